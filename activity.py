@@ -0,0 +1,161 @@
+import hashlib
+import math
+import zlib
+from array import array
+from datetime import date, datetime, timedelta, time as dtime
+import click
+from flask import Blueprint
+from sqlalchemy import delete, select
+from database import db
+from models import DailyDistinctSketch
+from archive import borrow_history
+from sketches import BufferedSketchTracker, rebuild_sketch_rows
+
+# 创建activity蓝图(只提供命令行)
+activity_bp = Blueprint('activity', __name__)
+
+# HyperLogLog精度：2^14个寄存器，标准误差约1.04/sqrt(16384)=0.8%
+HLL_PRECISION = 14
+HLL_REGISTERS = 1 << HLL_PRECISION
+# 默认合并写入数据库的间隔(秒)，可通过配置项ACTIVITY_FLUSH_SECONDS覆盖
+DEFAULT_FLUSH_SECONDS = 60
+# 计数对象
+DISTINCT_KINDS = ['user', 'book']
+
+_HASH_BITS = 64 - HLL_PRECISION
+_INVERSE_POWERS = [2.0 ** -rank for rank in range(_HASH_BITS + 2)]
+
+
+class HyperLogLog:
+    # HyperLogLog去重计数：每个元素哈希后落到一个寄存器，寄存器保存见过的最大前导零数+1
+    # 合并为逐个寄存器取最大值，与合并顺序、重复合并无关
+    def __init__(self, registers=None):
+        self.registers = registers if registers is not None else bytearray(HLL_REGISTERS)
+
+    def add(self, value):
+        hashed = int.from_bytes(hashlib.blake2b(str(value).encode(), digest_size=8).digest(), 'big')
+        index = hashed >> _HASH_BITS
+        rank = _HASH_BITS - (hashed & ((1 << _HASH_BITS) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def merge_encoded(self, payload):
+        # 直接合并编码后的寄存器，稀疏编码只访问非零寄存器
+        if payload[:1] == b'S':
+            data = zlib.decompress(payload[1:])
+            indexes = array('H')
+            indexes.frombytes(data[:len(data) * 2 // 3])
+            ranks = data[len(data) * 2 // 3:]
+            registers = self.registers
+            for index, rank in zip(indexes, ranks):
+                if rank > registers[index]:
+                    registers[index] = rank
+        else:
+            self.merge(HyperLogLog(bytearray(zlib.decompress(payload[1:]))))
+
+    def estimate(self):
+        m = HLL_REGISTERS
+        alpha = 0.7213 / (1 + 1.079 / m)
+        zeros = self.registers.count(0)
+        raw = alpha * m * m / sum(_INVERSE_POWERS[rank] for rank in self.registers)
+        # 基数较小时用线性计数，误差更小
+        if raw <= 2.5 * m and zeros:
+            return round(m * math.log(m / zeros))
+        return round(raw)
+
+    def encode(self):
+        # 非零寄存器较少时按(下标, 值)稀疏编码，否则整体压缩
+        nonzero = [(index, rank) for index, rank in enumerate(self.registers) if rank]
+        if len(nonzero) * 3 < HLL_REGISTERS:
+            indexes = array('H', [index for index, rank in nonzero])
+            return b'S' + zlib.compress(indexes.tobytes() + bytes(rank for index, rank in nonzero))
+        return b'D' + zlib.compress(bytes(self.registers))
+
+
+def _activity_entries(events):
+    # 每次借阅计入当天的借阅用户和被借图书
+    return [((day, kind), value) for day, user_id, book_id in events
+            for kind, value in (('user', user_id), ('book', book_id))]
+
+
+def _merge_registers(first, second):
+    first.merge(second)
+    return first
+
+
+def _merge_into_row(key, sketch):
+    # 锁定当天的寄存器行后合并写回(取最大值，重复写入不影响结果；不提交事务)
+    day, kind = key
+    row = db.session.query(DailyDistinctSketch).filter_by(
+        day=day, kind=kind).with_for_update().first()
+    if row is None:
+        db.session.add(DailyDistinctSketch(day=day, kind=kind, registers=sketch.encode()))
+    else:
+        sketch.merge_encoded(row.registers)
+        row.registers = sketch.encode()
+
+
+# 进程内的当天增量寄存器
+tracker = BufferedSketchTracker(
+    'activity', 'ACTIVITY_FLUSH_SECONDS', DEFAULT_FLUSH_SECONDS,
+    entries=_activity_entries,
+    new_sketch=HyperLogLog,
+    merge=_merge_registers,
+    upsert_row=_merge_into_row)
+
+# 借阅时记录(暂存在会话中，提交成功后计入寄存器，回滚时丢弃)
+
+
+def track_activity(user_id, book_id, when):
+    tracker.record((when.date(), user_id, book_id))
+
+# 估算[start, end]日期范围内(含两端)的借阅用户数和被借图书数：每天一行寄存器，按天合并
+
+
+def distinct_counts(start, end):
+    sketches = {kind: HyperLogLog() for kind in DISTINCT_KINDS}
+    rows = db.session.query(DailyDistinctSketch.kind, DailyDistinctSketch.registers).filter(
+        DailyDistinctSketch.day >= start,
+        DailyDistinctSketch.day <= end
+    ).all()
+    for kind, registers in rows:
+        sketches[kind].merge_encoded(registers)
+
+    def merge_pending(pending):
+        # 把本进程尚未写入的增量合并进查询结果
+        for (day, kind), sketch in pending.items():
+            if start <= day <= end:
+                sketches[kind].merge(sketch)
+    tracker.read_pending(merge_pending)
+    return {kind: sketch.estimate() for kind, sketch in sketches.items()}
+
+# 按借阅记录(在线表+归档表)重建[start, end]日期范围内(含两端)的寄存器：一次流式读取，按天累计后写入
+
+
+def rebuild_sketches(start, end):
+    history = borrow_history()
+    sketches = rebuild_sketch_rows(
+        select(history.c.borrow_time, history.c.user_id, history.c.book_id).where(
+            history.c.deleted_at == None,
+            history.c.borrow_time >= datetime.combine(start, dtime.min),
+            history.c.borrow_time < datetime.combine(end + timedelta(days=1), dtime.min)),
+        lambda row: _activity_entries([(row.borrow_time.date(), row.user_id, row.book_id)]),
+        new_sketch=HyperLogLog,
+        clear=delete(DailyDistinctSketch).where(
+            DailyDistinctSketch.day >= start, DailyDistinctSketch.day <= end),
+        to_row=lambda key, sketch: DailyDistinctSketch(day=key[0], kind=key[1], registers=sketch.encode()))
+    return len({day for day, kind in sketches})
+
+# 命令行：按借阅记录重建每日去重计数寄存器(首次上线回填)
+
+
+@activity_bp.cli.command('rebuild')
+@click.option('--from', 'start', type=click.DateTime(formats=['%Y-%m-%d']), required=True, help='起始日期(含)')
+@click.option('--to', 'end', type=click.DateTime(formats=['%Y-%m-%d']), help='结束日期(含)，默认今天')
+def rebuild_command(start, end):
+    """按借阅记录重建每日借阅用户/被借图书的去重计数寄存器"""
+    days = rebuild_sketches(start.date(), end.date() if end else date.today())
+    click.echo(f'已重建 {days} 天有借阅的去重计数寄存器')
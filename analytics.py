@@ -0,0 +1,416 @@
+import threading
+import time
+from datetime import datetime, timedelta
+import click
+try:
+    import numpy as np
+except ImportError:
+    np = None  # 未安装NumPy时分析接口改用等价SQL计算，其余功能不受影响
+from flask import Blueprint, jsonify, request, current_app
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from sqlalchemy import and_, case, extract, func, or_, select
+from database import db
+from models import Book, Borrow, User
+from archive import borrow_history
+from sql_funcs import days_between
+
+# 创建analytics蓝图
+analytics_bp = Blueprint('analytics', __name__)
+
+# 默认两次增量刷新的最小间隔(秒)，可通过配置项ANALYTICS_REFRESH_SECONDS覆盖
+DEFAULT_REFRESH_SECONDS = 10
+# 增量刷新时按updated_at回看的秒数(覆盖提交较晚的事务)，按id覆盖写入，重复读取不影响结果
+REFRESH_OVERLAP_SECONDS = 60
+# 流式读取时每批的行数
+LOAD_BATCH_SIZE = 10000
+
+# 各表加载的列及类型：flag为该列是否非空(软删除标记)，category为字典编码(int32编号)
+BORROW_COLUMNS = {'id': 'int32', 'user_id': 'int32', 'book_id': 'int32', 'borrow_time': 'datetime64[us]',
+                  'return_time': 'datetime64[us]', 'due_at': 'datetime64[us]', 'status': 'int8',
+                  'deleted_at': 'flag'}
+BOOK_COLUMNS = {'id': 'int32', 'category': 'category', 'deleted_at': 'flag'}
+USER_COLUMNS = {'id': 'int32', 'created_at': 'datetime64[us]', 'deleted_at': 'flag'}
+
+# 1970年1月之前的月数(与datetime64[M]的编号对齐)
+_EPOCH_MONTHS = 1970 * 12
+
+
+class ColumnTable:
+    # 一张表的列存副本：每列一个按id排序的NumPy数组
+    # 刷新时生成新数组后整体替换，正在计算的请求持有的旧数组不受影响
+    def __init__(self, model, columns, source=None):
+        self.model = model
+        self.columns = columns
+        self.source = source  # 首次全量加载的数据源，默认为模型对应的表
+        self.arrays = None
+        self.dictionary = []  # 字典编码：编号 -> 取值
+        self._codes = {}
+        self.max_id = 0
+        self.watermark = None
+
+    def _encode(self, value):
+        code = self._codes.get(value)
+        if code is None:
+            code = self._codes[value] = len(self.dictionary)
+            self.dictionary.append(value)
+        return code
+
+    def _convert(self, rows):
+        values = list(zip(*rows)) if rows else [()] * len(self.columns)
+        arrays = {}
+        for (name, dtype), column in zip(self.columns.items(), values):
+            if dtype == 'flag':
+                arrays[name] = np.array([value is not None for value in column], dtype=bool)
+            elif dtype == 'category':
+                arrays[name] = np.array([self._encode(value) for value in column], dtype=np.int32)
+            else:
+                arrays[name] = np.array(column, dtype=dtype)
+        return arrays
+
+    def refresh(self):
+        # 首次全量加载；之后只读取id大于上次最大id或updated_at不早于上次水位的行，按id覆盖或追加
+        table = self.model.__table__
+        if self.arrays is None:
+            source = self.source() if self.source else table
+            stmt = select(*[source.c[name] for name in self.columns])
+        else:
+            changed = table.c.id > self.max_id
+            if self.watermark is not None:
+                changed = or_(changed, table.c.updated_at >= self.watermark -
+                              timedelta(seconds=REFRESH_OVERLAP_SECONDS))
+            stmt = select(*[table.c[name] for name in self.columns]).where(changed).order_by(table.c.id)
+
+        chunks = []
+        # 水位和数据在同一连接上读取，水位之后提交的修改下次刷新时一定会读到
+        with db.engine.connect() as conn:
+            max_id, watermark = conn.execute(select(func.max(table.c.id), func.max(table.c.updated_at))).one()
+            result = conn.execution_options(yield_per=LOAD_BATCH_SIZE).execute(stmt)
+            for rows in result.partitions():
+                chunks.append(self._convert(rows))
+        rows = {name: np.concatenate([chunk[name] for chunk in chunks]) for name in self.columns} \
+            if chunks else self._convert([])
+
+        if self.arrays is None:
+            order = np.argsort(rows['id'], kind='stable')
+            self.arrays = {name: column[order] for name, column in rows.items()}
+        else:
+            self.arrays = self._merge(rows)
+        self.max_id = max(self.max_id, max_id or 0)
+        self.watermark = watermark or self.watermark
+        return len(rows['id'])
+
+    def _merge(self, rows):
+        current = self.arrays
+        ids = current['id']
+        if not len(rows['id']):
+            return current
+        pos, found = _lookup(ids, rows['id'])
+        new = ~found
+        merged = {}
+        for name, column in current.items():
+            # 拼接生成新数组，再覆盖已有的行
+            column = np.concatenate([column, rows[name][new]])
+            column[pos[found]] = rows[name][found]
+            merged[name] = column
+        # 新行的id一般都大于已有的最大id，否则重新排序
+        if new.any() and len(ids) and rows['id'][new][0] <= ids[-1]:
+            order = np.argsort(merged['id'], kind='stable')
+            merged = {name: column[order] for name, column in merged.items()}
+        return merged
+
+
+class ColumnStore:
+    # 借阅、图书、用户三张表的列存副本，按需增量刷新
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.books = ColumnTable(Book, BOOK_COLUMNS)
+        self.users = ColumnTable(User, USER_COLUMNS)
+        # 借阅记录首次加载在线表+归档表，之后归档只是搬移已加载的行，增量刷新只读在线表
+        self.borrows = ColumnTable(Borrow, BORROW_COLUMNS, borrow_history)
+        self._refreshed_at = 0
+
+    def refresh(self, force=False):
+        interval = current_app.config.get('ANALYTICS_REFRESH_SECONDS', DEFAULT_REFRESH_SECONDS)
+        with self._lock:
+            if not force and time.time() - self._refreshed_at < interval:
+                return None
+            counts = {table.model.__tablename__: table.refresh()
+                      for table in (self.books, self.users, self.borrows)}
+            self._refreshed_at = time.time()
+            return counts
+
+    def snapshot(self):
+        # 返回(借阅, 图书, 用户, 分类字典)，各表为列名 -> 数组
+        self.refresh()
+        with self._lock:
+            return self.borrows.arrays, self.books.arrays, self.users.arrays, tuple(self.books.dictionary)
+
+
+store = ColumnStore()
+
+
+def _lookup(ids, keys):
+    # keys在有序数组ids中的下标，以及是否存在
+    if not len(ids):
+        return np.zeros(len(keys), dtype=np.intp), np.zeros(len(keys), dtype=bool)
+    pos = np.minimum(np.searchsorted(ids, keys), len(ids) - 1)
+    return pos, ids[pos] == keys
+
+
+def _months(times):
+    # 距1970年1月的月数
+    return times.astype('datetime64[M]').astype(np.int64)
+
+# 按分类统计逾期率：已归还的按归还时间、借阅中的按当前时间判断是否逾期
+
+
+def overdue_rates(snapshot, now):
+    borrows, books, users, categories = snapshot
+    pos, found = _lookup(books['id'], borrows['book_id'])
+    live = found & ~borrows['deleted_at']
+    codes = books['category'][pos[live]]
+    due = borrows['due_at'][live]
+    overdue = np.where(borrows['status'][live] == 1,
+                       borrows['return_time'][live] > due,
+                       due < np.datetime64(now, 'us'))
+    totals = np.bincount(codes, minlength=len(categories))
+    overdue_counts = np.bincount(codes, weights=overdue, minlength=len(categories))
+    return _format_rates((categories[code], int(totals[code]), int(overdue_counts[code]))
+                         for code in np.flatnonzero(totals))
+
+
+def _format_rates(rows):
+    return [{
+        'category': category,
+        'borrows': total,
+        'overdue_borrows': overdue,
+        'overdue_rate': round(overdue / total, 4)
+    } for category, total, overdue in sorted(rows)]
+
+# 已归还借阅的时长分布(自然日数)：bins个宽width天的区间，最后一个区间不设上限
+
+
+def loan_days_histogram(snapshot, width, bins, category=None):
+    borrows, books, users, categories = snapshot
+    returned = (borrows['status'] == 1) & ~borrows['deleted_at']
+    if category is not None:
+        pos, found = _lookup(books['id'], borrows['book_id'])
+        code = categories.index(category) if category in categories else -1
+        returned &= found & (books['category'][pos] == code)
+    days = (borrows['return_time'][returned].astype('datetime64[D]') -
+            borrows['borrow_time'][returned].astype('datetime64[D]')).astype(np.int64)
+    counts = np.bincount(np.clip(days // width, 0, bins - 1), minlength=bins)
+    return _format_histogram(counts, width, int(days.sum()))
+
+
+def _format_histogram(counts, width, total_days):
+    total = int(sum(counts))
+    return {
+        'width': width,
+        'bins': [{
+            'from_days': index * width,
+            'to_days': (index + 1) * width if index < len(counts) - 1 else None,
+            'count': int(count)
+        } for index, count in enumerate(counts)],
+        'total': total,
+        'avg_days': round(total_days / total, 2) if total else 0
+    }
+
+# 按注册月份分组的借阅活跃度：每组用户在注册后第0~months-1个月内有借阅的人数
+
+
+def cohort_activity(snapshot, months):
+    borrows, books, users, categories = snapshot
+    user_months = _months(users['created_at'])
+    cohorts, cohort_index = np.unique(user_months, return_inverse=True)
+    live_users = ~users['deleted_at']
+    sizes = np.bincount(cohort_index, weights=live_users, minlength=len(cohorts))
+
+    pos, found = _lookup(users['id'], borrows['user_id'])
+    live = found & ~borrows['deleted_at']
+    live[live] = live_users[pos[live]]
+    pos = pos[live]
+    offsets = _months(borrows['borrow_time'][live]) - user_months[pos]
+    keep = (offsets >= 0) & (offsets < months)
+    # 同一用户同一个月只计一次
+    pairs = np.unique(pos[keep].astype(np.int64) * months + offsets[keep])
+    active = np.bincount(cohort_index[pairs // months] * months + pairs % months,
+                         minlength=len(cohorts) * months).reshape(len(cohorts), months)
+    return _format_cohorts(
+        (int(month), int(sizes[index]), active[index].tolist())
+        for index, month in enumerate(cohorts) if sizes[index])
+
+
+def _cohort_label(month):
+    # 自1970-01起的月序号转为YYYY-MM
+    year, index = divmod(int(month) + _EPOCH_MONTHS, 12)
+    return f'{year:04d}-{index + 1:02d}'
+
+
+def _format_cohorts(rows):
+    return [{
+        'cohort': _cohort_label(month),
+        'users': size,
+        'active_users': active
+    } for month, size, active in sorted(rows)]
+
+# 以下为等价的SQL实现，供基准测试对比耗时和校验结果
+
+
+def _sql_overdue_rates(now):
+    history = borrow_history()
+    overdue = case(
+        (and_(history.c.status == 1, history.c.return_time > history.c.due_at), 1),
+        (and_(history.c.status == 0, history.c.due_at < now), 1),
+        else_=0)
+    rows = db.session.query(
+        Book.category, func.count(history.c.id), func.sum(overdue)
+    ).select_from(history).join(Book, Book.id == history.c.book_id).filter(
+        history.c.deleted_at == None
+    ).group_by(Book.category).all()
+    return _format_rates((category, total, int(overdue)) for category, total, overdue in rows)
+
+
+def _sql_loan_days_histogram(width, bins, category=None):
+    history = borrow_history(status=1)
+    days = days_between(history.c.return_time, history.c.borrow_time)
+    query = db.session.query(days, func.count()).select_from(history).filter(history.c.deleted_at == None)
+    if category is not None:
+        query = query.join(Book, Book.id == history.c.book_id).filter(Book.category == category)
+    counts = [0] * bins
+    total_days = 0
+    for day, count in query.group_by(days).all():
+        counts[min(max(day // width, 0), bins - 1)] += count
+        total_days += day * count
+    return _format_histogram(counts, width, total_days)
+
+
+def _sql_cohort_activity(months):
+    history = borrow_history()
+    user_month = extract('year', User.created_at) * 12 + extract('month', User.created_at) - 1 - _EPOCH_MONTHS
+    borrow_month = (extract('year', history.c.borrow_time) * 12 +
+                    extract('month', history.c.borrow_time) - 1 - _EPOCH_MONTHS)
+    sizes = dict(db.session.query(user_month, func.count(User.id)).filter(
+        User.deleted_at == None).group_by(user_month).all())
+    active = {month: [0] * months for month in sizes}
+    rows = db.session.query(
+        user_month, borrow_month - user_month, func.count(func.distinct(User.id))
+    ).select_from(history).join(User, User.id == history.c.user_id).filter(
+        history.c.deleted_at == None,
+        User.deleted_at == None
+    ).group_by(user_month, borrow_month - user_month).all()
+    for month, offset, count in rows:
+        if 0 <= offset < months:
+            active[month][offset] = count
+    return _format_cohorts((month, size, active[month]) for month, size in sizes.items())
+
+# 管理员获取各分类的逾期率
+
+
+@analytics_bp.route('/overdue-rates', methods=['GET'])
+@jwt_required()
+def get_overdue_rates():
+    current_user_id = get_jwt_identity()
+
+    # 检查是否是管理员
+    current_user = User.query.get(current_user_id)
+    if not current_user or current_user.privilege != 1:
+        return jsonify({'message': '权限不足'}), 403
+
+    try:
+        now = datetime.now()
+        rates = _sql_overdue_rates(now) if np is None else overdue_rates(store.snapshot(), now)
+        return jsonify({'categories': rates}), 200
+    except Exception as e:
+        return jsonify({'message': '获取逾期率失败', 'error': str(e)}), 500
+
+# 管理员获取借阅时长分布，可按分类筛选
+
+
+@analytics_bp.route('/loan-days', methods=['GET'])
+@jwt_required()
+def get_loan_days():
+    current_user_id = get_jwt_identity()
+
+    # 检查是否是管理员
+    current_user = User.query.get(current_user_id)
+    if not current_user or current_user.privilege != 1:
+        return jsonify({'message': '权限不足'}), 403
+
+    width = request.args.get('width', 7, type=int)
+    bins = request.args.get('bins', 10, type=int)
+    if not 1 <= width <= 365 or not 1 <= bins <= 100:
+        return jsonify({'message': '区间宽度应为1~365天，区间数应为1~100'}), 400
+
+    try:
+        category = request.args.get('category')
+        if np is None:
+            return jsonify(_sql_loan_days_histogram(width, bins, category)), 200
+        return jsonify(loan_days_histogram(store.snapshot(), width, bins, category)), 200
+    except Exception as e:
+        return jsonify({'message': '获取借阅时长分布失败', 'error': str(e)}), 500
+
+# 管理员获取按注册月份分组的借阅活跃度
+
+
+@analytics_bp.route('/cohorts', methods=['GET'])
+@jwt_required()
+def get_cohorts():
+    current_user_id = get_jwt_identity()
+
+    # 检查是否是管理员
+    current_user = User.query.get(current_user_id)
+    if not current_user or current_user.privilege != 1:
+        return jsonify({'message': '权限不足'}), 403
+
+    months = request.args.get('months', 12, type=int)
+    if not 1 <= months <= 36:
+        return jsonify({'message': '月数应为1~36'}), 400
+
+    try:
+        cohorts = _sql_cohort_activity(months) if np is None else cohort_activity(store.snapshot(), months)
+        return jsonify({'months': months, 'cohorts': cohorts}), 200
+    except Exception as e:
+        return jsonify({'message': '获取注册月份活跃度失败', 'error': str(e)}), 500
+
+
+def _measure(compute, repeat):
+    # 重复执行取耗时中位数
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = compute()
+        timings.append(time.perf_counter() - started)
+    return sorted(timings)[len(timings) // 2], result
+
+# 命令行：对比列存分析与等价SQL的耗时，并校验两者结果一致
+
+
+@analytics_bp.cli.command('benchmark')
+@click.option('--repeat', default=5, show_default=True, help='每项重复次数(取中位数)')
+def benchmark_command(repeat):
+    """对比NumPy列存分析与等价SQL的耗时"""
+    if np is None:
+        click.echo('未安装NumPy，请先执行 pip install numpy', err=True)
+        return
+    bench_store = ColumnStore()
+    started = time.perf_counter()
+    counts = bench_store.refresh(force=True)
+    click.echo(f'全量加载 {counts}: {time.perf_counter() - started:.3f}s')
+    refresh_time, counts = _measure(lambda: bench_store.refresh(force=True), repeat)
+    click.echo(f'增量刷新 {counts}: {refresh_time * 1000:.1f}ms')
+
+    snapshot = bench_store.snapshot()
+    now = datetime.now()
+    cases = [
+        ('分类逾期率', lambda: overdue_rates(snapshot, now), lambda: _sql_overdue_rates(now)),
+        ('借阅时长分布', lambda: loan_days_histogram(snapshot, 7, 10),
+         lambda: _sql_loan_days_histogram(7, 10)),
+        ('注册月份活跃度', lambda: cohort_activity(snapshot, 12), lambda: _sql_cohort_activity(12)),
+    ]
+    for name, columnar, sql in cases:
+        columnar_time, columnar_result = _measure(columnar, repeat)
+        sql_time, sql_result = _measure(sql, repeat)
+        click.echo(f'{name}: NumPy {columnar_time * 1000:.1f}ms, SQL {sql_time * 1000:.1f}ms, '
+                   f'{sql_time / max(columnar_time, 1e-9):.1f}倍, '
+                   f'结果{"一致" if columnar_result == sql_result else "不一致"}')
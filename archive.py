@@ -0,0 +1,202 @@
+import time
+from datetime import datetime, timedelta
+import click
+from flask import Blueprint, jsonify, request, current_app
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from sqlalchemy import and_, case, delete, func, insert, literal, select, union_all
+from database import db
+from models import Borrow, BorrowArchive, User
+
+# 创建archive蓝图
+archive_bp = Blueprint('archive', __name__)
+
+# 默认保留期(天)：归还超过该天数的记录迁入归档表
+DEFAULT_RETENTION_DAYS = 365
+# 每个事务迁移的记录数
+ARCHIVE_BATCH_SIZE = 1000
+# 接口触发时单次最多执行的批数(避免请求超时，大量积压用命令行处理)
+API_MAX_BATCHES = 10
+# 归档时原样复制的列
+ARCHIVE_COLUMNS = ['id', 'user_id', 'book_id', 'borrow_time', 'return_time', 'due_at',
+                   'status', 'created_at', 'updated_at', 'deleted_at']
+# 历史查询(在线表+归档表)统一暴露的列
+HISTORY_COLUMNS = ['id', 'user_id', 'book_id', 'borrow_time', 'return_time', 'due_at',
+                   'status', 'deleted_at']
+
+
+# 借阅历史查询：在线表与归档表的UNION ALL子查询，过滤条件分别下推到两张表
+# 只查借阅中(status=0)的记录时不访问归档表；user_ids/book_ids用于批量报表按一批ID过滤
+
+
+def borrow_history(user_id=None, book_id=None, status=None, user_ids=None, book_ids=None):
+    parts = []
+    for model in (Borrow, BorrowArchive):
+        if model is BorrowArchive and status == 0:
+            continue  # 归档表只有已归还记录
+        stmt = select(*[getattr(model, c).label(c) for c in HISTORY_COLUMNS])
+        if user_id is not None:
+            stmt = stmt.where(model.user_id == user_id)
+        if book_id is not None:
+            stmt = stmt.where(model.book_id == book_id)
+        if user_ids is not None:
+            stmt = stmt.where(model.user_id.in_(user_ids))
+        if book_ids is not None:
+            stmt = stmt.where(model.book_id.in_(book_ids))
+        if status is not None:
+            stmt = stmt.where(model.status == status)
+        parts.append(stmt)
+
+    if len(parts) == 1:
+        return parts[0].subquery('borrow_history')
+    return union_all(*parts).subquery('borrow_history')
+
+
+def retention_cutoff(retention_days=None):
+    if retention_days is None:
+        retention_days = current_app.config.get(
+            'ARCHIVE_RETENTION_DAYS', DEFAULT_RETENTION_DAYS)
+    return datetime.now() - timedelta(days=retention_days)
+
+# 分批把过期的已归还记录迁入归档表，每批一个事务(先插入归档表再删除在线记录)
+
+
+def archive_borrows(retention_days=None, batch_size=ARCHIVE_BATCH_SIZE, max_batches=None, pause=0):
+    cutoff = retention_cutoff(retention_days)
+    # 保留ID最大的一条记录：MySQL 8.0之前重启后自增值按max(id)+1重算，
+    # 若最新记录被归档，新借阅可能复用归档表中已有的ID
+    max_id = db.session.query(func.max(Borrow.id)).scalar()
+    archived = batches = 0
+    last_id = 0
+
+    while max_id and (max_batches is None or batches < max_batches):
+        # 按ID游标推进，不会重复扫描未到期的已归还记录
+        ids = [row.id for row in db.session.query(Borrow.id).filter(
+            Borrow.status == 1,  # 已归还
+            Borrow.return_time < cutoff,
+            Borrow.id > last_id,
+            Borrow.id < max_id
+        ).order_by(Borrow.id).limit(batch_size).all()]
+        if not ids:
+            break
+
+        try:
+            db.session.execute(insert(BorrowArchive).from_select(
+                ARCHIVE_COLUMNS + ['archived_at'],
+                select(*[getattr(Borrow, c) for c in ARCHIVE_COLUMNS],
+                       literal(datetime.now(), db.DateTime))
+                .where(Borrow.id.in_(ids))
+            ))
+            db.session.execute(delete(Borrow).where(
+                Borrow.id.in_(ids), Borrow.status == 1))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+        archived += len(ids)
+        batches += 1
+        last_id = ids[-1]
+        if pause:
+            time.sleep(pause)  # 批次间让出资源，减轻主从延迟
+
+    return archived, batches
+
+
+def archive_status(retention_days=None):
+    cutoff = retention_cutoff(retention_days)
+    # MySQL不支持聚合FILTER子句，用SUM(CASE)一次统计
+    live_total, live_returned, eligible = db.session.query(
+        func.count(Borrow.id),
+        func.coalesce(func.sum(case((Borrow.status == 1, 1), else_=0)), 0),
+        func.coalesce(func.sum(case(
+            (and_(Borrow.status == 1, Borrow.return_time < cutoff), 1), else_=0)), 0)
+    ).one()
+    archived_total, last_archived_at = db.session.query(
+        func.count(BorrowArchive.id), func.max(BorrowArchive.archived_at)
+    ).one()
+    return {
+        'cutoff': cutoff.isoformat(),
+        'live_borrows': live_total,
+        'live_returned_borrows': int(live_returned),
+        'eligible_borrows': int(eligible),
+        'archived_borrows': archived_total,
+        'last_archived_at': last_archived_at.isoformat() if last_archived_at else None
+    }
+
+# 管理员查看归档状态
+
+
+@archive_bp.route('/status', methods=['GET'])
+@jwt_required()
+def get_archive_status():
+    current_user_id = get_jwt_identity()
+    current_user = User.query.get(current_user_id)
+
+    # 检查是否是管理员
+    if not current_user or current_user.privilege != 1:
+        return jsonify({'message': '权限不足'}), 403
+
+    retention_days = request.args.get('retention_days', type=int)
+    if retention_days is not None and retention_days < 0:
+        return jsonify({'message': '保留期必须是非负整数'}), 400
+
+    try:
+        return jsonify(archive_status(retention_days)), 200
+    except Exception as e:
+        return jsonify({'message': '获取归档状态失败', 'error': str(e)}), 500
+
+# 管理员触发归档(单次最多执行API_MAX_BATCHES批)
+
+
+@archive_bp.route('/run', methods=['POST'])
+@jwt_required()
+def run_archive():
+    current_user_id = get_jwt_identity()
+    current_user = User.query.get(current_user_id)
+
+    # 检查是否是管理员
+    if not current_user or current_user.privilege != 1:
+        return jsonify({'message': '权限不足'}), 403
+
+    data = request.get_json(silent=True) or {}
+    retention_days = data.get('retention_days')
+    batch_size = data.get('batch_size', ARCHIVE_BATCH_SIZE)
+    if retention_days is not None and (not isinstance(retention_days, int) or retention_days < 0):
+        return jsonify({'message': '保留期必须是非负整数'}), 400
+    if not isinstance(batch_size, int) or not 0 < batch_size <= 10000:
+        return jsonify({'message': '批大小必须在1-10000之间'}), 400
+
+    try:
+        archived, batches = archive_borrows(
+            retention_days, batch_size, max_batches=API_MAX_BATCHES)
+        return jsonify({
+            'message': '归档完成' if batches < API_MAX_BATCHES else '已达单次批数上限，剩余记录请再次执行',
+            'archived_borrows': archived,
+            'batches': batches
+        }), 200
+    except Exception as e:
+        return jsonify({'message': '归档失败', 'error': str(e)}), 500
+
+# 命令行：归档过期的已归还记录(可定时执行)
+
+
+@archive_bp.cli.command('run')
+@click.option('--retention-days', type=int, default=None, help='保留期(天)，默认读取ARCHIVE_RETENTION_DAYS')
+@click.option('--batch-size', default=ARCHIVE_BATCH_SIZE, show_default=True, help='每个事务迁移的记录数')
+@click.option('--max-batches', type=int, default=None, help='最多执行的批数，默认直到处理完')
+@click.option('--pause', default=0.0, show_default=True, help='批次间暂停秒数')
+def run_command(retention_days, batch_size, max_batches, pause):
+    """把超过保留期的已归还借阅记录分批迁入归档表"""
+    archived, batches = archive_borrows(
+        retention_days, batch_size, max_batches, pause)
+    click.echo(f'归档借阅记录 {archived} 条，共 {batches} 批')
+
+# 命令行：查看归档状态
+
+
+@archive_bp.cli.command('status')
+@click.option('--retention-days', type=int, default=None, help='保留期(天)，默认读取ARCHIVE_RETENTION_DAYS')
+def status_command(retention_days):
+    """输出在线表/归档表的记录数和待归档数"""
+    for key, value in archive_status(retention_days).items():
+        click.echo(f'{key}: {value}')
@@ -3,10 +3,13 @@ from flask import Blueprint, jsonify, request, current_app
 from flask_jwt_extended import (create_access_token, create_refresh_token,
                                 jwt_required, get_jwt_identity, get_jwt)
 from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy.orm.exc import StaleDataError
 from datetime import timedelta
 from database import db
 from models import User, TokenBlacklist
-from practical_funcs import is_valid_user_data, remove_html_tags
+from practical_funcs import (is_valid_user_data, remove_html_tags,
+                             version_etag, if_match_failed, is_valid_loan_period,
+                             is_valid_borrow_limit)
 
 # 创建auth蓝图
 auth_bp = Blueprint('auth', __name__)
@@ -188,7 +191,7 @@ def get_profile():
         'introduction': user.introduction,
     }
 
-    return jsonify(user_data), 200
+    return jsonify(user_data), 200, version_etag(user.version)
 
 # 修改用户信息
 
@@ -204,6 +207,10 @@ def update_profile():
     if not user:
         return jsonify({'message': '用户不存在或已被修改或删除'}), 404
 
+    # 乐观锁：If-Match与当前版本不一致，说明信息已被修改
+    if if_match_failed(user.version):
+        return jsonify({'message': '用户信息已被修改，请刷新后重试'}), 412
+
     if not data:
         return jsonify({'message': '请提供要更新的信息'}), 400
     # 对输入移除HTML标签
@@ -222,7 +229,11 @@ def update_profile():
 
     try:
         db.session.commit()
-        return jsonify({'message': '信息更新成功'}), 200
+        return jsonify({'message': '信息更新成功'}), 200, version_etag(user.version)
+    except StaleDataError:
+        # 读取后到提交前被修改，版本号校验失败
+        db.session.rollback()
+        return jsonify({'message': '用户信息已被修改，请刷新后重试'}), 412
     except Exception as e:
         db.session.rollback()
         return jsonify({'message': '信息更新失败', 'error': str(e)}), 500
@@ -347,6 +358,86 @@ def update_user_privilege(user_id):
         db.session.rollback()
         return jsonify({'message': '用户权限修改失败', 'error': str(e)}), 500
 
+# 管理员设置用户借阅期限(为空表示使用系统默认值)
+
+
+@auth_bp.route('/users/<int:user_id>/loan_period', methods=['PUT'])
+@jwt_required()
+def update_user_loan_period(user_id):
+    current_user_id = get_jwt_identity()
+    current_user = User.query.get(current_user_id)
+
+    # 检查是否是管理员
+    if not current_user or current_user.privilege != 1:
+        return jsonify({'message': '权限不足'}), 403
+
+    # 检查目标用户是否存在
+    target_user = User.query.filter_by(id=user_id, deleted_at=None).first()
+    if not target_user:
+        return jsonify({'message': '目标用户不存在'}), 404
+
+    data = request.get_json()
+    if not data or 'loan_period' not in data:
+        return jsonify({'message': '请提供借阅期限'}), 400
+
+    if not is_valid_loan_period(data['loan_period']):
+        return jsonify({'message': '借阅期限必须是正整数(天)'}), 400
+
+    try:
+        target_user.loan_period = data['loan_period']
+        target_user.updated_at = datetime.now()
+        db.session.commit()
+
+        return jsonify({
+            'message': '用户借阅期限修改成功',
+            'user_id': target_user.id,
+            'loan_period': target_user.loan_period
+        }), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': '用户借阅期限修改失败', 'error': str(e)}), 500
+
+# 管理员设置用户同时在借上限(为空表示使用系统默认值)
+
+
+@auth_bp.route('/users/<int:user_id>/borrow_limit', methods=['PUT'])
+@jwt_required()
+def update_user_borrow_limit(user_id):
+    current_user_id = get_jwt_identity()
+    current_user = User.query.get(current_user_id)
+
+    # 检查是否是管理员
+    if not current_user or current_user.privilege != 1:
+        return jsonify({'message': '权限不足'}), 403
+
+    # 检查目标用户是否存在
+    target_user = User.query.filter_by(id=user_id, deleted_at=None).first()
+    if not target_user:
+        return jsonify({'message': '目标用户不存在'}), 404
+
+    data = request.get_json()
+    if not data or 'borrow_limit' not in data:
+        return jsonify({'message': '请提供借阅上限'}), 400
+
+    if not is_valid_borrow_limit(data['borrow_limit']):
+        return jsonify({'message': '借阅上限必须是1-100之间的整数'}), 400
+
+    try:
+        # 调低上限不影响已借出的图书，在借数量降到上限以下后才能继续借阅
+        target_user.borrow_limit = data['borrow_limit']
+        target_user.updated_at = datetime.now()
+        db.session.commit()
+
+        return jsonify({
+            'message': '用户借阅上限修改成功',
+            'user_id': target_user.id,
+            'borrow_limit': target_user.borrow_limit,
+            'active_borrows': target_user.active_borrows
+        }), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': '用户借阅上限修改失败', 'error': str(e)}), 500
+
 # 管理员软删除普通用户
 
 
@@ -1,13 +1,23 @@
 from datetime import datetime
 from flask import Blueprint, jsonify, request
 from flask_jwt_extended import jwt_required, get_jwt_identity
+from sqlalchemy.orm.exc import StaleDataError
 from database import db
 from models import Book, User
-from practical_funcs import remove_html_tags
+from practical_funcs import (remove_html_tags, version_etag, if_match_failed,
+                             is_valid_loan_period)
+from inventory import book_stock, stock_totals, set_stock
+from cache import SingleFlightCache, get_catalog_version, bump_catalog_version
+from rollups import move_category_rollups
+from durations import merge_category_digests
+from holds import fill_holds
 
 # 创建books蓝图
 books_bp = Blueprint('books', __name__)
 
+# 搜索结果缓存：只缓存命中的图书ID和总数，库存等字段每次按主键读取最新值
+search_cache = SingleFlightCache(maxsize=2048)
+
 
 # 添加图书
 @books_bp.route('/', methods=['POST'])
@@ -41,6 +51,9 @@ def add_book():
     if not isinstance(data['stock'], int) or data['stock'] < 0:
         return jsonify({'message': '库存必须是非负整数'}), 400
 
+    if not is_valid_loan_period(data.get('loan_period')):
+        return jsonify({'message': '借阅期限必须是正整数(天)'}), 400
+
     # 检查ISBN是否已存在
     if Book.query.filter_by(ISBN=data['ISBN']).first():
         return jsonify({'message': '该ISBN的图书已存在'}), 400
@@ -54,9 +67,11 @@ def add_book():
     new_book.introduction = data.get('introduction', '')
     new_book.ISBN = data['ISBN']
     new_book.stock = data['stock']
+    new_book.loan_period = data.get('loan_period')
 
     try:
         db.session.add(new_book)
+        bump_catalog_version()
         db.session.commit()
         return jsonify({'message': '图书添加成功', 'book_id': new_book.id}), 201
     except Exception as e:
@@ -77,6 +92,7 @@ def get_books():
     books = Book.query.filter_by(deleted_at=None).paginate(
         page=page, per_page=per_page, error_out=False)
 
+    stocks = stock_totals(books.items)
     book_list = []
     for book in books.items:
         book_list.append({
@@ -87,7 +103,7 @@ def get_books():
             'category': book.category,
             'introduction': book.introduction,
             'ISBN': book.ISBN,
-            'stock': book.stock,
+            'stock': stocks[book.id],
             'created_at': book.created_at.isoformat() if book.created_at else None,
             'updated_at': book.updated_at.isoformat() if book.updated_at else None
         })
@@ -118,12 +134,13 @@ def get_book(book_id):
         'category': book.category,
         'introduction': book.introduction,
         'ISBN': book.ISBN,
-        'stock': book.stock,
+        'stock': book_stock(book),
+        'loan_period': book.loan_period,
         'created_at': book.created_at.isoformat() if book.created_at else None,
         'updated_at': book.updated_at.isoformat() if book.updated_at else None
     }
 
-    return jsonify(book_data), 200
+    return jsonify(book_data), 200, version_etag(book.version)
 
 # 更新图书信息
 
@@ -142,6 +159,10 @@ def update_book(book_id):
     if not book:
         return jsonify({'message': '图书不存在或已被删除'}), 404
 
+    # 乐观锁：If-Match与当前版本不一致，说明图书已被他人修改
+    if if_match_failed(book.version):
+        return jsonify({'message': '图书信息已被他人修改，请刷新后重试'}), 412
+
     data = request.get_json()
     if not data:
         return jsonify({'message': '请提供要更新的图书信息'}), 400
@@ -150,6 +171,21 @@ def update_book(book_id):
     for key in data:
         data[key] = remove_html_tags(data[key])
 
+    # 先完成校验再修改，避免校验查询触发自动flush
+    if 'ISBN' in data:
+        # 检查新的ISBN是否已被其他图书使用
+        existing_book = Book.query.filter_by(ISBN=data['ISBN']).first()
+        if existing_book and existing_book.id != book_id:
+            return jsonify({'message': '该ISBN的图书已存在'}), 400
+    if 'stock' in data:
+        if not isinstance(data['stock'], int) or data['stock'] < 0:
+            return jsonify({'message': '库存必须是非负整数'}), 400
+        set_stock(book, data['stock'])
+    if 'loan_period' in data:
+        if not is_valid_loan_period(data['loan_period']):
+            return jsonify({'message': '借阅期限必须是正整数(天)'}), 400
+        book.loan_period = data['loan_period']
+
     # 更新图书信息
     if 'name' in data:
         book.name = data['name']
@@ -157,26 +193,29 @@ def update_book(book_id):
         book.author = data['author']
     if 'publisher' in data:
         book.publisher = data['publisher']
+    old_category = book.category
     if 'category' in data:
         book.category = data['category']
     if 'introduction' in data:
         book.introduction = data['introduction']
     if 'ISBN' in data:
-        # 检查新的ISBN是否已被其他图书使用
-        existing_book = Book.query.filter_by(ISBN=data['ISBN']).first()
-        if existing_book and existing_book.id != book_id:
-            return jsonify({'message': '该ISBN的图书已存在'}), 400
         book.ISBN = data['ISBN']
-    if 'stock' in data:
-        if not isinstance(data['stock'], int) or data['stock'] < 0:
-            return jsonify({'message': '库存必须是非负整数'}), 400
-        book.stock = data['stock']
 
     book.updated_at = datetime.now()
 
     try:
+        # 改分类时每日分类统计随图书移到新分类
+        move_category_rollups([book.id], old_category, book.category)
+        if 'stock' in data:
+            # 库存调高后分配给排队的预约
+            fill_holds(book, book.updated_at)
+        bump_catalog_version()
         db.session.commit()
-        return jsonify({'message': '图书信息更新成功'}), 200
+        return jsonify({'message': '图书信息更新成功'}), 200, version_etag(book.version)
+    except StaleDataError:
+        # 读取后到提交前被他人修改，版本号校验失败
+        db.session.rollback()
+        return jsonify({'message': '图书信息已被他人修改，请刷新后重试'}), 412
     except Exception as e:
         db.session.rollback()
         return jsonify({'message': '图书信息更新失败', 'error': str(e)}), 500
@@ -199,6 +238,7 @@ def delete_book(book_id):
         return jsonify({'message': '图书不存在或已被删除'}), 404
 
     try:
+        bump_catalog_version()
         book.soft_delete()
         return jsonify({'message': '图书删除成功'}), 200
     except Exception as e:
@@ -246,10 +286,28 @@ def search_books():
             'current_page': 1
         }), 200
 
-    books = query.paginate(page=page, per_page=per_page, error_out=False)
+    # 缓存键：规范化后的搜索参数 + 目录写版本号(图书增删改后旧缓存自然失效)
+    # MySQL默认排序规则不区分大小写，规范化前后的查询结果一致
+    cache_key = (get_catalog_version(), keyword.casefold(), author.casefold(),
+                 ISBN.casefold(), category.casefold(), page, per_page)
 
+    def run_search():
+        result = query.paginate(page=page, per_page=per_page, error_out=False)
+        return [book.id for book in result.items], result.total, result.pages, result.page
+
+    book_ids, total, pages, current_page = search_cache.get_or_compute(
+        cache_key, run_search)
+
+    # 按主键读取最新的图书信息，保持搜索结果的顺序
+    books = {}
+    if book_ids:
+        books = {book.id: book for book in Book.query.filter(
+            Book.id.in_(book_ids), Book.deleted_at == None).all()}
+    items = [books[book_id] for book_id in book_ids if book_id in books]
+
+    stocks = stock_totals(items)
     book_list = []
-    for book in books.items:
+    for book in items:
         book_list.append({
             'id': book.id,
             'name': book.name,
@@ -258,16 +316,31 @@ def search_books():
             'category': book.category,
             'introduction': book.introduction,
             'ISBN': book.ISBN,
-            'stock': book.stock
+            'stock': stocks[book.id]
         })
 
     return jsonify({
         'books': book_list,
-        'total': books.total,
-        'pages': books.pages,
-        'current_page': books.page
+        'total': total,
+        'pages': pages,
+        'current_page': current_page
     }), 200
 
+# 管理员查看搜索缓存统计
+
+
+@books_bp.route('/search/cache', methods=['GET'])
+@jwt_required()
+def get_search_cache_stats():
+    current_user_id = get_jwt_identity()
+    current_user = User.query.get(current_user_id)
+
+    # 检查是否是管理员
+    if not current_user or current_user.privilege != 1:
+        return jsonify({'message': '权限不足'}), 403
+
+    return jsonify(search_cache.stats()), 200
+
 # 图书分类管理
 
 # 获取所有图书分类
@@ -304,6 +377,7 @@ def get_books_by_category(category):
     books = Book.query.filter_by(category=category, deleted_at=None).paginate(
         page=page, per_page=per_page, error_out=False)
 
+    stocks = stock_totals(books.items)
     book_list = []
     for book in books.items:
         book_list.append({
@@ -314,7 +388,7 @@ def get_books_by_category(category):
             'category': book.category,
             'introduction': book.introduction,
             'ISBN': book.ISBN,
-            'stock': book.stock
+            'stock': stocks[book.id]
         })
 
     return jsonify({
@@ -350,11 +424,19 @@ def rename_category():
         return jsonify({'message': '旧分类不存在'}), 404
 
     try:
+        # 每日分类统计和借阅时长摘要随图书移到新分类(在同一事务内)
+        book_ids = [row.id for row in db.session.query(Book.id).filter_by(
+            category=old_category, deleted_at=None).all()]
+        move_category_rollups(book_ids, old_category, new_category)
+        merge_category_digests(old_category, new_category)
+
         # 更新所有使用该分类的图书
         Book.query.filter_by(category=old_category, deleted_at=None).update({
             'category': new_category,
-            'updated_at': datetime.now()
+            'updated_at': datetime.now(),
+            'version': Book.version + 1  # 批量更新不经过ORM版本控制，手动递增版本号
         })
+        bump_catalog_version()
         db.session.commit()
 
         return jsonify({'message': '分类重命名成功'}), 200
@@ -1,21 +1,124 @@
 from datetime import datetime, timedelta
-from flask import Blueprint, jsonify, request
+import click
+from flask import Blueprint, jsonify, request, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity
+from sqlalchemy import case, func, select, update
 from database import db
 from models import Borrow, Book, User
 from practical_funcs import remove_html_tags
+from inventory import take_stock, put_stock
+from archive import borrow_history
+from idempotency import idempotent
+from fines import overdue_days, settle_fine
+from holds import allocate_copy, claim_hold, close_waiting_hold
+from rollups import record_borrow, record_return
+from trending import track_borrow
+from activity import track_activity
+from durations import record_loan
 
 # 创建borrows蓝图
 borrows_bp = Blueprint('borrows', __name__)
 
-# 默认借阅期限（天）
+# 默认借阅期限（天），可通过配置项BORROW_PERIOD_DAYS覆盖
 DEFAULT_BORROW_PERIOD = 14
+# 默认同时在借上限，可通过配置项BORROW_LIMIT覆盖
+DEFAULT_BORROW_LIMIT = 10
+# 批量借还每次最多处理的图书数
+MAX_BATCH_SIZE = 20
+
+
+# 借阅/归还共用函数(不提交事务，由调用方提交)
+
+
+def loan_period(user, book):
+    # 借阅期限(天)：图书设置优先，其次用户设置，最后为系统默认值
+    return book.loan_period or user.loan_period or \
+        current_app.config.get('BORROW_PERIOD_DAYS', DEFAULT_BORROW_PERIOD)
+
+
+def borrow_limit(user):
+    # 同时在借上限：用户设置优先，其次为系统默认值
+    return user.borrow_limit or current_app.config.get('BORROW_LIMIT', DEFAULT_BORROW_LIMIT)
+
+
+def _checkout(user, book, now):
+    # 原子占用在借名额、扣减库存并创建借阅记录，返回(借阅记录, 失败原因)
+    # 先更新用户行再更新图书行，与归还的加锁顺序一致
+    limit = borrow_limit(user)
+    result = db.session.execute(
+        update(User).where(User.id == user.id, User.active_borrows < limit)
+        .values(active_borrows=User.active_borrows + 1))
+    if result.rowcount != 1:
+        return None, f'已达到借阅上限({limit}本)'
+    # 优先使用为该用户预约保留的图书，否则扣减在架库存
+    if not claim_hold(user.id, book.id, now):
+        if not take_stock(book.id, book.stock_shards):
+            # 库存不足，退回名额(行锁已持有，不会与其他请求交错)
+            db.session.execute(
+                update(User).where(User.id == user.id)
+                .values(active_borrows=User.active_borrows - 1))
+            return None, '图书库存不足'
+        # 借到在架库存，该用户对这本书的排队预约不再需要
+        close_waiting_hold(user.id, book.id, now)
+    borrow = Borrow()
+    borrow.user_id = user.id
+    borrow.book_id = book.id
+    borrow.borrow_time = now
+    borrow.due_at = now + timedelta(days=loan_period(user, book))
+    borrow.status = 0  # 0:借阅中
+    db.session.add(borrow)
+    record_borrow(borrow, book)
+    track_borrow(book.id)
+    track_activity(user.id, book.id, now)
+    return borrow, None
+
+
+def _checkin(borrow, book, now):
+    # 更新借阅记录并结算逾期罚款，释放在借名额、累加罚款余额，原子归还库存
+    # 有人预约时在同一事务内把归还的图书分配给队首，返回本次新增的罚款金额
+    borrow.return_time = now
+    borrow.status = 1  # 1:已归还
+    borrow.updated_at = now
+    fine = settle_fine(borrow, now)
+    record_return(borrow, book)
+    record_loan(borrow, book)
+    db.session.execute(
+        update(User).where(User.id == borrow.user_id)
+        .values(active_borrows=case((User.active_borrows > 0, User.active_borrows - 1), else_=0),
+                fine_balance=User.fine_balance + fine)
+        .execution_options(synchronize_session=False))
+    put_stock(book.id, book.stock_shards)
+    allocate_copy(book, now)
+    return fine
+
+
+def _overdue_days(borrow):
+    # 已归还借阅的逾期天数(未逾期为0)，与结算罚款的天数一致
+    return overdue_days(borrow.due_at, borrow.return_time)
+
+
+def _parse_batch(data, field):
+    # 解析批量请求的ID列表和处理模式，返回(ids, mode, 错误信息)
+    if not data or not isinstance(data.get(field), list) or not data[field]:
+        return None, None, f'请提供{field}列表'
+    mode = data.get('mode', 'all')
+    if mode not in ['all', 'best_effort']:
+        return None, None, '处理模式必须是all(全部成功或全部失败)或best_effort(尽量处理)'
+    try:
+        # 去重并保持顺序
+        ids = list(dict.fromkeys(int(value) for value in data[field]))
+    except (TypeError, ValueError):
+        return None, None, 'ID必须是整数'
+    if len(ids) > MAX_BATCH_SIZE:
+        return None, None, f'每次最多处理{MAX_BATCH_SIZE}本图书'
+    return ids, mode, None
 
 # 借阅图书
 
 
 @borrows_bp.route('/', methods=['POST'])
 @jwt_required()
+@idempotent
 def borrow_book():
     current_user_id = get_jwt_identity()
     data = request.get_json()
@@ -45,10 +148,6 @@ def borrow_book():
         if not book:
             return jsonify({'message': '图书不存在或已被删除'}), 404
 
-        # 检查图书库存
-        if book.stock <= 0:
-            return jsonify({'message': '图书库存不足'}), 400
-
         # 检查用户是否已经借阅了这本书
         existing_borrow = Borrow.query.filter_by(
             user_id=current_user_id,
@@ -60,17 +159,12 @@ def borrow_book():
         if existing_borrow:
             return jsonify({'message': '您已经借阅了这本书'}), 400
 
-        # 创建新的借阅记录
-        new_borrow = Borrow()
-        new_borrow.user_id = current_user_id
-        new_borrow.book_id = book_id
-        new_borrow.borrow_time = datetime.now()
-        new_borrow.status = 0  # 0:借阅中
-
-        # 减少图书库存
-        book.stock -= 1
+        # 原子占用在借名额、扣减图书库存(分片图书路由到随机非空分片)并创建借阅记录
+        new_borrow, error = _checkout(user, book, datetime.now())
+        if not new_borrow:
+            db.session.rollback()
+            return jsonify({'message': error}), 400
 
-        db.session.add(new_borrow)
         db.session.commit()
 
         return jsonify({
@@ -79,7 +173,7 @@ def borrow_book():
             'book_id': book.id,
             'book_name': book.name,
             'borrow_time': new_borrow.borrow_time.isoformat(),
-            'due_time': (new_borrow.borrow_time + timedelta(days=DEFAULT_BORROW_PERIOD)).isoformat()
+            'due_time': new_borrow.due_at.isoformat()
         }), 201
     except Exception as e:
         db.session.rollback()
@@ -90,17 +184,18 @@ def borrow_book():
 
 @borrows_bp.route('/<int:borrow_id>/return', methods=['PUT'])
 @jwt_required()
+@idempotent
 def return_book(borrow_id):
     current_user_id = get_jwt_identity()
 
     try:
-        # 查找借阅记录
+        # 查找并锁定借阅记录，防止并发重复归还
         borrow = Borrow.query.filter_by(
             id=borrow_id,
             user_id=current_user_id,
             status=0,  # 0:借阅中
             deleted_at=None
-        ).first()
+        ).with_for_update().first()
 
         if not borrow:
             return jsonify({'message': '借阅记录不存在或已归还'}), 404
@@ -110,23 +205,13 @@ def return_book(borrow_id):
         if not book:
             return jsonify({'message': '图书不存在或已被删除'}), 404
 
-        # 更新借阅记录
-        borrow.return_time = datetime.now()
-        borrow.status = 1  # 1:已归还
-        borrow.updated_at = datetime.now()
-
-        # 增加图书库存
-        book.stock += 1
+        # 更新借阅记录、结算罚款并原子增加图书库存
+        fine = _checkin(borrow, book, datetime.now())
 
         db.session.commit()
 
         # 检查是否逾期
-        is_overdue = False
-        overdue_days = 0
-        due_time = borrow.borrow_time + timedelta(days=DEFAULT_BORROW_PERIOD)
-        if borrow.return_time > due_time:
-            is_overdue = True
-            overdue_days = (borrow.return_time - due_time).days
+        overdue_days = _overdue_days(borrow)
 
         return jsonify({
             'message': '图书归还成功',
@@ -134,13 +219,178 @@ def return_book(borrow_id):
             'book_id': book.id,
             'book_name': book.name,
             'return_time': borrow.return_time.isoformat(),
-            'is_overdue': is_overdue,
-            'overdue_days': overdue_days
+            'is_overdue': overdue_days > 0,
+            'overdue_days': overdue_days,
+            'fine': float(fine)
         }), 200
     except Exception as e:
         db.session.rollback()
         return jsonify({'message': '图书归还失败', 'error': str(e)}), 500
 
+# 批量借阅图书(借还台一次借多本)
+# mode=all：任意一本失败则全部不借；mode=best_effort：能借的都借出
+
+
+@borrows_bp.route('/batch', methods=['POST'])
+@jwt_required()
+@idempotent
+def borrow_books_batch():
+    current_user_id = get_jwt_identity()
+    book_ids, mode, error = _parse_batch(request.get_json(), 'book_ids')
+    if error:
+        return jsonify({'message': error}), 400
+
+    try:
+        # 检查用户是否存在且状态正常
+        user = User.query.filter_by(
+            id=current_user_id, deleted_at=None).first()
+        if not user:
+            return jsonify({'message': '用户不存在或已被删除'}), 404
+
+        if user.status != 0:
+            return jsonify({'message': '用户状态异常，无法借阅图书'}), 403
+
+        # 集合式校验：一次查出全部图书和已借阅中的记录
+        books = {book.id: book for book in Book.query.filter(
+            Book.id.in_(book_ids), Book.deleted_at == None).all()}
+        borrowed = {row.book_id for row in db.session.query(Borrow.book_id).filter(
+            Borrow.user_id == current_user_id,
+            Borrow.book_id.in_(book_ids),
+            Borrow.status == 0,  # 借阅中
+            Borrow.deleted_at == None
+        ).all()}
+
+        results = {}
+        for book_id in book_ids:
+            if book_id not in books:
+                results[book_id] = {'book_id': book_id, 'success': False,
+                                    'message': '图书不存在或已被删除'}
+            elif book_id in borrowed:
+                results[book_id] = {'book_id': book_id, 'success': False,
+                                    'message': '您已经借阅了这本书'}
+
+        if mode == 'all' and results:
+            return _batch_response(book_ids, 'book_id', results, '批量借阅失败', 400)
+
+        # 按图书ID顺序扣减库存，并发的批量借阅加锁顺序一致，避免死锁
+        now = datetime.now()
+        new_borrows = {}
+        for book_id in sorted(set(book_ids) - set(results)):
+            new_borrow, error = _checkout(user, books[book_id], now)
+            if not new_borrow:
+                results[book_id] = {'book_id': book_id, 'success': False,
+                                    'message': error}
+                if mode == 'all':
+                    db.session.rollback()
+                    return _batch_response(book_ids, 'book_id', results, '批量借阅失败', 400)
+                continue
+            new_borrows[book_id] = new_borrow
+
+        if not new_borrows:
+            db.session.rollback()
+            return _batch_response(book_ids, 'book_id', results, '批量借阅失败', 400)
+
+        db.session.commit()
+
+        for book_id, new_borrow in new_borrows.items():
+            results[book_id] = {
+                'book_id': book_id,
+                'success': True,
+                'message': '图书借阅成功',
+                'borrow_id': new_borrow.id,
+                'book_name': books[book_id].name,
+                'borrow_time': now.isoformat(),
+                'due_time': new_borrow.due_at.isoformat()
+            }
+        return _batch_response(book_ids, 'book_id', results, '批量借阅完成', 201)
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': '批量借阅失败', 'error': str(e)}), 500
+
+# 批量归还图书
+# mode=all：任意一本失败则全部不还；mode=best_effort：能还的都归还
+
+
+@borrows_bp.route('/return/batch', methods=['PUT'])
+@jwt_required()
+@idempotent
+def return_books_batch():
+    current_user_id = get_jwt_identity()
+    borrow_ids, mode, error = _parse_batch(request.get_json(), 'borrow_ids')
+    if error:
+        return jsonify({'message': error}), 400
+
+    try:
+        # 集合式校验：一次查出并锁定全部借阅记录，再一次查出对应图书
+        borrows = {borrow.id: borrow for borrow in Borrow.query.filter(
+            Borrow.id.in_(borrow_ids),
+            Borrow.user_id == current_user_id,
+            Borrow.status == 0,  # 借阅中
+            Borrow.deleted_at == None
+        ).order_by(Borrow.id).with_for_update().all()}
+        book_ids = {borrow.book_id for borrow in borrows.values()}
+        books = {book.id: book for book in Book.query.filter(
+            Book.id.in_(book_ids), Book.deleted_at == None
+        ).all()} if book_ids else {}
+
+        results = {}
+        for borrow_id in borrow_ids:
+            borrow = borrows.get(borrow_id)
+            if not borrow:
+                results[borrow_id] = {'borrow_id': borrow_id, 'success': False,
+                                      'message': '借阅记录不存在或已归还'}
+            elif borrow.book_id not in books:
+                results[borrow_id] = {'borrow_id': borrow_id, 'success': False,
+                                      'message': '图书不存在或已被删除'}
+
+        if mode == 'all' and results:
+            db.session.rollback()
+            return _batch_response(borrow_ids, 'borrow_id', results, '批量归还失败', 400)
+
+        # 按图书ID顺序归还库存，避免并发死锁
+        now = datetime.now()
+        returned = sorted((borrow for borrow_id, borrow in borrows.items() if borrow_id not in results),
+                          key=lambda borrow: borrow.book_id)
+        if not returned:
+            db.session.rollback()
+            return _batch_response(borrow_ids, 'borrow_id', results, '批量归还失败', 400)
+        fines = {}
+        for borrow in returned:
+            fines[borrow.id] = _checkin(borrow, books[borrow.book_id], now)
+
+        db.session.commit()
+
+        for borrow in returned:
+            overdue_days = _overdue_days(borrow)
+            results[borrow.id] = {
+                'borrow_id': borrow.id,
+                'success': True,
+                'message': '图书归还成功',
+                'book_id': borrow.book_id,
+                'book_name': books[borrow.book_id].name,
+                'return_time': now.isoformat(),
+                'is_overdue': overdue_days > 0,
+                'overdue_days': overdue_days,
+                'fine': float(fines[borrow.id])
+            }
+        return _batch_response(borrow_ids, 'borrow_id', results, '批量归还完成', 200)
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': '批量归还失败', 'error': str(e)}), 500
+
+
+def _batch_response(ids, id_field, results, message, status_code):
+    # 按请求顺序返回每一项的处理结果，整批失败时没有出错的条目标记为未处理
+    items = [results.get(item_id) or {id_field: item_id, 'success': False, 'message': '未处理(同批次其他条目失败)'}
+             for item_id in ids]
+    succeeded = sum(1 for item in items if item['success'])
+    return jsonify({
+        'message': message,
+        'succeeded': succeeded,
+        'failed': len(items) - succeeded,
+        'results': items
+    }), status_code
+
 # 获取当前用户的借阅记录
 
 
@@ -156,30 +406,38 @@ def get_user_borrows():
     # 状态筛选
     status = request.args.get('status', type=int)
 
-    # 构建查询
-    query = Borrow.query.filter_by(
-        user_id=current_user_id,
-        deleted_at=None
+    if status not in [0, 1]:
+        status = None
+
+    # 构建查询：一次联表取出所需列，已删除的图书在SQL中过滤，分页不会缺条
+    # 历史记录跨在线表和归档表读取，只查借阅中记录时仅访问在线表
+    history = borrow_history(user_id=current_user_id, status=status)
+    query = db.session.query(
+        history.c.id,
+        history.c.book_id,
+        history.c.borrow_time,
+        history.c.return_time,
+        history.c.due_at,
+        history.c.status,
+        Book.name.label('book_name'),
+        Book.author,
+        Book.publisher
+    ).join(Book, Book.id == history.c.book_id).filter(
+        history.c.deleted_at == None,
+        Book.deleted_at == None
     )
 
-    if status is not None and status in [0, 1]:
-        query = query.filter_by(status=status)
-
-    borrows = query.order_by(Borrow.borrow_time.desc()).paginate(
+    borrows = query.order_by(history.c.borrow_time.desc()).paginate(
         page=page, per_page=per_page, error_out=False
     )
 
     # 构建返回结果
     borrow_list = []
     for borrow in borrows.items:
-        book = Book.query.get(borrow.book_id)
-        if not book or book.deleted_at:
-            continue
-
         # 计算是否逾期和剩余天数
         is_overdue = False
         days_left = None
-        due_time = borrow.borrow_time + timedelta(days=DEFAULT_BORROW_PERIOD)
+        due_time = borrow.due_at
 
         if borrow.status == 0:  # 借阅中
             if datetime.now() > due_time:
@@ -191,9 +449,9 @@ def get_user_borrows():
         borrow_list.append({
             'id': borrow.id,
             'book_id': borrow.book_id,
-            'book_name': book.name,
-            'author': book.author,
-            'publisher': book.publisher,
+            'book_name': borrow.book_name,
+            'author': borrow.author,
+            'publisher': borrow.publisher,
             'borrow_time': borrow.borrow_time.isoformat(),
             'return_time': borrow.return_time.isoformat() if borrow.return_time else None,
             'status': borrow.status,
@@ -222,35 +480,39 @@ def get_overdue_borrows():
     page = request.args.get('page', 1, type=int)
     per_page = request.args.get('per_page', 10, type=int)
 
-    # 查找所有借阅中且已逾期的记录
+    # 查找所有借阅中且已逾期的记录(走(user_id, status, due_at)索引范围扫描)
     now = datetime.now()
-    due_time_cutoff = now - timedelta(days=DEFAULT_BORROW_PERIOD)
 
-    borrows = Borrow.query.filter(
+    borrows = db.session.query(
+        Borrow.id,
+        Borrow.book_id,
+        Borrow.borrow_time,
+        Borrow.due_at,
+        Book.name.label('book_name'),
+        Book.author,
+        Book.publisher
+    ).join(Book, Book.id == Borrow.book_id).filter(
         Borrow.user_id == current_user_id,
         Borrow.status == 0,  # 借阅中
-        Borrow.borrow_time < due_time_cutoff,
-        Borrow.deleted_at == None
-    ).order_by(Borrow.borrow_time.desc()).paginate(
+        Borrow.due_at < now,
+        Borrow.deleted_at == None,
+        Book.deleted_at == None
+    ).order_by(Borrow.due_at.desc()).paginate(
         page=page, per_page=per_page, error_out=False
     )
 
     # 构建返回结果
     borrow_list = []
     for borrow in borrows.items:
-        book = Book.query.get(borrow.book_id)
-        if not book or book.deleted_at:
-            continue
-
-        due_time = borrow.borrow_time + timedelta(days=DEFAULT_BORROW_PERIOD)
+        due_time = borrow.due_at
         overdue_days = (now - due_time).days
 
         borrow_list.append({
             'id': borrow.id,
             'book_id': borrow.book_id,
-            'book_name': book.name,
-            'author': book.author,
-            'publisher': book.publisher,
+            'book_name': borrow.book_name,
+            'author': borrow.author,
+            'publisher': borrow.publisher,
             'borrow_time': borrow.borrow_time.isoformat(),
             'due_time': due_time.isoformat(),
             'overdue_days': overdue_days
@@ -293,42 +555,53 @@ def get_all_borrows():
         elif is_overdue.lower() == 'false':
             is_overdue = False
 
-    # 构建查询
-    query = Borrow.query.filter_by(deleted_at=None)
-
-    if user_id:
-        query = query.filter_by(user_id=user_id)
-    if book_id:
-        query = query.filter_by(book_id=book_id)
-    if status is not None and status in [0, 1]:
-        query = query.filter_by(status=status)
+    if status not in [0, 1]:
+        status = None
+    # 处理逾期筛选(只有借阅中的记录才算逾期，只需访问在线表)
+    if is_overdue is True and status is None:
+        status = 0
+
+    # 构建查询：一次联表取出所需列，已删除的用户和图书在SQL中过滤
+    # 历史记录跨在线表和归档表读取，只查借阅中记录时仅访问在线表
+    history = borrow_history(
+        user_id=user_id or None, book_id=book_id or None, status=status)
+    query = db.session.query(
+        history.c.id,
+        history.c.user_id,
+        history.c.book_id,
+        history.c.borrow_time,
+        history.c.return_time,
+        history.c.due_at,
+        history.c.status,
+        User.username,
+        User.name.label('user_name'),
+        Book.name.label('book_name'),
+        Book.author
+    ).join(User, User.id == history.c.user_id).join(
+        Book, Book.id == history.c.book_id
+    ).filter(
+        history.c.deleted_at == None,
+        User.deleted_at == None,
+        Book.deleted_at == None
+    )
 
-    # 处理逾期筛选
     if is_overdue is True:
-        now = datetime.now()
-        due_time_cutoff = now - timedelta(days=DEFAULT_BORROW_PERIOD)
         query = query.filter(
-            Borrow.borrow_time < due_time_cutoff
+            history.c.status == 0,
+            history.c.due_at < datetime.now()
         )
 
-    borrows = query.order_by(Borrow.borrow_time.desc()).paginate(
+    borrows = query.order_by(history.c.borrow_time.desc()).paginate(
         page=page, per_page=per_page, error_out=False
     )
 
     # 构建返回结果
     borrow_list = []
     for borrow in borrows.items:
-        user = User.query.get(borrow.user_id)
-        book = Book.query.get(borrow.book_id)
-
-        if not user or user.deleted_at or not book or book.deleted_at:
-            continue
-
         # 计算是否逾期
         overdue_info = None
         if borrow.status == 0:  # 借阅中
-            due_time = borrow.borrow_time + \
-                timedelta(days=DEFAULT_BORROW_PERIOD)
+            due_time = borrow.due_at
             if datetime.now() > due_time:
                 overdue_info = {
                     'is_overdue': True,
@@ -345,11 +618,11 @@ def get_all_borrows():
         borrow_list.append({
             'id': borrow.id,
             'user_id': borrow.user_id,
-            'username': user.username,
-            'user_name': user.name,
+            'username': borrow.username,
+            'user_name': borrow.user_name,
             'book_id': borrow.book_id,
-            'book_name': book.name,
-            'author': book.author,
+            'book_name': borrow.book_name,
+            'author': borrow.author,
             'borrow_time': borrow.borrow_time.isoformat(),
             'return_time': borrow.return_time.isoformat() if borrow.return_time else None,
             'status': borrow.status,
@@ -363,3 +636,28 @@ def get_all_borrows():
         'pages': borrows.pages,
         'current_page': borrows.page
     }), 200
+
+
+# 按借阅表重算用户的在借数量(计数器与实际不一致时修正)，返回修正的用户数
+
+
+def reconcile_active_borrows():
+    actual = select(func.count(Borrow.id)).where(
+        Borrow.user_id == User.id,
+        Borrow.status == 0,  # 借阅中
+        Borrow.deleted_at == None
+    ).scalar_subquery()
+    result = db.session.execute(
+        update(User).where(User.active_borrows != actual)
+        .values(active_borrows=actual)
+        .execution_options(synchronize_session=False))
+    db.session.commit()
+    return result.rowcount
+
+# 命令行：校正用户在借数量计数器(建议每天低峰期执行)
+
+
+@borrows_bp.cli.command('reconcile-counters')
+def reconcile_counters_command():
+    """按借阅中的记录重算每个用户的在借数量"""
+    click.echo(f'已校正 {reconcile_active_borrows()} 个用户的在借数量')
@@ -0,0 +1,331 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app
+from sqlalchemy import delete, insert, update
+from database import db
+from models import CacheEntry, SystemCounter
+
+# 目录写版本号：图书的增删改会使其递增，搜索缓存以它作为缓存键的一部分
+CATALOG_VERSION = 'catalog_version'
+
+
+# 计数器共用函数
+
+
+def get_counter(name):
+    value = db.session.query(SystemCounter.value).filter(
+        SystemCounter.name == name).scalar()
+    return value or 0
+
+
+def bump_counter(name):
+    # 原子递增计数器(不提交事务，随调用方的修改一起提交)
+    result = db.session.execute(
+        update(SystemCounter).where(SystemCounter.name == name)
+        .values(value=SystemCounter.value + 1))
+    if result.rowcount == 0:
+        counter = SystemCounter()
+        counter.name = name
+        counter.value = 1
+        db.session.add(counter)
+
+
+def get_catalog_version():
+    return get_counter(CATALOG_VERSION)
+
+
+def bump_catalog_version():
+    bump_counter(CATALOG_VERSION)
+
+# 统计缓存版本号：清除统计缓存时递增，各进程的旧结果随之失效
+STATS_CACHE_VERSION = 'stats_cache_version'
+# 后台刷新租约时长(秒)：刷新线程异常退出时，租约到期后其他进程可以接手
+REFRESH_LEASE_SECONDS = 30
+# 刷新失败或其他进程正在刷新时，本进程隔多久(秒)再尝试
+REFRESH_RETRY_SECONDS = 1
+
+
+class _Call:
+    # 一次进行中的计算，并发的相同请求等待它完成
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+        self.cost = 0.0
+
+
+class SingleFlightCache:
+    # 进程内LRU结果缓存；并发未命中同一个key时只有一个线程计算，其余线程等待其结果
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (value, 计算耗时)
+        self._calls = {}  # key -> 进行中的_Call
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.saved_seconds = 0.0
+        self.compute_seconds = 0.0
+
+    def get_or_compute(self, key, compute):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                self.saved_seconds += entry[1]
+                return entry[0]
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            with self._lock:
+                self.saved_seconds += call.cost
+            return call.value
+
+        started = time.perf_counter()
+        try:
+            call.value = compute()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            call.cost = time.perf_counter() - started
+            with self._lock:
+                self._calls.pop(key, None)
+                self.compute_seconds += call.cost
+                if call.error is None:
+                    self._entries[key] = (call.value, call.cost)
+                    while len(self._entries) > self.maxsize:
+                        self._entries.popitem(last=False)
+            call.event.set()
+        return call.value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses + self.coalesced
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,  # 并发未命中时等待他人结果的次数
+                'hit_ratio': round((self.hits + self.coalesced) / lookups, 4) if lookups else 0,
+                'saved_db_seconds': round(self.saved_seconds, 3),
+                'compute_db_seconds': round(self.compute_seconds, 3)
+            }
+
+
+# 共享缓存存取(跨进程共享时使用，结果以JSON存入cache_entry表)
+
+
+def _now_ms():
+    return int(time.time() * 1000)
+
+
+def _load_shared(key):
+    row = db.session.get(CacheEntry, key)
+    if row is None:
+        return None
+    return json.loads(row.value), row.computed_at / 1000
+
+
+def _save_shared(key, value, computed_at):
+    # 写入结果并释放刷新租约
+    values = {'value': json.dumps(value), 'computed_at': int(computed_at * 1000), 'refresh_until': 0}
+    try:
+        result = db.session.execute(
+            update(CacheEntry).where(CacheEntry.key == key).values(**values))
+        if result.rowcount == 0:
+            db.session.add(CacheEntry(key=key, **values))
+        db.session.commit()
+    except Exception:
+        # 共享写入失败(如多个进程同时插入同一个键)不影响本次结果
+        db.session.rollback()
+
+
+_insert_leased = insert(CacheEntry.__table__).prefix_with(
+    'IGNORE', dialect='mysql').prefix_with('OR IGNORE', dialect='sqlite')
+
+
+def _acquire_refresh(key, entry):
+    # 条件更新抢占刷新租约，所有进程中只有一个能抢到
+    # 共享结果行不存在时(清空缓存或写入失败)以本进程的旧值插入并持有租约，并发插入时只有一个成功
+    now = _now_ms()
+    lease = now + REFRESH_LEASE_SECONDS * 1000
+    result = db.session.execute(
+        update(CacheEntry).where(CacheEntry.key == key, CacheEntry.refresh_until < now)
+        .values(refresh_until=lease))
+    if result.rowcount == 0 and db.session.get(CacheEntry, key) is None:
+        result = db.session.execute(_insert_leased, {
+            'key': key, 'value': json.dumps(entry.value),
+            'computed_at': int(entry.computed_at * 1000), 'refresh_until': lease})
+    db.session.commit()
+    return result.rowcount == 1
+
+
+def clear_shared():
+    db.session.execute(delete(CacheEntry))
+    db.session.commit()
+
+
+class _Entry:
+    __slots__ = ('value', 'computed_at', 'refreshing', 'retry_at')
+
+    def __init__(self, value, computed_at):
+        self.value = value
+        self.computed_at = computed_at
+        self.refreshing = False
+        self.retry_at = 0.0
+
+
+class StaleWhileRevalidateCache:
+    # 进程内结果缓存(过期后先返回旧值再后台刷新)：
+    # 未超过软过期时间直接返回；超过软过期未超过硬过期时立即返回旧值，同时只启动一个后台线程重算；
+    # 超过硬过期或没有缓存时同步计算，并发的相同请求只计算一次
+    # shared=True时结果同时写入cache_entry表，其他进程本地过期后先读取共享结果，后台刷新靠租约保证只有一个进程执行
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> _Entry
+        self._calls = {}  # key -> 进行中的_Call
+        self.fresh_hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+
+    def get(self, key, compute, soft_ttl, hard_ttl, shared=False):
+        # key为字符串，compute返回可JSON序列化的结果；返回(结果, 结果年龄秒数, 状态fresh/stale/miss)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+
+        if shared and (entry is None or time.time() - entry.computed_at >= soft_ttl):
+            loaded = _load_shared(key)
+            if loaded and (entry is None or loaded[1] > entry.computed_at):
+                entry = self._put(key, *loaded)
+
+        now = time.time()
+        if entry is not None and now - entry.computed_at < soft_ttl:
+            with self._lock:
+                self.fresh_hits += 1
+            return entry.value, now - entry.computed_at, 'fresh'
+
+        if entry is not None and now - entry.computed_at < hard_ttl:
+            with self._lock:
+                self.stale_hits += 1
+                start = not entry.refreshing and now >= entry.retry_at
+                if start:
+                    entry.refreshing = True
+            if start:
+                threading.Thread(target=self._refresh, daemon=True, args=(
+                    current_app._get_current_object(), key, entry, compute, shared)).start()
+            return entry.value, now - entry.computed_at, 'stale'
+
+        value, computed_at = self._compute_once(key, compute, shared)
+        return value, max(time.time() - computed_at, 0), 'miss'
+
+    def _put(self, key, value, computed_at):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.computed_at >= computed_at:
+                return entry
+            entry = self._entries[key] = _Entry(value, computed_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+            return entry
+
+    def _compute_once(self, key, compute, shared):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value
+
+        try:
+            value = compute()
+            computed_at = time.time()
+            self._put(key, value, computed_at)
+            call.value = (value, computed_at)
+            if shared:
+                _save_shared(key, value, computed_at)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+        return call.value
+
+    def _refresh(self, app, key, entry, compute, shared):
+        # 后台线程使用独立的应用上下文(独立的数据库会话)
+        retry = False
+        try:
+            with app.app_context():
+                if shared and not _acquire_refresh(key, entry):
+                    # 其他进程正在刷新，稍后从共享存储读取它的结果
+                    retry = True
+                    return
+                value = compute()
+                computed_at = time.time()
+                self._put(key, value, computed_at)
+                if shared:
+                    _save_shared(key, value, computed_at)
+                with self._lock:
+                    self.refreshes += 1
+        except Exception:
+            retry = True
+            with self._lock:
+                self.refresh_errors += 1
+        finally:
+            with self._lock:
+                entry.refreshing = False
+                if retry:
+                    entry.retry_at = time.time() + REFRESH_RETRY_SECONDS
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.fresh_hits + self.stale_hits + self.misses + self.coalesced
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'fresh_hits': self.fresh_hits,
+                'stale_hits': self.stale_hits,  # 返回旧值并触发后台刷新的次数
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'hit_ratio': round((self.fresh_hits + self.stale_hits) / lookups, 4) if lookups else 0,
+                'background_refreshes': self.refreshes,
+                'refresh_errors': self.refresh_errors
+            }
@@ -0,0 +1,83 @@
+from datetime import datetime
+from flask import Blueprint, jsonify
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from database import db
+from models import Book, Borrow, User
+from borrows import borrow_limit
+from fines import overdue_days
+
+# 创建dashboard蓝图
+dashboard_bp = Blueprint('dashboard', __name__)
+
+# 读者首页：个人信息、在借图书、逾期图书、计数和罚款一次返回
+# 令牌黑名单检查已按ID加载当前用户，这里从会话的identity map取用户不再查库，
+# 在借图书一次联表查询，整个请求共3条SQL
+
+
+@dashboard_bp.route('/dashboard', methods=['GET'])
+@jwt_required()
+def get_dashboard():
+    current_user_id = get_jwt_identity()
+    user = db.session.get(User, int(current_user_id))
+    if not user or user.deleted_at is not None:
+        return jsonify({'message': '用户不存在或已被修改或删除'}), 404
+
+    # 在借图书按应还时间排序(走(user_id, status, due_at)索引)，数量受借阅上限约束
+    borrows = db.session.query(
+        Borrow.id,
+        Borrow.book_id,
+        Borrow.borrow_time,
+        Borrow.due_at,
+        Book.name.label('book_name'),
+        Book.author,
+        Book.publisher
+    ).join(Book, Book.id == Borrow.book_id).filter(
+        Borrow.user_id == user.id,
+        Borrow.status == 0,  # 借阅中
+        Borrow.deleted_at == None,
+        Book.deleted_at == None
+    ).order_by(Borrow.due_at).all()
+
+    now = datetime.now()
+    active_list = []
+    overdue_list = []
+    for borrow in borrows:
+        # 逾期天数按自然日计，与罚款一致(到期当天不算逾期)
+        days_overdue = overdue_days(borrow.due_at, now)
+        is_overdue = days_overdue > 0
+        item = {
+            'id': borrow.id,
+            'book_id': borrow.book_id,
+            'book_name': borrow.book_name,
+            'author': borrow.author,
+            'publisher': borrow.publisher,
+            'borrow_time': borrow.borrow_time.isoformat(),
+            'due_time': borrow.due_at.isoformat(),
+            'is_overdue': is_overdue,
+            'days_left': (borrow.due_at.date() - now.date()).days
+        }
+        active_list.append(item)
+        if is_overdue:
+            overdue_list.append(dict(item, overdue_days=days_overdue))
+
+    limit = borrow_limit(user)
+    return jsonify({
+        'profile': {
+            'username': user.username,
+            'email': user.email,
+            'phone': user.phone,
+            'name': user.name,
+            'sex': user.sex,
+            'age': user.age,
+            'introduction': user.introduction,
+        },
+        'counts': {
+            'active_borrows': user.active_borrows,
+            'overdue_borrows': len(overdue_list),
+            'borrow_limit': limit,
+            'remaining_borrows': max(limit - user.active_borrows, 0)
+        },
+        'fine_balance': float(user.fine_balance),
+        'active_borrows': active_list,
+        'overdue_borrows': overdue_list
+    }), 200
@@ -0,0 +1,372 @@
+import hashlib
+import json
+import re
+import struct
+import unicodedata
+from datetime import datetime
+import click
+from flask import Blueprint, jsonify, request
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from sqlalchemy import insert, or_
+from sqlalchemy.orm import aliased
+from database import db
+from models import Book, BookSignature, BookLshBucket, DuplicateCandidate, User
+
+# 创建dedupe蓝图
+dedupe_bp = Blueprint('dedupe', __name__)
+
+# MinHash签名长度(哈希函数个数)
+NUM_PERM = 64
+# LSH分段：LSH_BANDS * LSH_ROWS = NUM_PERM，成为候选的相似度拐点约为(1/16)^(1/4)=0.5
+LSH_BANDS = 16
+LSH_ROWS = 4
+# 判定为疑似重复的默认相似度阈值
+DEFAULT_THRESHOLD = 0.6
+# 每批建立索引的图书数
+SCAN_BATCH_SIZE = 1000
+# IN查询每次携带的参数个数
+IN_CHUNK_SIZE = 1000
+# 字符shingle长度(中文书名较短，取2)
+SHINGLE_SIZE = 2
+# 各字段的权重(书名更能区分作品，不同出版社的版本也应判为重复)
+FIELD_WEIGHTS = (('name', 2), ('author', 1), ('publisher', 1))
+
+# 版次、装帧等不影响"是否同一作品"的标记
+EDITION_PATTERN = re.compile(
+    r'第?[0-9一二三四五六七八九十]+版|修订版|典藏版|珍藏版|纪念版|精装版?|平装版?|新版'
+    r'|\d+(st|nd|rd|th)?\s*edition|edition')
+NON_WORD_PATTERN = re.compile(r'[\W_]+')
+
+
+# MinHash/LSH共用函数
+
+
+def normalize_text(text):
+    # 全角转半角、统一大小写，去掉版次标记和标点空白
+    text = unicodedata.normalize('NFKC', text or '').casefold()
+    text = EDITION_PATTERN.sub('', text)
+    return NON_WORD_PATTERN.sub('', text)
+
+
+def book_shingles(name, author, publisher):
+    # 生成书名/作者/出版社的字符shingle集合，权重为w的字段每个shingle加入w份
+    fields = {'name': name, 'author': author, 'publisher': publisher}
+    shingles = set()
+    for field, weight in FIELD_WEIGHTS:
+        text = normalize_text(fields[field])
+        grams = {text[i:i + SHINGLE_SIZE]
+                 for i in range(max(len(text) - SHINGLE_SIZE + 1, 1))} if text else set()
+        for replica in range(weight):
+            shingles.update(f'{field}{replica}:{gram}' for gram in grams)
+    return shingles
+
+
+def minhash(shingles):
+    # 计算MinHash签名：每个shingle用一次SHAKE-128输出NUM_PERM个32位哈希值，
+    # 相当于NUM_PERM个独立的哈希函数，逐位取最小值
+    signature = [0xFFFFFFFF] * NUM_PERM
+    for shingle in shingles:
+        values = struct.unpack(f'<{NUM_PERM}I', hashlib.shake_128(
+            shingle.encode('utf-8')).digest(NUM_PERM * 4))
+        signature = list(map(min, signature, values))
+    return signature
+
+
+def lsh_buckets(signature):
+    # 签名按band切分，每段哈希成一个桶(band编号参与哈希，不同band的桶不会相撞)
+    for band in range(LSH_BANDS):
+        rows = signature[band * LSH_ROWS:(band + 1) * LSH_ROWS]
+        digest = hashlib.blake2b(struct.pack(
+            f'<I{LSH_ROWS}I', band, *rows), digest_size=8).digest()
+        yield band, int.from_bytes(digest, 'big') >> 1  # 取63位，适配有符号BIGINT
+
+
+def similarity(signature_a, signature_b):
+    # 签名逐位相等的比例即Jaccard相似度的无偏估计
+    return sum(1 for a, b in zip(signature_a, signature_b) if a == b) / NUM_PERM
+
+
+def _pack(signature):
+    return struct.pack(f'<{NUM_PERM}I', *signature)
+
+
+def _unpack(data):
+    return list(struct.unpack(f'<{NUM_PERM}I', data))
+
+
+def _chunks(values, size=IN_CHUNK_SIZE):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def scan_duplicates(full=False, threshold=DEFAULT_THRESHOLD, batch_size=SCAN_BATCH_SIZE):
+    # 增量查重：只处理还没有签名、或签名建立后又被修改过的图书
+    # 返回(处理的图书数, 新发现的疑似重复对数)
+    if full:
+        BookLshBucket.query.delete()
+        BookSignature.query.delete()
+        db.session.commit()
+
+    indexed = found = 0
+    last_id = 0
+    while True:
+        books = db.session.query(
+            Book.id, Book.name, Book.author, Book.publisher
+        ).outerjoin(BookSignature, BookSignature.book_id == Book.id).filter(
+            Book.id > last_id,
+            Book.deleted_at == None,
+            or_(BookSignature.book_id == None,
+                BookSignature.indexed_at < Book.updated_at)
+        ).order_by(Book.id).limit(batch_size).all()
+        if not books:
+            break
+        found += _index_batch(books, threshold)
+        indexed += len(books)
+        last_id = books[-1].id
+        db.session.commit()
+    return indexed, found
+
+
+def _index_batch(books, threshold):
+    now = datetime.now()
+    book_ids = [book.id for book in books]
+    signatures = {}
+    for book in books:
+        shingles = book_shingles(book.name, book.author, book.publisher)
+        if shingles:
+            signatures[book.id] = minhash(shingles)
+
+    # 替换本批图书的旧签名和分桶
+    BookLshBucket.query.filter(BookLshBucket.book_id.in_(
+        book_ids)).delete(synchronize_session=False)
+    BookSignature.query.filter(BookSignature.book_id.in_(
+        book_ids)).delete(synchronize_session=False)
+    if not signatures:
+        return 0
+
+    bucket_rows = []
+    buckets = {}
+    for book_id, signature in signatures.items():
+        for band, bucket in lsh_buckets(signature):
+            bucket_rows.append(
+                {'book_id': book_id, 'band': band, 'bucket': bucket})
+            buckets.setdefault(bucket, []).append(book_id)
+    db.session.execute(insert(BookSignature), [
+        {'book_id': book_id, 'signature': _pack(signature), 'indexed_at': now}
+        for book_id, signature in signatures.items()])
+    db.session.execute(insert(BookLshBucket), bucket_rows)
+
+    # 同桶的图书即候选对(包含本批内部的图书)，只与本批图书配对，总代价近似线性
+    pairs = set()
+    for chunk in _chunks(buckets):
+        rows = db.session.query(BookLshBucket.bucket, BookLshBucket.book_id).filter(
+            BookLshBucket.bucket.in_(chunk)).all()
+        for row in rows:
+            for book_id in buckets[row.bucket]:
+                if row.book_id != book_id:
+                    pairs.add((min(book_id, row.book_id),
+                              max(book_id, row.book_id)))
+    if not pairs:
+        return 0
+
+    # 加载候选图书的签名，按估计相似度过滤
+    other_ids = {book_id for pair in pairs for book_id in pair} - \
+        set(signatures)
+    for chunk in _chunks(other_ids):
+        for row in BookSignature.query.filter(BookSignature.book_id.in_(chunk)).all():
+            signatures[row.book_id] = _unpack(row.signature)
+    scored = {}
+    for pair in pairs:
+        if pair[0] in signatures and pair[1] in signatures:
+            score = similarity(signatures[pair[0]], signatures[pair[1]])
+            if score >= threshold:
+                scored[pair] = score
+    if not scored:
+        return 0
+
+    # 已存在的候选对(含已审核的)不重复插入
+    low_ids = {pair[0] for pair in scored}
+    for chunk in _chunks(low_ids):
+        for row in db.session.query(DuplicateCandidate.book_id, DuplicateCandidate.other_book_id).filter(
+                DuplicateCandidate.book_id.in_(chunk)).all():
+            scored.pop((row.book_id, row.other_book_id), None)
+    if scored:
+        db.session.execute(insert(DuplicateCandidate), [
+            {'book_id': pair[0], 'other_book_id': pair[1], 'similarity': round(score, 4),
+             'status': 0, 'created_at': now, 'updated_at': now}
+            for pair, score in scored.items()])
+    return len(scored)
+
+
+def duplicate_clusters():
+    # 将待审核的疑似重复对用并查集合并成簇，已删除的图书不参与
+    book_a = aliased(Book)
+    book_b = aliased(Book)
+    pairs = db.session.query(
+        DuplicateCandidate.id,
+        DuplicateCandidate.book_id,
+        DuplicateCandidate.other_book_id,
+        DuplicateCandidate.similarity
+    ).join(book_a, book_a.id == DuplicateCandidate.book_id).join(
+        book_b, book_b.id == DuplicateCandidate.other_book_id
+    ).filter(
+        DuplicateCandidate.status == 0,  # 待审核
+        book_a.deleted_at == None,
+        book_b.deleted_at == None
+    ).all()
+
+    parent = {}
+
+    def find(book_id):
+        parent.setdefault(book_id, book_id)
+        while parent[book_id] != book_id:
+            parent[book_id] = parent[parent[book_id]]
+            book_id = parent[book_id]
+        return book_id
+
+    for pair in pairs:
+        parent[find(pair.book_id)] = find(pair.other_book_id)
+
+    clusters = {}
+    for pair in pairs:
+        cluster = clusters.setdefault(
+            find(pair.book_id), {'book_ids': set(), 'pairs': []})
+        cluster['book_ids'].update((pair.book_id, pair.other_book_id))
+        cluster['pairs'].append({
+            'candidate_id': pair.id,
+            'book_id': pair.book_id,
+            'other_book_id': pair.other_book_id,
+            'similarity': pair.similarity
+        })
+
+    books = {}
+    for chunk in _chunks(parent):
+        for book in Book.query.filter(Book.id.in_(chunk)).all():
+            books[book.id] = {
+                'id': book.id,
+                'name': book.name,
+                'author': book.author,
+                'publisher': book.publisher,
+                'category': book.category,
+                'ISBN': book.ISBN
+            }
+
+    result = []
+    for cluster in clusters.values():
+        result.append({
+            'books': [books[book_id] for book_id in sorted(cluster['book_ids'])],
+            'pairs': sorted(cluster['pairs'], key=lambda pair: -pair['similarity']),
+            'max_similarity': max(pair['similarity'] for pair in cluster['pairs'])
+        })
+    result.sort(key=lambda cluster: (-cluster['max_similarity'], cluster['books'][0]['id']))
+    return result
+
+# 管理员获取疑似重复图书簇
+
+
+@dedupe_bp.route('/clusters', methods=['GET'])
+@jwt_required()
+def get_clusters():
+    current_user_id = get_jwt_identity()
+    current_user = User.query.get(current_user_id)
+
+    # 检查是否是管理员
+    if not current_user or current_user.privilege != 1:
+        return jsonify({'message': '权限不足'}), 403
+
+    # 分页参数
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = max(request.args.get('per_page', 10, type=int), 1)
+
+    try:
+        clusters = duplicate_clusters()
+        return jsonify({
+            'clusters': clusters[(page - 1) * per_page:page * per_page],
+            'total': len(clusters),
+            'pages': (len(clusters) + per_page - 1) // per_page,
+            'current_page': page
+        }), 200
+    except Exception as e:
+        return jsonify({'message': '获取疑似重复图书失败', 'error': str(e)}), 500
+
+# 管理员触发查重(默认增量)
+
+
+@dedupe_bp.route('/scan', methods=['POST'])
+@jwt_required()
+def scan():
+    current_user_id = get_jwt_identity()
+    current_user = User.query.get(current_user_id)
+
+    # 检查是否是管理员
+    if not current_user or current_user.privilege != 1:
+        return jsonify({'message': '权限不足'}), 403
+
+    data = request.get_json(silent=True) or {}
+    threshold = data.get('threshold', DEFAULT_THRESHOLD)
+    if not isinstance(threshold, (int, float)) or not 0 < threshold <= 1:
+        return jsonify({'message': '相似度阈值必须在0-1之间'}), 400
+
+    try:
+        indexed, found = scan_duplicates(
+            full=bool(data.get('full')), threshold=threshold)
+        return jsonify({
+            'message': '查重完成',
+            'indexed_books': indexed,
+            'new_candidates': found
+        }), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': '查重失败', 'error': str(e)}), 500
+
+# 管理员审核疑似重复对
+
+
+@dedupe_bp.route('/candidates/<int:candidate_id>', methods=['PUT'])
+@jwt_required()
+def review_candidate(candidate_id):
+    current_user_id = get_jwt_identity()
+    current_user = User.query.get(current_user_id)
+
+    # 检查是否是管理员
+    if not current_user or current_user.privilege != 1:
+        return jsonify({'message': '权限不足'}), 403
+
+    data = request.get_json()
+    if not data or data.get('status') not in [1, 2]:
+        return jsonify({'message': '审核状态必须是1(确认重复)或2(不是重复)'}), 400
+
+    candidate = DuplicateCandidate.query.get(candidate_id)
+    if not candidate:
+        return jsonify({'message': '疑似重复记录不存在'}), 404
+
+    try:
+        candidate.status = data['status']
+        candidate.updated_at = datetime.now()
+        db.session.commit()
+        return jsonify({'message': '审核成功', 'candidate_id': candidate.id, 'status': candidate.status}), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': '审核失败', 'error': str(e)}), 500
+
+# 命令行：增量查重(可定时执行)
+
+
+@dedupe_bp.cli.command('scan')
+@click.option('--full', is_flag=True, help='清空签名后全量重建')
+@click.option('--threshold', default=DEFAULT_THRESHOLD, show_default=True, help='疑似重复的相似度阈值')
+@click.option('--batch-size', default=SCAN_BATCH_SIZE, show_default=True, help='每批处理的图书数')
+def scan_command(full, threshold, batch_size):
+    """为新增/修改的图书建立MinHash签名并查找疑似重复"""
+    indexed, found = scan_duplicates(full, threshold, batch_size)
+    click.echo(f'处理图书 {indexed} 本，新发现疑似重复 {found} 对')
+
+# 命令行：输出待审核的疑似重复簇
+
+
+@dedupe_bp.cli.command('clusters')
+def clusters_command():
+    """以JSON Lines格式输出待审核的疑似重复簇"""
+    for cluster in duplicate_clusters():
+        click.echo(json.dumps(cluster, ensure_ascii=False))
@@ -0,0 +1,228 @@
+import math
+import struct
+from array import array
+from datetime import datetime
+import click
+from flask import Blueprint
+from sqlalchemy import delete, event, insert, select
+from database import db
+from models import Book, LoanDurationDigest
+from archive import borrow_history
+
+# 创建durations蓝图(只提供命令行)
+durations_bp = Blueprint('durations', __name__)
+
+# t-digest压缩参数：质心数约为其1~2倍，越大分位数越精确
+DIGEST_COMPRESSION = 100
+# 报表中的分位数
+LOAN_PERCENTILES = {'p50': 0.5, 'p90': 0.9, 'p99': 0.99}
+
+# 编码头：压缩参数、最小值、最大值
+_HEADER = struct.Struct('<Hdd')
+
+
+class TDigest:
+    # t-digest分位数摘要：把数据聚成若干质心(均值, 权重)，两端的质心小、中间的质心大，尾部分位数更精确
+    # 两个摘要合并即把质心放在一起重新压缩，可按任意顺序合并
+    def __init__(self, compression=DIGEST_COMPRESSION):
+        self.compression = compression
+        self.centroids = []  # [(均值, 权重)]，按均值排序
+        self._buffer = []
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value, weight=1):
+        self._buffer.append((value, weight))
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        if len(self._buffer) >= self.compression * 5:
+            self._compress()
+
+    def merge(self, other):
+        other._compress()
+        self._buffer.extend(other.centroids)
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._compress()
+
+    @property
+    def count(self):
+        self._compress()
+        return sum(weight for mean, weight in self.centroids)
+
+    def _scale(self, q):
+        return self.compression / (2 * math.pi) * math.asin(2 * q - 1)
+
+    def _compress(self):
+        if not self._buffer:
+            return
+        items = sorted(self.centroids + self._buffer)
+        self._buffer = []
+        total = sum(weight for mean, weight in items)
+        merged = []
+        mean, weight = items[0]
+        before = 0
+        k_left = self._scale(0)
+        for next_mean, next_weight in items[1:]:
+            if self._scale((before + weight + next_weight) / total) - k_left <= 1:
+                weight += next_weight
+                mean += (next_mean - mean) * next_weight / weight
+            else:
+                merged.append((mean, weight))
+                before += weight
+                k_left = self._scale(before / total)
+                mean, weight = next_mean, next_weight
+        merged.append((mean, weight))
+        self.centroids = merged
+
+    def quantile(self, q):
+        # 在相邻质心中心之间线性插值，两端向最小/最大值插值
+        self._compress()
+        if not self.centroids:
+            return None
+        if len(self.centroids) == 1:
+            return self.centroids[0][0]
+        total = sum(weight for mean, weight in self.centroids)
+        target = q * total
+        first_mean, first_weight = self.centroids[0]
+        if target < first_weight / 2:
+            return self.min + (first_mean - self.min) * target / (first_weight / 2)
+        cumulative = 0
+        for (left_mean, left_weight), (right_mean, right_weight) in zip(self.centroids, self.centroids[1:]):
+            left_center = cumulative + left_weight / 2
+            right_center = cumulative + left_weight + right_weight / 2
+            if target <= right_center:
+                return left_mean + (right_mean - left_mean) * (target - left_center) / (right_center - left_center)
+            cumulative += left_weight
+        last_mean, last_weight = self.centroids[-1]
+        remaining = total - target
+        return self.max - (self.max - last_mean) * remaining / (last_weight / 2)
+
+    def encode(self):
+        # 头部 + 质心均值(float32) + 质心权重(uint32)，约8字节/质心
+        self._compress()
+        means = array('f', [mean for mean, weight in self.centroids])
+        weights = array('I', [int(weight) for mean, weight in self.centroids])
+        return _HEADER.pack(self.compression, self.min, self.max) + means.tobytes() + weights.tobytes()
+
+    @classmethod
+    def decode(cls, payload):
+        compression, minimum, maximum = _HEADER.unpack_from(payload)
+        body = payload[_HEADER.size:]
+        means = array('f')
+        means.frombytes(body[:len(body) // 2])
+        weights = array('I')
+        weights.frombytes(body[len(body) // 2:])
+        digest = cls(compression)
+        digest.centroids = list(zip(means, weights))
+        digest.min = minimum
+        digest.max = maximum
+        return digest
+
+
+def loan_days(borrow):
+    return (borrow.return_time - borrow.borrow_time).total_seconds() / 86400
+
+
+def percentiles(digest):
+    return {name: round(digest.quantile(q), 2) for name, q in LOAN_PERCENTILES.items()}
+
+# 归还时记录借阅时长(暂存在会话中，提交前合并写入，回滚时丢弃)
+
+
+def record_loan(borrow, book):
+    pending = db.session.info.setdefault('duration_pending', {})
+    days = loan_days(borrow)
+    for key in (('book', str(book.id)), ('category', book.category)):
+        pending.setdefault(key, []).append(days)
+
+
+_insert_empty = insert(LoanDurationDigest.__table__).prefix_with(
+    'IGNORE', dialect='mysql').prefix_with('OR IGNORE', dialect='sqlite')
+
+# 提交前锁定摘要行并合并：固定顺序加锁，与每日统计一样只在提交前短暂持有
+
+
+@event.listens_for(db.session, 'before_commit')
+def _flush_durations(session):
+    pending = session.info.pop('duration_pending', None)
+    if not pending:
+        return
+    for (kind, key), values in sorted(pending.items()):
+        # 先插入空摘要(已存在则忽略)，并发的首次归还不会因主键冲突失败
+        session.execute(_insert_empty, {'kind': kind, 'key': key, 'count': 0,
+                                        'digest': TDigest().encode(), 'updated_at': datetime.now()})
+        row = session.query(LoanDurationDigest).filter_by(
+            kind=kind, key=key).with_for_update().populate_existing().one()
+        digest = TDigest.decode(row.digest)
+        for value in values:
+            digest.add(value)
+        row.count += len(values)
+        row.digest = digest.encode()
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_durations(session):
+    session.info.pop('duration_pending', None)
+
+# 分类重命名或合并时把旧分类的摘要并入新分类(不提交事务)
+
+
+def merge_category_digests(old_category, new_category):
+    if old_category == new_category:
+        return
+    rows = {row.key: row for row in db.session.query(LoanDurationDigest).filter(
+        LoanDurationDigest.kind == 'category',
+        LoanDurationDigest.key.in_([old_category, new_category])
+    ).order_by(LoanDurationDigest.key).with_for_update().all()}
+    old_row = rows.pop(old_category, None)
+    if old_row is None:
+        return
+    new_row = rows.get(new_category)
+    if new_row is None:
+        db.session.add(LoanDurationDigest(kind='category', key=new_category,
+                                          count=old_row.count, digest=old_row.digest))
+    else:
+        digest = TDigest.decode(new_row.digest)
+        digest.merge(TDigest.decode(old_row.digest))
+        new_row.count += old_row.count
+        new_row.digest = digest.encode()
+    db.session.delete(old_row)
+
+# 按借阅历史(在线表+归档表)中已归还的记录重建全部摘要：一次流式读取
+
+
+def rebuild_digests():
+    history = borrow_history(status=1)
+    stmt = select(history.c.borrow_time, history.c.return_time, history.c.book_id, Book.category).join(
+        Book, Book.id == history.c.book_id).where(history.c.deleted_at == None)
+    digests = {}
+    # 读取使用独立连接上的服务端游标
+    with db.engine.connect() as conn:
+        result = conn.execution_options(yield_per=5000).execute(stmt)
+        for rows in result.partitions():
+            for row in rows:
+                days = loan_days(row)
+                for key in (('book', str(row.book_id)), ('category', row.category)):
+                    digest = digests.get(key)
+                    if digest is None:
+                        digest = digests[key] = TDigest()
+                    digest.add(days)
+
+    try:
+        db.session.execute(delete(LoanDurationDigest))
+        for (kind, key), digest in digests.items():
+            db.session.add(LoanDurationDigest(kind=kind, key=key, count=digest.count, digest=digest.encode()))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return len(digests)
+
+# 命令行：重建借阅时长摘要(首次上线回填)
+
+
+@durations_bp.cli.command('rebuild')
+def rebuild_command():
+    """按已归还的借阅记录重建每本书和每个分类的借阅时长摘要"""
+    click.echo(f'已重建 {rebuild_digests()} 个借阅时长摘要')
@@ -0,0 +1,143 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from database import db
+
+# 默认每条查询从开始执行起的超时时间(秒)，可通过配置项QUERY_FANOUT_TIMEOUT覆盖
+DEFAULT_TIMEOUT = 10
+# 默认并发执行查询的线程数(即同时占用的连接数上限，应小于连接池大小)，可通过配置项QUERY_FANOUT_WORKERS覆盖
+DEFAULT_WORKERS = 4
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class QueryTimeout(Exception):
+    # 并发查询未在整体超时时间内全部完成
+    pass
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=current_app.config.get('QUERY_FANOUT_WORKERS', DEFAULT_WORKERS),
+                thread_name_prefix='query-fanout')
+        return _executor
+
+
+def _statement(query):
+    # 接受db.session.query(...)或Core语句
+    return getattr(query, 'statement', query)
+
+
+def fetch_scalar(query):
+    stmt = _statement(query)
+    return lambda conn: conn.execute(stmt).scalar()
+
+
+def fetch_one(query):
+    stmt = _statement(query)
+    return lambda conn: conn.execute(stmt).one()
+
+
+def fetch_first(query):
+    stmt = _statement(query)
+    return lambda conn: conn.execute(stmt).first()
+
+
+def fetch_all(query):
+    stmt = _statement(query)
+    return lambda conn: conn.execute(stmt).all()
+
+
+def _interrupt(conn):
+    # 在数据库端中断连接上正在执行的语句(语句已结束时没有影响)
+    driver_connection = conn.connection.driver_connection
+    try:
+        if conn.dialect.name == 'sqlite':
+            driver_connection.interrupt()
+        elif conn.dialect.name == 'mysql':
+            with conn.engine.connect() as killer:
+                killer.exec_driver_sql(f'KILL QUERY {int(driver_connection.thread_id())}')
+        elif conn.dialect.name == 'postgresql':
+            driver_connection.cancel()
+    except Exception:
+        pass
+
+# 并发执行互不依赖的只读查询：tasks为{名称: fetch_*(查询)}，返回{名称: 结果}
+# 每条查询使用连接池中的独立连接(各自的读快照)，总耗时约等于最慢的一条
+# 线程池为所有请求共用，超时按每条查询开始执行(取连接)起计时，在队列中排在其他请求之后等待的时间不计入
+# 任一查询出错或执行超过超时时间时取消其余查询：未开始的从队列中移除，执行中的在数据库端中断
+
+
+def fan_out(tasks, timeout=None):
+    if timeout is None:
+        timeout = current_app.config.get('QUERY_FANOUT_TIMEOUT', DEFAULT_TIMEOUT)
+    engine = db.engine
+    running = {}  # 名称 -> 正在执行查询的连接
+    started = {}  # 名称 -> 开始执行的时间
+    changed = threading.Condition()  # 查询开始或结束时通知等待的请求线程
+    cancelled = False
+
+    def run(name, fetch):
+        nonlocal cancelled
+        with changed:
+            if cancelled:
+                return None
+            started[name] = time.monotonic()
+            changed.notify_all()
+        with engine.connect() as conn:
+            with changed:
+                if cancelled:
+                    return None
+                running[name] = conn
+            try:
+                return fetch(conn)
+            except Exception:
+                # 出错时立即标记取消，本线程接着取到的同批查询不再执行
+                with changed:
+                    cancelled = True
+                raise
+            finally:
+                # 连接归还连接池之前注销，之后不会再被中断
+                with changed:
+                    running.pop(name, None)
+
+    def finished(future):
+        with changed:
+            changed.notify_all()
+
+    executor = _get_executor()
+    futures = {executor.submit(run, name, fetch): name for name, fetch in tasks.items()}
+    for future in futures:
+        future.add_done_callback(finished)
+
+    with changed:
+        while True:
+            failed = next((future for future in futures
+                           if future.done() and future.exception() is not None), None)
+            unfinished = [name for future, name in futures.items() if not future.done()]
+            if failed or not unfinished:
+                break
+            now = time.monotonic()
+            expired = [name for name in unfinished if name in started and now - started[name] >= timeout]
+            if expired:
+                break
+            # 等到最早开始的查询到期，或有查询开始/结束；都未开始时只等开始通知
+            deadlines = [started[name] + timeout for name in unfinished if name in started]
+            changed.wait(min(deadlines) - now if deadlines else None)
+
+        if failed or unfinished:
+            cancelled = True
+            for future in futures:
+                future.cancel()
+            for conn in running.values():
+                _interrupt(conn)
+    if failed:
+        raise failed.exception()
+    if unfinished:
+        raise QueryTimeout(f'查询执行超过{timeout}秒未完成：' + '、'.join(sorted(expired)))
+    return {name: future.result() for future, name in futures.items()}
@@ -0,0 +1,250 @@
+from datetime import date, datetime, time as dtime
+from decimal import Decimal, InvalidOperation
+import click
+from flask import Blueprint, jsonify, request, current_app
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from sqlalchemy import and_, func, insert, literal, select, update
+from database import db
+from models import Borrow, FineLedger, User
+from sql_funcs import days_between
+
+# 创建fines蓝图
+fines_bp = Blueprint('fines', __name__)
+
+# 默认每逾期一天的罚款(元)，可通过配置项FINE_PER_DAY覆盖
+DEFAULT_FINE_PER_DAY = '0.50'
+# 夜间计提每个事务处理的借阅记录数
+ACCRUE_BATCH_SIZE = 1000
+
+# 流水类型
+FINE_SETTLE = 0  # 归还结算
+FINE_ACCRUE = 1  # 逾期计提
+FINE_PAY = 2  # 缴纳
+FINE_WAIVE = 3  # 减免
+FINE_TYPE_TEXT = {FINE_SETTLE: '归还结算', FINE_ACCRUE: '逾期计提',
+                  FINE_PAY: '缴纳', FINE_WAIVE: '减免'}
+
+
+def fine_rate():
+    return Decimal(str(current_app.config.get('FINE_PER_DAY', DEFAULT_FINE_PER_DAY)))
+
+
+def overdue_days(due_at, now):
+    # 逾期天数按自然日计(到期当天归还不算逾期)，与罚款结算、夜间计提一致
+    return max((now.date() - due_at.date()).days, 0)
+
+
+def settle_fine(borrow, now):
+    # 归还时结算尚未计提的逾期天数，写入流水并返回新增金额(不提交事务)
+    # 用户余额由调用方与在借数量在同一条UPDATE中更新
+    days = overdue_days(borrow.due_at, now)
+    pending_days = days - borrow.fine_accrued_days
+    if pending_days <= 0:
+        return Decimal('0.00')
+    amount = fine_rate() * pending_days
+    db.session.add(FineLedger(user_id=borrow.user_id, borrow_id=borrow.id, type=FINE_SETTLE,
+                              days=pending_days, amount=amount, created_at=now))
+    borrow.fine_accrued_days = days
+    return amount
+
+# 夜间计提：为借阅中且已逾期的记录补记截至当天的罚款
+# 只扫描借阅中的记录(与历史总量无关)，按ID分批，每批三条集合式语句
+
+
+def accrue_fines(batch_size=ACCRUE_BATCH_SIZE, today=None):
+    now = datetime.now()
+    day_start = datetime.combine(today or date.today(), dtime.min)
+    rate = fine_rate()
+    days = days_between(literal(day_start, db.DateTime), Borrow.due_at)
+    pending = and_(
+        Borrow.status == 0,  # 借阅中
+        Borrow.deleted_at == None,
+        Borrow.due_at < day_start,
+        Borrow.fine_accrued_days < days
+    )
+    pending_days = days - Borrow.fine_accrued_days
+
+    accrued = 0
+    last_id = 0
+    while True:
+        ids = [row.id for row in db.session.query(Borrow.id).filter(
+            pending, Borrow.id > last_id
+        ).order_by(Borrow.id).limit(batch_size).all()]
+        if not ids:
+            break
+        last_id = ids[-1]
+        in_batch = and_(Borrow.id.in_(ids), pending)
+
+        try:
+            # 先锁借阅记录再更新用户，与归还的加锁顺序一致
+            db.session.query(Borrow.id).filter(in_batch).with_for_update().all()
+            db.session.execute(insert(FineLedger.__table__).from_select(
+                ['user_id', 'borrow_id', 'type', 'days', 'amount', 'created_at'],
+                select(Borrow.user_id, Borrow.id, literal(FINE_ACCRUE), pending_days,
+                       pending_days * literal(rate, db.Numeric(10, 2)),
+                       literal(now, db.DateTime)).where(in_batch)
+            ))
+            owed_days = select(func.coalesce(func.sum(pending_days), 0)).where(
+                Borrow.user_id == User.id, in_batch).scalar_subquery()
+            db.session.execute(
+                update(User).where(User.id.in_(select(Borrow.user_id).where(in_batch)))
+                .values(fine_balance=User.fine_balance + owed_days * literal(rate, db.Numeric(10, 2)))
+                .execution_options(synchronize_session=False))
+            result = db.session.execute(
+                update(Borrow).where(in_batch).values(fine_accrued_days=days)
+                .execution_options(synchronize_session=False))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        accrued += result.rowcount
+
+    return accrued
+
+# 按流水重算用户罚款余额(余额与流水不一致时修正)，返回修正的用户数
+
+
+def reconcile_fine_balances():
+    actual = select(func.coalesce(func.sum(FineLedger.amount), 0)).where(
+        FineLedger.user_id == User.id).scalar_subquery()
+    result = db.session.execute(
+        update(User).where(User.fine_balance != actual)
+        .values(fine_balance=actual)
+        .execution_options(synchronize_session=False))
+    db.session.commit()
+    return result.rowcount
+
+
+def _fine_summary(user):
+    # 余额直接读用户表，流水分页读取
+    page = request.args.get('page', 1, type=int)
+    per_page = request.args.get('per_page', 10, type=int)
+
+    entries = FineLedger.query.filter_by(user_id=user.id).order_by(
+        FineLedger.id.desc()).paginate(page=page, per_page=per_page, error_out=False)
+
+    entry_list = []
+    for entry in entries.items:
+        entry_list.append({
+            'id': entry.id,
+            'borrow_id': entry.borrow_id,
+            'type': entry.type,
+            'type_text': FINE_TYPE_TEXT.get(entry.type),
+            'days': entry.days,
+            'amount': float(entry.amount),
+            'note': entry.note,
+            'created_at': entry.created_at.isoformat()
+        })
+
+    return jsonify({
+        'user_id': user.id,
+        'fine_balance': float(user.fine_balance),
+        'entries': entry_list,
+        'total': entries.total,
+        'pages': entries.pages,
+        'current_page': entries.page
+    }), 200
+
+# 获取当前用户的罚款余额和流水
+
+
+@fines_bp.route('/me', methods=['GET'])
+@jwt_required()
+def get_my_fines():
+    current_user_id = get_jwt_identity()
+    user = User.query.filter_by(id=current_user_id, deleted_at=None).first()
+    if not user:
+        return jsonify({'message': '用户不存在或已被删除'}), 404
+    return _fine_summary(user)
+
+# 管理员获取用户的罚款余额和流水
+
+
+@fines_bp.route('/users/<int:user_id>', methods=['GET'])
+@jwt_required()
+def get_user_fines(user_id):
+    current_user_id = get_jwt_identity()
+    current_user = User.query.get(current_user_id)
+
+    # 检查是否是管理员
+    if not current_user or current_user.privilege != 1:
+        return jsonify({'message': '权限不足'}), 403
+
+    user = User.query.filter_by(id=user_id, deleted_at=None).first()
+    if not user:
+        return jsonify({'message': '用户不存在或已被删除'}), 404
+    return _fine_summary(user)
+
+# 管理员登记缴纳或减免罚款
+
+
+@fines_bp.route('/users/<int:user_id>/payments', methods=['POST'])
+@jwt_required()
+def add_payment(user_id):
+    current_user_id = get_jwt_identity()
+    current_user = User.query.get(current_user_id)
+
+    # 检查是否是管理员
+    if not current_user or current_user.privilege != 1:
+        return jsonify({'message': '权限不足'}), 403
+
+    data = request.get_json()
+    if not data or 'amount' not in data:
+        return jsonify({'message': '请提供金额'}), 400
+
+    fine_type = data.get('type', FINE_PAY)
+    if fine_type not in [FINE_PAY, FINE_WAIVE]:
+        return jsonify({'message': '类型必须是2(缴纳)或3(减免)'}), 400
+
+    try:
+        amount = Decimal(str(data['amount'])).quantize(Decimal('0.01'))
+    except (InvalidOperation, ValueError):
+        return jsonify({'message': '金额格式不正确'}), 400
+    if amount <= 0:
+        return jsonify({'message': '金额必须大于0'}), 400
+
+    user = User.query.filter_by(id=user_id, deleted_at=None).first()
+    if not user:
+        return jsonify({'message': '用户不存在或已被删除'}), 404
+
+    try:
+        # 条件更新：余额不足时不扣减，避免并发登记把余额扣成负数
+        result = db.session.execute(
+            update(User).where(User.id == user_id, User.fine_balance >= amount)
+            .values(fine_balance=User.fine_balance - amount)
+            .execution_options(synchronize_session=False))
+        if result.rowcount != 1:
+            db.session.rollback()
+            return jsonify({'message': '金额超过未缴罚款余额'}), 400
+
+        entry = FineLedger(user_id=user_id, type=fine_type, days=0, amount=-amount,
+                           note=str(data.get('note') or '')[:200] or None)
+        db.session.add(entry)
+        db.session.commit()
+
+        db.session.refresh(user)
+        return jsonify({
+            'message': '登记成功',
+            'entry_id': entry.id,
+            'fine_balance': float(user.fine_balance)
+        }), 201
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': '登记失败', 'error': str(e)}), 500
+
+# 命令行：夜间计提逾期罚款(建议每天凌晨执行)
+
+
+@fines_bp.cli.command('accrue')
+@click.option('--batch-size', default=ACCRUE_BATCH_SIZE, show_default=True, help='每个事务处理的借阅记录数')
+def accrue_command(batch_size):
+    """为借阅中且已逾期的记录计提截至当天的罚款"""
+    click.echo(f'已为 {accrue_fines(batch_size)} 条逾期借阅计提罚款')
+
+# 命令行：按流水校正用户罚款余额
+
+
+@fines_bp.cli.command('reconcile')
+def reconcile_command():
+    """按罚款流水重算每个用户的未缴余额"""
+    click.echo(f'已校正 {reconcile_fine_balances()} 个用户的罚款余额')
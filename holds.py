@@ -0,0 +1,399 @@
+from datetime import datetime, timedelta
+import click
+from flask import Blueprint, jsonify, request, current_app
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from sqlalchemy import func, insert, update
+from database import db
+from models import Book, Borrow, Hold, HoldQueueNode, Notification, User
+from inventory import take_stock, put_stock, book_stock
+from notifications import NOTIFY_HOLD_READY
+
+# 创建holds蓝图
+holds_bp = Blueprint('holds', __name__)
+
+# 每本书排队序号的上限(树状数组大小)，查询/更新最多访问log2(上限)=20个节点
+HOLD_QUEUE_CAPACITY = 1 << 20
+# 默认取书期限(小时)，可通过配置项HOLD_PICKUP_HOURS覆盖
+DEFAULT_PICKUP_HOURS = 48
+# 每次处理的过期预约数
+EXPIRE_BATCH_SIZE = 500
+
+# 预约状态
+HOLD_WAITING = 0
+HOLD_READY = 1
+HOLD_FULFILLED = 2
+HOLD_CANCELLED = 3
+HOLD_EXPIRED = 4
+HOLD_STATUS_TEXT = {HOLD_WAITING: '排队中', HOLD_READY: '待取书', HOLD_FULFILLED: '已借出',
+                    HOLD_CANCELLED: '已取消', HOLD_EXPIRED: '已过期'}
+
+
+# 排队人数树状数组(按书存储，只保存非零节点)：排队/出队时更新，查询位置为前缀和
+
+
+def _tree_add(book_id, queue_no, delta):
+    nodes = []
+    i = queue_no
+    while i <= HOLD_QUEUE_CAPACITY:
+        nodes.append(i)
+        i += i & -i
+    existing = {row.node for row in db.session.query(HoldQueueNode.node).filter(
+        HoldQueueNode.book_id == book_id,
+        HoldQueueNode.node.in_(nodes)
+    ).all()}
+    if existing:
+        db.session.execute(
+            update(HoldQueueNode).where(
+                HoldQueueNode.book_id == book_id,
+                HoldQueueNode.node.in_(existing)
+            ).values(count=HoldQueueNode.count + delta)
+            .execution_options(synchronize_session=False))
+    missing = [node for node in nodes if node not in existing]
+    if missing:
+        db.session.execute(insert(HoldQueueNode.__table__), [
+            {'book_id': book_id, 'node': node, 'count': delta} for node in missing])
+
+
+def queue_position(book_id, queue_no):
+    # 排在该序号及之前的排队人数(即排队位置，从1开始)，一次主键查询最多20行
+    nodes = []
+    i = queue_no
+    while i > 0:
+        nodes.append(i)
+        i &= i - 1
+    return db.session.query(func.coalesce(func.sum(HoldQueueNode.count), 0)).filter(
+        HoldQueueNode.book_id == book_id,
+        HoldQueueNode.node.in_(nodes)
+    ).scalar()
+
+
+def _lock_book(book_id):
+    # 预约的排队/取消/分配都先锁定图书行，同一本书的队列操作串行执行
+    return Book.query.filter_by(id=book_id, deleted_at=None).with_for_update().first()
+
+
+def _make_ready(hold, book, now):
+    # 队首出队，分配到书并写入到书提醒
+    pickup_hours = current_app.config.get(
+        'HOLD_PICKUP_HOURS', DEFAULT_PICKUP_HOURS)
+    hold.status = HOLD_READY
+    hold.ready_at = now
+    hold.expires_at = now + timedelta(hours=pickup_hours)
+    _tree_add(hold.book_id, hold.queue_no, -1)
+
+    user = db.session.get(User, hold.user_id)
+    db.session.execute(insert(Notification.__table__), {
+        'user_id': hold.user_id,
+        'hold_id': hold.id,
+        'type': NOTIFY_HOLD_READY,
+        'notify_date': now.date(),
+        'email': user.email,
+        'phone': user.phone,
+        'message': f'您预约的《{book.name}》已为您保留，请于{hold.expires_at.strftime("%Y-%m-%d %H:%M")}前借阅'[:255],
+        'status': 0,
+        'created_at': now
+    })
+
+# 预约共用函数(不提交事务，由调用方提交)
+
+
+def allocate_copy(book, now):
+    # 库存已放回后调用：有人排队时把一本库存重新扣出分配给队首，返回分配到的预约
+    head = Hold.query.filter_by(book_id=book.id, status=HOLD_WAITING).order_by(
+        Hold.queue_no).with_for_update().first()
+    if not head or not take_stock(book.id, book.stock_shards):
+        return None
+    _make_ready(head, book, now)
+    return head
+
+
+def fill_holds(book, now):
+    # 库存增加后调用：依次把在架库存分配给排队的预约，直到无人排队或无库存，返回分配数
+    allocated = 0
+    while allocate_copy(book, now):
+        allocated += 1
+    return allocated
+
+
+def claim_hold(user_id, book_id, now):
+    # 借阅时库存不足，若该用户有待取的预约则使用为其保留的那本
+    result = db.session.execute(
+        update(Hold).where(
+            Hold.user_id == user_id,
+            Hold.book_id == book_id,
+            Hold.status == HOLD_READY,
+            Hold.expires_at > now
+        ).values(status=HOLD_FULFILLED, closed_at=now)
+        .execution_options(synchronize_session=False))
+    return result.rowcount == 1
+
+
+def close_waiting_hold(user_id, book_id, now):
+    # 借到在架库存时，该用户对这本书仍在排队的预约随之完成并出队
+    hold = Hold.query.filter_by(user_id=user_id, book_id=book_id,
+                                status=HOLD_WAITING).with_for_update().first()
+    if not hold:
+        return False
+    hold.status = HOLD_FULFILLED
+    hold.closed_at = now
+    _tree_add(book_id, hold.queue_no, -1)
+    return True
+
+
+def _release_copy(book, now):
+    # 待取的预约取消/过期：保留的书先放回库存，再分配给下一位
+    put_stock(book.id, book.stock_shards)
+    allocate_copy(book, now)
+
+# 过期未取的预约作废并把书分配给下一位；再补分配有库存却仍有人排队的图书
+# (分片图书归还时不锁图书行，与并发的预约交错时可能错过分配)
+
+
+def expire_holds(batch_size=EXPIRE_BATCH_SIZE):
+    now = datetime.now()
+    expired = 0
+    last_id = 0
+    while True:
+        candidates = db.session.query(Hold.id, Hold.book_id).filter(
+            Hold.status == HOLD_READY,
+            Hold.expires_at <= now,
+            Hold.id > last_id
+        ).order_by(Hold.id).limit(batch_size).all()
+        if not candidates:
+            break
+        last_id = candidates[-1].id
+
+        for candidate in candidates:
+            # 先锁图书行再锁预约，与排队/取消的加锁顺序一致
+            book = _lock_book(candidate.book_id)
+            hold = Hold.query.filter_by(id=candidate.id, status=HOLD_READY).filter(
+                Hold.expires_at <= now).with_for_update().first()
+            if hold:
+                hold.status = HOLD_EXPIRED
+                hold.closed_at = now
+                if book:
+                    _release_copy(book, now)
+                else:
+                    # 图书已删除，按原分片规则放回库存即可
+                    deleted = db.session.get(Book, candidate.book_id)
+                    put_stock(deleted.id, deleted.stock_shards)
+                expired += 1
+            db.session.commit()
+
+    promoted = 0
+    book_ids = [row.book_id for row in db.session.query(Hold.book_id).filter(
+        Hold.status == HOLD_WAITING).distinct().all()]
+    for book_id in book_ids:
+        book = _lock_book(book_id)
+        if book and book_stock(book) > 0:
+            promoted += fill_holds(book, now)
+        db.session.commit()
+
+    return expired, promoted
+
+
+def _hold_data(hold, book_name):
+    return {
+        'id': hold.id,
+        'book_id': hold.book_id,
+        'book_name': book_name,
+        'status': hold.status,
+        'status_text': HOLD_STATUS_TEXT.get(hold.status),
+        'position': queue_position(hold.book_id, hold.queue_no) if hold.status == HOLD_WAITING else None,
+        'created_at': hold.created_at.isoformat(),
+        'ready_at': hold.ready_at.isoformat() if hold.ready_at else None,
+        'expires_at': hold.expires_at.isoformat() if hold.expires_at else None
+    }
+
+# 预约图书(仅限无库存的图书)
+
+
+@holds_bp.route('/', methods=['POST'])
+@jwt_required()
+def place_hold():
+    current_user_id = get_jwt_identity()
+    data = request.get_json()
+
+    # 验证必填字段
+    if not data or 'book_id' not in data:
+        return jsonify({'message': '请提供书籍ID'}), 400
+
+    try:
+        book_id = int(data['book_id'])
+    except (TypeError, ValueError):
+        return jsonify({'message': '书籍ID必须是整数'}), 400
+
+    try:
+        # 检查用户是否存在且状态正常
+        user = User.query.filter_by(
+            id=current_user_id, deleted_at=None).first()
+        if not user:
+            return jsonify({'message': '用户不存在或已被删除'}), 404
+
+        if user.status != 0:
+            return jsonify({'message': '用户状态异常，无法预约图书'}), 403
+
+        book = _lock_book(book_id)
+        if not book:
+            db.session.rollback()
+            return jsonify({'message': '图书不存在或已被删除'}), 404
+
+        if book_stock(book) > 0:
+            db.session.rollback()
+            return jsonify({'message': '图书有库存，请直接借阅'}), 400
+
+        # 检查是否已借阅或已预约这本书
+        if Borrow.query.filter_by(user_id=user.id, book_id=book.id, status=0, deleted_at=None).first():
+            db.session.rollback()
+            return jsonify({'message': '您已经借阅了这本书'}), 400
+        if Hold.query.filter(Hold.user_id == user.id, Hold.book_id == book.id,
+                             Hold.status.in_([HOLD_WAITING, HOLD_READY])).first():
+            db.session.rollback()
+            return jsonify({'message': '您已经预约了这本书'}), 400
+
+        # 图书行已锁定，取最大序号加一不会冲突
+        last_no = db.session.query(func.max(Hold.queue_no)).filter(
+            Hold.book_id == book.id).scalar() or 0
+        if last_no >= HOLD_QUEUE_CAPACITY:
+            db.session.rollback()
+            return jsonify({'message': '该书预约人数已达上限'}), 400
+
+        hold = Hold()
+        hold.user_id = user.id
+        hold.book_id = book.id
+        hold.queue_no = last_no + 1
+        hold.status = HOLD_WAITING
+        hold.created_at = datetime.now()
+        db.session.add(hold)
+        _tree_add(book.id, hold.queue_no, 1)
+        db.session.commit()
+
+        return jsonify(dict(_hold_data(hold, book.name), message='预约成功')), 201
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': '预约失败', 'error': str(e)}), 500
+
+# 获取当前用户的预约
+
+
+@holds_bp.route('/', methods=['GET'])
+@jwt_required()
+def get_user_holds():
+    current_user_id = get_jwt_identity()
+
+    # 分页参数
+    page = request.args.get('page', 1, type=int)
+    per_page = request.args.get('per_page', 10, type=int)
+
+    # 状态筛选
+    status = request.args.get('status', type=int)
+
+    query = db.session.query(Hold, Book.name).join(Book, Book.id == Hold.book_id).filter(
+        Hold.user_id == current_user_id)
+    if status in HOLD_STATUS_TEXT:
+        query = query.filter(Hold.status == status)
+
+    holds = query.order_by(Hold.id.desc()).paginate(
+        page=page, per_page=per_page, error_out=False)
+
+    return jsonify({
+        'holds': [_hold_data(hold, book_name) for hold, book_name in holds.items],
+        'total': holds.total,
+        'pages': holds.pages,
+        'current_page': holds.page
+    }), 200
+
+# 查询单个预约(含排队位置)
+
+
+@holds_bp.route('/<int:hold_id>', methods=['GET'])
+@jwt_required()
+def get_hold(hold_id):
+    current_user_id = get_jwt_identity()
+
+    row = db.session.query(Hold, Book.name).join(Book, Book.id == Hold.book_id).filter(
+        Hold.id == hold_id,
+        Hold.user_id == current_user_id
+    ).first()
+    if not row:
+        return jsonify({'message': '预约不存在'}), 404
+
+    return jsonify(_hold_data(*row)), 200
+
+# 取消预约(待取书的预约取消后图书分配给下一位)
+
+
+@holds_bp.route('/<int:hold_id>', methods=['DELETE'])
+@jwt_required()
+def cancel_hold(hold_id):
+    current_user_id = get_jwt_identity()
+
+    hold = Hold.query.filter(
+        Hold.id == hold_id,
+        Hold.user_id == current_user_id,
+        Hold.status.in_([HOLD_WAITING, HOLD_READY])
+    ).first()
+    if not hold:
+        return jsonify({'message': '预约不存在或已结束'}), 404
+
+    try:
+        # 先锁图书行再锁预约，确认状态未变
+        book = _lock_book(hold.book_id)
+        hold = Hold.query.filter(
+            Hold.id == hold_id,
+            Hold.status.in_([HOLD_WAITING, HOLD_READY])
+        ).with_for_update().populate_existing().first()
+        if not hold:
+            db.session.rollback()
+            return jsonify({'message': '预约不存在或已结束'}), 404
+
+        now = datetime.now()
+        if hold.status == HOLD_WAITING:
+            _tree_add(hold.book_id, hold.queue_no, -1)
+        elif book:
+            _release_copy(book, now)
+        else:
+            deleted = db.session.get(Book, hold.book_id)
+            put_stock(deleted.id, deleted.stock_shards)
+        hold.status = HOLD_CANCELLED
+        hold.closed_at = now
+        db.session.commit()
+
+        return jsonify({'message': '预约已取消', 'hold_id': hold.id}), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': '取消预约失败', 'error': str(e)}), 500
+
+# 管理员触发过期预约处理
+
+
+@holds_bp.route('/expire', methods=['POST'])
+@jwt_required()
+def expire():
+    current_user_id = get_jwt_identity()
+    current_user = User.query.get(current_user_id)
+
+    # 检查是否是管理员
+    if not current_user or current_user.privilege != 1:
+        return jsonify({'message': '权限不足'}), 403
+
+    try:
+        expired, promoted = expire_holds()
+        return jsonify({
+            'message': '过期预约处理完成',
+            'expired_holds': expired,
+            'promoted_holds': promoted
+        }), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': '过期预约处理失败', 'error': str(e)}), 500
+
+# 命令行：处理过期未取的预约(建议每小时执行)
+
+
+@holds_bp.cli.command('expire')
+@click.option('--batch-size', default=EXPIRE_BATCH_SIZE, show_default=True, help='每次读取的过期预约数')
+def expire_command(batch_size):
+    """作废过期未取的预约，并把图书分配给排队的下一位"""
+    expired, promoted = expire_holds(batch_size)
+    click.echo(f'作废过期预约 {expired} 条，补分配 {promoted} 条')
@@ -0,0 +1,153 @@
+import hashlib
+import time
+from datetime import datetime, timedelta
+from functools import wraps
+import click
+from flask import Blueprint, Response, jsonify, request, current_app, make_response
+from flask_jwt_extended import get_jwt_identity
+from sqlalchemy import delete, update
+from sqlalchemy.exc import IntegrityError
+from database import db
+from models import IdempotencyKey
+
+# 创建idempotency蓝图(仅提供命令行)
+idempotency_bp = Blueprint('idempotency', __name__)
+
+# 幂等键默认保留时长（小时），可通过配置项IDEMPOTENCY_TTL_HOURS覆盖
+DEFAULT_TTL_HOURS = 24
+# 相同请求正在处理时最长等待秒数
+WAIT_SECONDS = 10
+# 等待时的轮询间隔(秒)
+POLL_INTERVAL = 0.05
+# 清理过期键时每个事务删除的条数
+PURGE_BATCH_SIZE = 1000
+
+
+def _fingerprint():
+    # 请求指纹：同一个键只能用于同一个请求
+    digest = hashlib.sha256()
+    digest.update(request.method.encode())
+    digest.update(request.path.encode())
+    digest.update(request.get_data())
+    return digest.hexdigest()
+
+
+def _replay(record):
+    response = Response(record.response_body, status=record.response_code,
+                        mimetype='application/json')
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _claim(user_id, key, request_hash):
+    # 插入处理中的幂等键(不提交，随业务事务一起提交)
+    # 并发的相同请求会阻塞在唯一索引上，直到首个请求提交后报重复键
+    now = datetime.now()
+    ttl = current_app.config.get('IDEMPOTENCY_TTL_HOURS', DEFAULT_TTL_HOURS)
+    record = IdempotencyKey(user_id=user_id, key=key, request_hash=request_hash, status=0,
+                            created_at=now, expires_at=now + timedelta(hours=ttl))
+    db.session.add(record)
+    try:
+        db.session.flush()
+        return record
+    except IntegrityError:
+        db.session.rollback()
+        return None
+
+
+def _existing(user_id, key):
+    # 读取已有的幂等键，处于处理中(业务已提交、响应尚未写回)时短暂等待
+    deadline = time.monotonic() + WAIT_SECONDS
+    while True:
+        record = IdempotencyKey.query.filter_by(user_id=user_id, key=key).first()
+        if not record or record.status == 1 or time.monotonic() >= deadline:
+            return record
+        db.session.rollback()  # 结束当前事务，下次读取最新数据
+        time.sleep(POLL_INTERVAL)
+
+# 幂等装饰器：请求带Idempotency-Key时，相同键的重试直接返回首次的响应
+# 只保存2xx响应，失败的请求可以用同一个键重试
+# 需放在jwt_required之后
+
+
+def idempotent(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if key is None:
+            return view(*args, **kwargs)
+        if not key or len(key) > 255:
+            return jsonify({'message': 'Idempotency-Key长度必须在1-255之间'}), 400
+
+        user_id = int(get_jwt_identity())
+        request_hash = _fingerprint()
+
+        record = _claim(user_id, key, request_hash)
+        if record is None:
+            existing = _existing(user_id, key)
+            if existing is not None and existing.expires_at <= datetime.now():
+                # 已过期但尚未清理，作废后按新请求处理
+                db.session.delete(existing)
+                db.session.commit()
+                record = _claim(user_id, key, request_hash)
+                existing = None if record else _existing(user_id, key)
+
+        if record is None:
+            if existing is None:
+                return jsonify({'message': '相同请求正在处理中，请稍后重试'}), 409
+            if existing.request_hash != request_hash:
+                return jsonify({'message': '该Idempotency-Key已用于其他请求'}), 422
+            if existing.status != 1:
+                return jsonify({'message': '相同请求正在处理中，请稍后重试'}), 409
+            return _replay(existing)
+
+        response = make_response(view(*args, **kwargs))
+
+        if 200 <= response.status_code < 300:
+            try:
+                # 业务事务已提交时键随之提交，这里写回响应
+                db.session.execute(update(IdempotencyKey).where(
+                    IdempotencyKey.user_id == user_id,
+                    IdempotencyKey.key == key
+                ).values(status=1, response_code=response.status_code,
+                         response_body=response.get_data(as_text=True)))
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+        else:
+            # 失败的请求不保存：回滚未提交的键，已提交的删除
+            db.session.rollback()
+            db.session.execute(delete(IdempotencyKey).where(
+                IdempotencyKey.user_id == user_id,
+                IdempotencyKey.key == key,
+                IdempotencyKey.status == 0
+            ))
+            db.session.commit()
+        return response
+    return wrapper
+
+# 分批删除过期的幂等键
+
+
+def purge_expired_keys(batch_size=PURGE_BATCH_SIZE):
+    purged = 0
+    while True:
+        ids = [row.id for row in db.session.query(IdempotencyKey.id).filter(
+            IdempotencyKey.expires_at <= datetime.now()
+        ).limit(batch_size).all()]
+        if not ids:
+            break
+        db.session.execute(delete(IdempotencyKey).where(
+            IdempotencyKey.id.in_(ids)))
+        db.session.commit()
+        purged += len(ids)
+    return purged
+
+# 命令行：清理过期的幂等键(建议每小时执行)
+
+
+@idempotency_bp.cli.command('purge')
+@click.option('--batch-size', default=PURGE_BATCH_SIZE, show_default=True, help='每个事务删除的条数')
+def purge_command(batch_size):
+    """删除超过保留时长的幂等键"""
+    click.echo(f'已清理过期幂等键 {purge_expired_keys(batch_size)} 条')
@@ -0,0 +1,618 @@
+import csv
+import io
+import json
+import random
+import threading
+import time
+from datetime import datetime
+from itertools import islice
+import click
+from flask import Blueprint, Response, jsonify, request, current_app
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from sqlalchemy import bindparam, func, or_, update
+from database import db
+from models import Book, BookStockShard, Borrow, Hold, User
+
+# 创建inventory蓝图
+inventory_bp = Blueprint('inventory', __name__)
+
+# 默认分片数
+DEFAULT_SHARD_COUNT = 8
+# 最大分片数
+MAX_SHARD_COUNT = 64
+# 库存盘点每个事务处理的条目数
+RECONCILE_CHUNK_SIZE = 500
+# 盘点报告的字段
+RECONCILE_REPORT_FIELDS = ['line', 'book_id', 'ISBN', 'status', 'message', 'counted_total',
+                           'expected_total', 'discrepancy', 'outstanding', 'stock_before', 'stock_after']
+
+
+class ReconcileError(Exception):
+    # 盘点的某一块处理失败：该块已回滚，之前的块已提交
+    def __init__(self, first_line, last_line, error):
+        super().__init__(f'第{first_line}~{last_line}行所在的块处理失败：{error}' if last_line
+                         else f'读取第{first_line}行起的盘点条目失败：{error}')
+        self.first_line = first_line
+        self.last_line = last_line
+        self.error = error
+
+
+# 库存操作共用函数(不提交事务，由调用方提交)
+
+
+def take_stock(book_id, stock_shards):
+    # 原子扣减一本库存，库存不足返回False
+    if not stock_shards:
+        # 单行库存：条件更新，库存不足时不会扣成负数
+        result = db.session.execute(
+            update(Book).where(Book.id == book_id, Book.stock > 0)
+            .values(stock=Book.stock - 1))
+        return result.rowcount == 1
+
+    # 分片库存：先随机路由到一个分片，多数情况下一条语句即可完成
+    shard_no = random.randrange(stock_shards)
+    if _take_from_shard(book_id, shard_no):
+        return True
+
+    # 该分片已空，改为在非空分片中随机重试
+    shard_nos = [row.shard_no for row in db.session.query(BookStockShard.shard_no).filter(
+        BookStockShard.book_id == book_id,
+        BookStockShard.stock > 0
+    ).all()]
+    random.shuffle(shard_nos)
+    for shard_no in shard_nos:
+        if _take_from_shard(book_id, shard_no):
+            return True
+    return False
+
+
+def _take_from_shard(book_id, shard_no):
+    result = db.session.execute(
+        update(BookStockShard).where(
+            BookStockShard.book_id == book_id,
+            BookStockShard.shard_no == shard_no,
+            BookStockShard.stock > 0
+        ).values(stock=BookStockShard.stock - 1))
+    return result.rowcount == 1
+
+
+def put_stock(book_id, stock_shards):
+    # 原子归还一本库存
+    if not stock_shards:
+        db.session.execute(
+            update(Book).where(Book.id == book_id)
+            .values(stock=Book.stock + 1))
+        return
+    db.session.execute(
+        update(BookStockShard).where(
+            BookStockShard.book_id == book_id,
+            BookStockShard.shard_no == random.randrange(stock_shards)
+        ).values(stock=BookStockShard.stock + 1))
+
+
+def book_stock(book):
+    # 获取单本图书的总库存(分片图书为各分片之和)
+    if not book.stock_shards:
+        return book.stock
+    return db.session.query(func.coalesce(func.sum(BookStockShard.stock), 0)).filter(
+        BookStockShard.book_id == book.id
+    ).scalar()
+
+
+def stock_totals(books):
+    # 批量获取图书总库存，返回{book_id: stock}；分片图书只用一条分组查询汇总
+    totals = {book.id: book.stock for book in books}
+    sharded_ids = [book.id for book in books if book.stock_shards]
+    if sharded_ids:
+        rows = db.session.query(
+            BookStockShard.book_id,
+            func.sum(BookStockShard.stock).label('stock')
+        ).filter(
+            BookStockShard.book_id.in_(sharded_ids)
+        ).group_by(BookStockShard.book_id).all()
+        for row in rows:
+            totals[row.book_id] = int(row.stock)
+    return totals
+
+
+def set_stock(book, stock):
+    # 设置图书总库存，分片图书均匀分配到各分片
+    if not book.stock_shards:
+        book.stock = stock
+        return
+    shards = BookStockShard.query.filter_by(book_id=book.id).order_by(
+        BookStockShard.shard_no).with_for_update().all()
+    _distribute(shards, stock)
+
+
+def rebalance_shards(book_id):
+    # 将分片库存重新均匀分配，返回总库存
+    shards = BookStockShard.query.filter_by(book_id=book_id).order_by(
+        BookStockShard.shard_no).with_for_update().all()
+    total = sum(shard.stock for shard in shards)
+    _distribute(shards, total)
+    return total
+
+
+def reshard(book, stock_shards):
+    # 修改图书的分片数(0表示关闭分片)，库存合计保持不变
+    shards = BookStockShard.query.filter_by(
+        book_id=book.id).with_for_update().all()
+    total = sum(shard.stock for shard in shards) if book.stock_shards else book.stock
+
+    for shard in shards:
+        db.session.delete(shard)
+    db.session.flush()
+
+    new_shards = []
+    for shard_no in range(stock_shards):
+        shard = BookStockShard()
+        shard.book_id = book.id
+        shard.shard_no = shard_no
+        new_shards.append(shard)
+    if new_shards:
+        _distribute(new_shards, total)
+        db.session.add_all(new_shards)
+
+    book.stock = 0 if stock_shards else total
+    book.stock_shards = stock_shards
+    return total
+
+
+def _distribute(shards, total):
+    base, extra = divmod(total, len(shards))
+    for index, shard in enumerate(shards):
+        shard.stock = base + (1 if index < extra else 0)
+
+
+def _shard_info(book):
+    shards = BookStockShard.query.filter_by(book_id=book.id).order_by(
+        BookStockShard.shard_no).all()
+    return {
+        'book_id': book.id,
+        'stock_shards': book.stock_shards,
+        'stock': sum(shard.stock for shard in shards) if book.stock_shards else book.stock,
+        'shards': [{'shard_no': shard.shard_no, 'stock': shard.stock} for shard in shards]
+    }
+
+# 查看图书库存分片
+
+
+@inventory_bp.route('/books/<int:book_id>/shards', methods=['GET'])
+@jwt_required()
+def get_book_shards(book_id):
+    current_user_id = get_jwt_identity()
+    current_user = User.query.get(current_user_id)
+
+    # 检查是否是管理员
+    if not current_user or current_user.privilege != 1:
+        return jsonify({'message': '权限不足'}), 403
+
+    book = Book.query.filter_by(id=book_id, deleted_at=None).first()
+    if not book:
+        return jsonify({'message': '图书不存在或已被删除'}), 404
+
+    return jsonify(_shard_info(book)), 200
+
+# 开启/调整/关闭图书库存分片
+
+
+@inventory_bp.route('/books/<int:book_id>/shards', methods=['PUT'])
+@jwt_required()
+def update_book_shards(book_id):
+    current_user_id = get_jwt_identity()
+    current_user = User.query.get(current_user_id)
+
+    # 检查是否是管理员
+    if not current_user or current_user.privilege != 1:
+        return jsonify({'message': '权限不足'}), 403
+
+    data = request.get_json()
+    if not data or 'stock_shards' not in data:
+        return jsonify({'message': '请提供分片数'}), 400
+
+    stock_shards = data['stock_shards']
+    if not isinstance(stock_shards, int) or stock_shards < 0 or stock_shards > MAX_SHARD_COUNT:
+        return jsonify({'message': f'分片数必须是0-{MAX_SHARD_COUNT}之间的整数'}), 400
+
+    try:
+        book = Book.query.filter_by(
+            id=book_id, deleted_at=None).with_for_update().first()
+        if not book:
+            return jsonify({'message': '图书不存在或已被删除'}), 404
+
+        reshard(book, stock_shards)
+        db.session.commit()
+        return jsonify({'message': '库存分片设置成功', **_shard_info(book)}), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': '库存分片设置失败', 'error': str(e)}), 500
+
+# 重新均衡图书库存分片
+
+
+@inventory_bp.route('/books/<int:book_id>/shards/rebalance', methods=['POST'])
+@jwt_required()
+def rebalance_book_shards(book_id):
+    current_user_id = get_jwt_identity()
+    current_user = User.query.get(current_user_id)
+
+    # 检查是否是管理员
+    if not current_user or current_user.privilege != 1:
+        return jsonify({'message': '权限不足'}), 403
+
+    book = Book.query.filter_by(id=book_id, deleted_at=None).first()
+    if not book:
+        return jsonify({'message': '图书不存在或已被删除'}), 404
+    if not book.stock_shards:
+        return jsonify({'message': '该图书未开启库存分片'}), 400
+
+    try:
+        rebalance_shards(book.id)
+        db.session.commit()
+        return jsonify({'message': '库存分片均衡成功', **_shard_info(book)}), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': '库存分片均衡失败', 'error': str(e)}), 500
+
+# 命令行：均衡所有分片图书的库存(可定时执行)
+
+
+@inventory_bp.cli.command('rebalance')
+def rebalance_command():
+    """均衡所有开启分片的图书库存"""
+    book_ids = [row.id for row in db.session.query(Book.id).filter(
+        Book.stock_shards > 0, Book.deleted_at == None).all()]
+    for book_id in book_ids:
+        rebalance_shards(book_id)
+        db.session.commit()
+    click.echo(f'已均衡 {len(book_ids)} 本图书的库存分片')
+
+# 命令行：对比单行库存与分片库存的并发借阅吞吐量
+
+
+@inventory_bp.cli.command('benchmark')
+@click.option('--threads', default=8, show_default=True, help='并发线程数(不宜超过连接池大小)')
+@click.option('--seconds', default=5.0, show_default=True, help='每种模式的压测时长(秒)')
+@click.option('--shards', default=DEFAULT_SHARD_COUNT, show_default=True, help='分片模式的分片数')
+def benchmark_command(threads, seconds, shards):
+    """对比单行库存与分片库存的并发扣减吞吐量"""
+    app = current_app._get_current_object()
+
+    # 创建临时压测图书
+    book = Book()
+    book.name = '__stock_benchmark__'
+    book.author = '-'
+    book.publisher = '-'
+    book.category = '-'
+    book.ISBN = 'BENCH' + str(random.randrange(10 ** 8)).zfill(8)
+    book.stock = 10 ** 8
+    db.session.add(book)
+    db.session.commit()
+    book_id = book.id
+
+    def run(stock_shards):
+        counts = []
+        deadline = time.perf_counter() + seconds
+
+        def worker():
+            done = 0
+            with app.app_context():
+                while time.perf_counter() < deadline:
+                    # 每次扣减一个独立事务，模拟并发借阅
+                    take_stock(book_id, stock_shards)
+                    db.session.commit()
+                    done += 1
+            counts.append(done)
+
+        workers = [threading.Thread(target=worker) for _ in range(threads)]
+        started = time.perf_counter()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        return sum(counts), sum(counts) / elapsed
+
+    try:
+        results = [('single-row', run(0))]
+        reshard(book, shards)
+        db.session.commit()
+        results.append((f'sharded({shards})', run(shards)))
+    finally:
+        # 清理临时压测数据
+        BookStockShard.query.filter_by(book_id=book_id).delete()
+        Book.query.filter_by(id=book_id).delete()
+        db.session.commit()
+
+    click.echo(f'{"模式":<14}{"线程":>6}{"扣减次数":>12}{"吞吐(次/秒)":>14}')
+    for name, (total, throughput) in results:
+        click.echo(f'{name:<14}{threads:>6}{total:>12}{throughput:>14.1f}')
+
+# 库存盘点
+# 盘点条目格式：book_id或ISBN二选一，stock(盘点得到的馆藏总数，含借出未还的册数)或delta(馆藏增减量)二选一
+# 盘点后在架库存 = 馆藏总数 - 借出未还数，馆藏总数少于借出未还数的条目会被拒绝
+
+
+def reconcile_stock(items, chunk_size=RECONCILE_CHUNK_SIZE, dry_run=False):
+    # 流式处理盘点条目，每chunk_size条一个事务，逐条产出盘点报告
+    # 某一块失败时回滚该块并抛出ReconcileError(含该块的行号范围)，已产出的报告对应已提交的块
+    iterator = enumerate(items, start=1)
+    first_line = 1
+    while True:
+        chunk = []
+        try:
+            chunk = list(islice(iterator, chunk_size))
+            if not chunk:
+                break
+            rows = _reconcile_chunk(chunk)
+            if dry_run:
+                db.session.rollback()
+            else:
+                db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            raise ReconcileError(first_line, chunk[-1][0] if chunk else None, e) from e
+        first_line = chunk[-1][0] + 1
+        yield from rows
+
+
+def _parse_item(raw):
+    # 解析单个盘点条目，返回(book_id, ISBN, mode, value)，格式错误抛出ValueError
+    if isinstance(raw, ValueError):
+        raise raw  # 读取时解析失败的行
+    if not isinstance(raw, dict):
+        raise ValueError('条目格式错误')
+    book_id = raw.get('book_id') or None
+    isbn = str(raw.get('ISBN') or '').strip() or None
+    if (book_id is None) == (isbn is None):
+        raise ValueError('book_id和ISBN必须且只能提供一个')
+    stock = raw.get('stock')
+    delta = raw.get('delta')
+    has_stock = stock not in (None, '')
+    has_delta = delta not in (None, '')
+    if has_stock == has_delta:
+        raise ValueError('stock和delta必须且只能提供一个')
+    try:
+        book_id = int(book_id) if book_id is not None else None
+        value = int(stock if has_stock else delta)
+    except (TypeError, ValueError):
+        raise ValueError('book_id、stock和delta必须是整数')
+    if has_stock and value < 0:
+        raise ValueError('馆藏总数必须是非负整数')
+    return book_id, isbn, 'stock' if has_stock else 'delta', value
+
+
+def _reconcile_chunk(chunk):
+    report = []
+    parsed = []
+    for line, raw in chunk:
+        try:
+            parsed.append((line, _parse_item(raw)))
+        except ValueError as e:
+            report.append({'line': line, 'status': 'invalid', 'message': str(e)})
+
+    # 一次查询锁定本块涉及的全部图书，单行库存图书的借还更新图书行，盘点期间会等待本事务提交
+    book_ids = {item[0] for _, item in parsed if item[0] is not None}
+    isbns = {item[1] for _, item in parsed if item[1] is not None}
+    books = []
+    if book_ids or isbns:
+        books = Book.query.filter(
+            or_(Book.id.in_(book_ids), Book.ISBN.in_(isbns)),
+            Book.deleted_at == None
+        ).with_for_update().all()
+    by_id = {book.id: book for book in books}
+    by_isbn = {book.ISBN: book for book in books}
+
+    # 分片图书的借还只更新分片行，不经过图书行：按(book_id, shard_no)顺序锁定其全部分片，
+    # 之后再统计借出未还数，库存与借出数来自同一时刻，并发借还等待本事务提交
+    stocks = {book.id: book.stock for book in books if not book.stock_shards}
+    sharded_ids = sorted(book.id for book in books if book.stock_shards)
+    if sharded_ids:
+        stocks.update({book_id: 0 for book_id in sharded_ids})
+        for shard in BookStockShard.query.filter(
+            BookStockShard.book_id.in_(sharded_ids)
+        ).order_by(BookStockShard.book_id, BookStockShard.shard_no).with_for_update().all():
+            stocks[shard.book_id] += shard.stock
+
+    # 分组查询统计各书借出未还数，为预约保留待取的图书同样不在架上
+    outstanding = dict(db.session.query(
+        Borrow.book_id, func.count(Borrow.id)
+    ).filter(
+        Borrow.book_id.in_(list(by_id)),
+        Borrow.status == 0,  # 借阅中
+        Borrow.deleted_at == None
+    ).group_by(Borrow.book_id).all()) if by_id else {}
+    if by_id:
+        for book_id, held in db.session.query(
+            Hold.book_id, func.count(Hold.id)
+        ).filter(
+            Hold.book_id.in_(list(by_id)),
+            Hold.status == 1  # 待取书
+        ).group_by(Hold.book_id).all():
+            outstanding[book_id] = outstanding.get(book_id, 0) + held
+
+    original = dict(stocks)
+    for line, (book_id, isbn, mode, value) in parsed:
+        book = by_id.get(book_id) if book_id is not None else by_isbn.get(isbn)
+        if not book:
+            report.append({'line': line, 'book_id': book_id, 'ISBN': isbn,
+                           'status': 'not_found', 'message': '图书不存在或已被删除'})
+            continue
+
+        # 同一块内同一本书的多个条目按顺序累计生效
+        borrowed = outstanding.get(book.id, 0)
+        expected_total = stocks[book.id] + borrowed
+        counted_total = value if mode == 'stock' else expected_total + value
+        row = {
+            'line': line,
+            'book_id': book.id,
+            'ISBN': book.ISBN,
+            'counted_total': counted_total,
+            'expected_total': expected_total,
+            'discrepancy': counted_total - expected_total,
+            'outstanding': borrowed,
+            'stock_before': stocks[book.id]
+        }
+        if counted_total < borrowed:
+            row.update(status='rejected', stock_after=stocks[book.id],
+                       message='馆藏总数不能少于借出未还数')
+        else:
+            stocks[book.id] = counted_total - borrowed
+            row.update(status='updated' if row['discrepancy'] else 'unchanged',
+                       stock_after=stocks[book.id], message='')
+        report.append(row)
+
+    # 单行库存的图书用一条批量UPDATE写回，分片图书按分片重新分配
+    now = datetime.now()
+    params = []
+    for book_id, stock in stocks.items():
+        if stock == original[book_id]:
+            continue
+        book = by_id[book_id]
+        if book.stock_shards:
+            set_stock(book, stock)
+        else:
+            params.append({'b_id': book_id, 'b_stock': stock})
+    if params:
+        table = Book.__table__
+        db.session.execute(
+            table.update().where(table.c.id == bindparam('b_id')).values(
+                stock=bindparam('b_stock'),
+                updated_at=now,
+                version=table.c.version + 1
+            ), params)
+
+    # 库存调高的图书分配给排队的预约(holds依赖本模块，延迟导入)
+    from holds import fill_holds
+    for book_id, stock in stocks.items():
+        if stock > original[book_id]:
+            fill_holds(by_id[book_id], now)
+
+    report.sort(key=lambda row: row['line'])
+    return report
+
+
+def _summarize(report):
+    summary = {'total': len(report), 'updated': 0, 'unchanged': 0,
+               'rejected': 0, 'not_found': 0, 'invalid': 0, 'net_discrepancy': 0}
+    for row in report:
+        summary[row['status']] += 1
+        summary['net_discrepancy'] += row.get('discrepancy') or 0
+    return summary
+
+
+def _read_items(stream, fmt):
+    # 从文本流读取盘点条目(csv或ndjson)
+    if fmt == 'csv':
+        yield from csv.DictReader(stream)
+        return
+    for text in stream:
+        if text.strip():
+            # 无法解析的行作为无效条目写入报告，不中断盘点
+            try:
+                yield json.loads(text)
+            except ValueError as e:
+                yield ValueError(f'JSON解析失败：{e}')
+
+
+def _report_csv(report):
+    output = io.StringIO()
+    writer = csv.DictWriter(output, fieldnames=RECONCILE_REPORT_FIELDS)
+    writer.writeheader()
+    writer.writerows(report)
+    return output.getvalue()
+
+# 管理员批量盘点库存
+# 请求体支持JSON数组(或{"items": [...]})、text/csv、application/x-ndjson
+
+
+@inventory_bp.route('/reconcile', methods=['POST'])
+@jwt_required()
+def reconcile():
+    current_user_id = get_jwt_identity()
+    current_user = User.query.get(current_user_id)
+
+    # 检查是否是管理员
+    if not current_user or current_user.privilege != 1:
+        return jsonify({'message': '权限不足'}), 403
+
+    dry_run = request.args.get('dry_run', 'false').lower() == 'true'
+    report_format = request.args.get('format', 'json')
+    chunk_size = request.args.get('chunk_size', RECONCILE_CHUNK_SIZE, type=int)
+    if chunk_size <= 0:
+        return jsonify({'message': 'chunk_size必须是正整数'}), 400
+
+    if request.mimetype in ('text/csv', 'application/x-ndjson'):
+        fmt = 'csv' if request.mimetype == 'text/csv' else 'ndjson'
+        items = _read_items(io.StringIO(
+            request.get_data(as_text=True)), fmt)
+    else:
+        data = request.get_json(silent=True)
+        items = data.get('items') if isinstance(data, dict) else data
+        if not isinstance(items, list) or not items:
+            return jsonify({'message': '请提供盘点条目'}), 400
+
+    report = []
+    try:
+        for row in reconcile_stock(items, chunk_size, dry_run):
+            report.append(row)
+    except ReconcileError as e:
+        # 返回已提交部分的报告和失败块的行号范围，修正后可只重新提交失败块及之后的条目
+        return jsonify({
+            'message': '库存盘点中途失败，失败块之前的条目已生效' if report and not dry_run else '库存盘点失败',
+            'error': str(e.error),
+            'dry_run': dry_run,
+            'failed_lines': {'from': e.first_line, 'to': e.last_line},
+            'summary': _summarize(report),
+            'report': report
+        }), 500
+
+    if report_format == 'csv':
+        return Response(_report_csv(report), mimetype='text/csv')
+    return jsonify({
+        'message': '库存盘点预览' if dry_run else '库存盘点完成',
+        'dry_run': dry_run,
+        'summary': _summarize(report),
+        'report': report
+    }), 200
+
+# 命令行：从文件批量盘点库存
+
+
+@inventory_bp.cli.command('reconcile')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'ndjson']), default=None,
+              help='文件格式(默认按扩展名判断)')
+@click.option('--chunk-size', default=RECONCILE_CHUNK_SIZE, show_default=True, help='每个事务处理的条目数')
+@click.option('--dry-run', is_flag=True, help='只生成盘点报告，不修改库存')
+@click.option('--report', 'report_path', type=click.Path(dir_okay=False), default=None,
+              help='盘点报告输出文件(csv，默认输出到标准输出)')
+def reconcile_command(path, fmt, chunk_size, dry_run, report_path):
+    """从csv/ndjson文件批量盘点库存并输出差异报告"""
+    fmt = fmt or ('ndjson' if path.endswith(('.ndjson', '.jsonl')) else 'csv')
+    summary = _summarize([])
+    failed = None
+    target = open(report_path, 'w', encoding='utf-8',
+                  newline='') if report_path else click.get_text_stream('stdout')
+    try:
+        with open(path, encoding='utf-8-sig', newline='') as source:
+            writer = csv.DictWriter(
+                target, fieldnames=RECONCILE_REPORT_FIELDS)
+            writer.writeheader()
+            # 报告逐行写出，大文件也不会整体读入内存
+            for row in reconcile_stock(_read_items(source, fmt), chunk_size, dry_run):
+                writer.writerow(row)
+                summary['total'] += 1
+                summary[row['status']] += 1
+                summary['net_discrepancy'] += row.get('discrepancy') or 0
+    except ReconcileError as e:
+        failed = e
+    finally:
+        if report_path:
+            target.close()
+    click.echo(('[预览] ' if dry_run else '') + json.dumps(summary, ensure_ascii=False), err=True)
+    if failed:
+        # 报告中已写出的条目对应已提交的块
+        click.echo(f'盘点中途失败：{failed}', err=True)
+        raise SystemExit(1)
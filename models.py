@@ -1,16 +1,17 @@
 # models.py
 from database import db
+from sqlalchemy.dialects import mysql
 from datetime import datetime, timezone
 # 时间戳mixin类
 
 
 class TimestampMixin:
     created_at = db.Column(
-        # 创建时间
-        db.DateTime, default=datetime.now(), nullable=False)
-    updated_at = db.Column(db.DateTime, default=datetime.now(),
+        # 创建时间(传入函数而非调用结果，否则所有记录都是进程启动时间)
+        db.DateTime, default=datetime.now, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.now,
                            # 更新时间
-                           onupdate=datetime.now(), nullable=False)
+                           onupdate=datetime.now, nullable=False)
     deleted_at = db.Column(db.DateTime, nullable=True)  # 软删除标记
 
 # 用户信息表
@@ -35,13 +36,25 @@ class User(db.Model, TimestampMixin):
     sex = db.Column(db.Integer, nullable=False)  # 性别(0:男,1:女,2:未知) 可改枚举
     age = db.Column(db.Integer)  # 年龄
     introduction = db.Column(db.String(200))  # 简介
+    version = db.Column(db.Integer, nullable=False,
+                        default=1, server_default='1')  # 版本号(乐观锁,对外暴露为ETag)
+    loan_period = db.Column(db.Integer)  # 借阅期限(天,为空时使用图书或系统默认值)
+    borrow_limit = db.Column(db.Integer)  # 同时在借上限(为空时使用系统默认值)
+    active_borrows = db.Column(db.Integer, nullable=False,
+                               default=0, server_default='0')  # 当前在借数量(借还时原子维护)
+    fine_balance = db.Column(db.Numeric(10, 2), nullable=False,
+                             default=0, server_default='0')  # 未缴罚款余额(与罚款流水同步维护)
 
     # 索引
     __table_args__ = (
         db.Index('idx_user_username', 'username'),
         db.Index('idx_user_email', 'email'),
         db.Index('idx_user_phone', 'phone'),
+        # 列存分析按updated_at增量刷新
+        db.Index('idx_user_updated_at', 'updated_at'),
     )
+    # 乐观锁：UPDATE时校验版本号，并发修改时抛出StaleDataError
+    __mapper_args__ = {'version_id_col': version}
 
     def soft_delete(self):
         self.deleted_at = datetime.now()
@@ -61,7 +74,12 @@ class Book(db.Model, TimestampMixin):
     category = db.Column(db.String(80), nullable=False)  # 分类
     introduction = db.Column(db.String(200))  # 简介
     ISBN = db.Column(db.String(13), unique=True, nullable=False)  # ISBN
-    stock = db.Column(db.Integer, nullable=False)  # 库存
+    stock = db.Column(db.Integer, nullable=False)  # 库存(启用分片库存后为0,以分片合计为准)
+    stock_shards = db.Column(db.Integer, nullable=False,
+                             default=0, server_default='0')  # 库存分片数(0:不分片)
+    version = db.Column(db.Integer, nullable=False,
+                        default=1, server_default='1')  # 版本号(乐观锁,对外暴露为ETag)
+    loan_period = db.Column(db.Integer)  # 借阅期限(天,为空时使用用户或系统默认值)
 
     # 索引
     __table_args__ = (
@@ -70,7 +88,11 @@ class Book(db.Model, TimestampMixin):
         db.Index('idx_book_publisher', 'publisher'),
         db.Index('idx_book_ISBN', 'ISBN'),
         db.Index('idx_book_category', 'category'),
+        # 列存分析按updated_at增量刷新
+        db.Index('idx_book_updated_at', 'updated_at'),
     )
+    # 乐观锁：UPDATE时校验版本号，并发修改时抛出StaleDataError
+    __mapper_args__ = {'version_id_col': version}
 
     def soft_delete(self):
         self.deleted_at = datetime.now()
@@ -90,6 +112,9 @@ class Borrow(db.Model, TimestampMixin):
         'book.id'), nullable=False)  # 书籍ID
     borrow_time = db.Column(db.DateTime, nullable=False)  # 借阅时间
     return_time = db.Column(db.DateTime, nullable=True)  # 归还时间
+    due_at = db.Column(db.DateTime, nullable=False)  # 应还时间(借阅时按借阅期限确定)
+    fine_accrued_days = db.Column(db.Integer, nullable=False,
+                                  default=0, server_default='0')  # 已计入罚款流水的逾期天数
     # 外键关联
     user = db.relationship('User', backref=db.backref('borrows', lazy=True))
     book = db.relationship('Book', backref=db.backref('borrows', lazy=True))
@@ -101,6 +126,12 @@ class Borrow(db.Model, TimestampMixin):
         db.Index('idx_borrow_user_id', 'user_id'),
         db.Index('idx_borrow_book_id', 'book_id'),
         db.Index('idx_borrow_status', 'status'),
+        # 逾期查询(status=0 AND due_at<now)走索引范围扫描
+        db.Index('idx_borrow_status_due_at', 'status', 'due_at'),
+        db.Index('idx_borrow_user_status_due_at',
+                 'user_id', 'status', 'due_at'),
+        # 列存分析按updated_at增量刷新
+        db.Index('idx_borrow_updated_at', 'updated_at'),
     )
 
     def soft_delete(self):
@@ -111,6 +142,357 @@ class Borrow(db.Model, TimestampMixin):
         return f'<Borrow {self.id}>'
 
 
+# 借阅归档表(超过保留期的已归还记录从borrow表迁移至此，保留原主键)
+
+
+class BorrowArchive(db.Model, TimestampMixin):
+    id = db.Column(db.Integer, primary_key=True,
+                   autoincrement=False)  # 主键(沿用原借阅记录ID)
+    user_id = db.Column(db.Integer, db.ForeignKey(
+        'user.id'), nullable=False)  # 用户ID
+    book_id = db.Column(db.Integer, db.ForeignKey(
+        'book.id'), nullable=False)  # 书籍ID
+    borrow_time = db.Column(db.DateTime, nullable=False)  # 借阅时间
+    return_time = db.Column(db.DateTime, nullable=False)  # 归还时间
+    due_at = db.Column(db.DateTime, nullable=False)  # 应还时间
+    status = db.Column(db.Integer, nullable=False,
+                       default=1)  # 状态(归档记录均为1:已归还)
+    archived_at = db.Column(db.DateTime, nullable=False)  # 归档时间
+    # 索引(历史查询按用户/图书取最近记录)
+    __table_args__ = (
+        db.Index('idx_borrow_archive_user_borrow_time',
+                 'user_id', 'borrow_time'),
+        db.Index('idx_borrow_archive_book_borrow_time',
+                 'book_id', 'borrow_time'),
+    )
+
+    def __repr__(self):
+        return f'<BorrowArchive {self.id}>'
+
+
+# 图书库存分片表(热门图书的库存拆分到多行,分散借阅时的行锁竞争)
+
+
+class BookStockShard(db.Model):
+    id = db.Column(db.Integer, primary_key=True)  # 主键
+    book_id = db.Column(db.Integer, db.ForeignKey(
+        'book.id'), nullable=False)  # 书籍ID
+    shard_no = db.Column(db.Integer, nullable=False)  # 分片编号(从0开始)
+    stock = db.Column(db.Integer, nullable=False, default=0)  # 分片库存
+
+    # 索引
+    __table_args__ = (
+        db.UniqueConstraint('book_id', 'shard_no',
+                            name='uq_book_stock_shard_book_no'),
+    )
+
+    def __repr__(self):
+        return f'<BookStockShard book_id={self.book_id} shard_no={self.shard_no}>'
+
+
+# 图书MinHash签名表(查重用，记录建立索引的时间以便增量处理)
+
+
+class BookSignature(db.Model):
+    book_id = db.Column(db.Integer, db.ForeignKey(
+        'book.id'), primary_key=True)  # 书籍ID
+    signature = db.Column(db.LargeBinary, nullable=False)  # MinHash签名(定长无符号32位整数序列)
+    indexed_at = db.Column(db.DateTime, nullable=False)  # 建立索引的时间
+
+    def __repr__(self):
+        return f'<BookSignature book_id={self.book_id}>'
+
+# 图书LSH分桶表(签名按band切分后哈希到桶，同桶的图书为候选重复)
+
+
+class BookLshBucket(db.Model):
+    id = db.Column(db.Integer, primary_key=True)  # 主键
+    book_id = db.Column(db.Integer, db.ForeignKey(
+        'book.id'), nullable=False)  # 书籍ID
+    band = db.Column(db.Integer, nullable=False)  # band编号
+    bucket = db.Column(db.BigInteger, nullable=False)  # 桶哈希值
+
+    # 索引
+    __table_args__ = (
+        db.Index('idx_lsh_bucket_bucket', 'bucket'),
+        db.Index('idx_lsh_bucket_book_id', 'book_id'),
+    )
+
+    def __repr__(self):
+        return f'<BookLshBucket band={self.band} book_id={self.book_id}>'
+
+# 疑似重复图书表(待管理员审核)
+
+
+class DuplicateCandidate(db.Model, TimestampMixin):
+    id = db.Column(db.Integer, primary_key=True)  # 主键
+    book_id = db.Column(db.Integer, db.ForeignKey(
+        'book.id'), nullable=False)  # 书籍ID(较小者)
+    other_book_id = db.Column(db.Integer, db.ForeignKey(
+        'book.id'), nullable=False)  # 疑似重复的书籍ID(较大者)
+    similarity = db.Column(db.Float, nullable=False)  # 估计的Jaccard相似度
+    status = db.Column(db.Integer, nullable=False,
+                       default=0)  # 状态(0:待审核, 1:确认重复, 2:不是重复) 可改枚举
+
+    # 索引
+    __table_args__ = (
+        db.UniqueConstraint('book_id', 'other_book_id',
+                            name='uq_duplicate_candidate_pair'),
+        db.Index('idx_duplicate_candidate_status', 'status'),
+    )
+
+    def __repr__(self):
+        return f'<DuplicateCandidate {self.book_id}-{self.other_book_id}>'
+
+
+# 系统计数器表(如目录写版本号，供各进程共享)
+
+
+class SystemCounter(db.Model):
+    name = db.Column(db.String(50), primary_key=True)  # 计数器名称
+    value = db.Column(db.BigInteger, nullable=False, default=0)  # 当前值
+
+    def __repr__(self):
+        return f'<SystemCounter {self.name}={self.value}>'
+
+# 统计结果共享缓存表(开启跨进程共享时，各进程从这里读取其他进程算好的结果)
+
+
+class CacheEntry(db.Model):
+    key = db.Column(db.String(191), primary_key=True)  # 缓存键
+    value = db.Column(db.Text().with_variant(mysql.LONGTEXT(), 'mysql'),
+                      nullable=False)  # 结果(JSON)，MySQL的TEXT最大64KB，使用LONGTEXT
+    computed_at = db.Column(db.BigInteger, nullable=False)  # 计算完成时间(毫秒时间戳)
+    refresh_until = db.Column(db.BigInteger, nullable=False,
+                              default=0)  # 后台刷新租约到期时间(毫秒时间戳)，租约内其他进程不重复刷新
+
+    def __repr__(self):
+        return f'<CacheEntry {self.key}>'
+
+# 预约表(图书无库存时排队，归还时把图书分配给队首)
+
+
+class Hold(db.Model):
+    id = db.Column(db.Integer, primary_key=True)  # 主键
+    user_id = db.Column(db.Integer, db.ForeignKey(
+        'user.id'), nullable=False)  # 用户ID
+    book_id = db.Column(db.Integer, db.ForeignKey(
+        'book.id'), nullable=False)  # 书籍ID
+    queue_no = db.Column(db.Integer, nullable=False)  # 该书的排队序号(递增)
+    status = db.Column(db.Integer, nullable=False,
+                       default=0)  # 状态(0:排队中,1:待取书,2:已借出,3:已取消,4:已过期)
+    created_at = db.Column(db.DateTime, nullable=False,
+                           default=datetime.now)  # 预约时间
+    ready_at = db.Column(db.DateTime)  # 分配到书的时间
+    expires_at = db.Column(db.DateTime)  # 取书截止时间
+    closed_at = db.Column(db.DateTime)  # 借出/取消/过期的时间
+    # 约束与索引
+    __table_args__ = (
+        db.UniqueConstraint('book_id', 'queue_no',
+                            name='uq_hold_book_queue_no'),
+        db.Index('idx_hold_book_status_queue_no',
+                 'book_id', 'status', 'queue_no'),
+        db.Index('idx_hold_user_book_status', 'user_id', 'book_id', 'status'),
+        db.Index('idx_hold_status_expires_at', 'status', 'expires_at'),
+    )
+
+    def __repr__(self):
+        return f'<Hold {self.id}>'
+
+# 预约队列树状数组节点表(按排队序号统计排队人数，查询排队位置为O(log n))
+
+
+class HoldQueueNode(db.Model):
+    book_id = db.Column(db.Integer, primary_key=True,
+                        autoincrement=False)  # 书籍ID
+    node = db.Column(db.Integer, primary_key=True,
+                     autoincrement=False)  # 树状数组下标
+    count = db.Column(db.Integer, nullable=False, default=0)  # 该节点覆盖区间内排队中的人数
+
+    def __repr__(self):
+        return f'<HoldQueueNode book_id={self.book_id} node={self.node}>'
+
+# 罚款流水表(余额为流水合计，用户表的fine_balance同步维护)
+
+
+class FineLedger(db.Model):
+    id = db.Column(db.Integer, primary_key=True)  # 主键
+    user_id = db.Column(db.Integer, db.ForeignKey(
+        'user.id'), nullable=False)  # 用户ID
+    borrow_id = db.Column(db.Integer)  # 借阅记录ID(缴纳/减免为空；借阅记录可能已归档，不设外键)
+    type = db.Column(db.Integer, nullable=False)  # 类型(0:归还结算,1:逾期计提,2:缴纳,3:减免)
+    days = db.Column(db.Integer, nullable=False, default=0)  # 本条计罚的逾期天数
+    amount = db.Column(db.Numeric(10, 2), nullable=False)  # 金额(正数为应缴，负数为缴纳/减免)
+    note = db.Column(db.String(200))  # 备注
+    created_at = db.Column(db.DateTime, nullable=False,
+                           default=datetime.now)  # 创建时间
+    # 索引
+    __table_args__ = (
+        db.Index('idx_fine_ledger_user_id', 'user_id', 'id'),
+    )
+
+    def __repr__(self):
+        return f'<FineLedger {self.id}>'
+
+# 批处理任务检查点表(记录当天处理到的位置，重跑时从断点继续)
+
+
+class JobCheckpoint(db.Model):
+    name = db.Column(db.String(50), primary_key=True)  # 任务名称
+    run_date = db.Column(db.Date, nullable=False)  # 检查点所属日期
+    cursor_time = db.Column(db.DateTime)  # 已处理到的排序时间
+    cursor_id = db.Column(db.Integer)  # 已处理到的记录ID(同一时间内的次序)
+    updated_at = db.Column(db.DateTime, nullable=False,
+                           default=datetime.now, onupdate=datetime.now)  # 更新时间
+
+    def __repr__(self):
+        return f'<JobCheckpoint {self.name}>'
+
+# 每日借阅统计表(按天×图书/用户/分类汇总借出和归还次数，借还时增量维护)
+
+
+class DailyBookStat(db.Model):
+    day = db.Column(db.Date, primary_key=True)  # 日期
+    book_id = db.Column(db.Integer, primary_key=True,
+                        autoincrement=False)  # 书籍ID
+    borrows = db.Column(db.Integer, nullable=False, default=0)  # 借出次数
+    returns = db.Column(db.Integer, nullable=False, default=0)  # 归还次数
+    overdue_returns = db.Column(
+        db.Integer, nullable=False, default=0)  # 逾期归还次数
+    # 索引
+    __table_args__ = (
+        db.Index('idx_daily_book_stat_book_day', 'book_id', 'day'),
+    )
+
+    def __repr__(self):
+        return f'<DailyBookStat {self.day} book_id={self.book_id}>'
+
+
+class DailyUserStat(db.Model):
+    day = db.Column(db.Date, primary_key=True)  # 日期
+    user_id = db.Column(db.Integer, primary_key=True,
+                        autoincrement=False)  # 用户ID
+    borrows = db.Column(db.Integer, nullable=False, default=0)  # 借出次数
+    returns = db.Column(db.Integer, nullable=False, default=0)  # 归还次数
+    overdue_returns = db.Column(
+        db.Integer, nullable=False, default=0)  # 逾期归还次数
+    # 索引
+    __table_args__ = (
+        db.Index('idx_daily_user_stat_user_day', 'user_id', 'day'),
+    )
+
+    def __repr__(self):
+        return f'<DailyUserStat {self.day} user_id={self.user_id}>'
+
+
+class DailyCategoryStat(db.Model):
+    day = db.Column(db.Date, primary_key=True)  # 日期
+    category = db.Column(db.String(80), primary_key=True)  # 分类(图书当前所属分类，改分类时随图书迁移)
+    borrows = db.Column(db.Integer, nullable=False, default=0)  # 借出次数
+    returns = db.Column(db.Integer, nullable=False, default=0)  # 归还次数
+    overdue_returns = db.Column(
+        db.Integer, nullable=False, default=0)  # 逾期归还次数
+
+    def __repr__(self):
+        return f'<DailyCategoryStat {self.day} {self.category}>'
+
+# 热门图书摘要表(按小时/天保存Space-Saving摘要，各进程定期合并写入，重启后从这里恢复)
+
+
+class TrendingSketch(db.Model):
+    granularity = db.Column(db.String(10), primary_key=True)  # 时间桶粒度(hour/day)
+    bucket_start = db.Column(db.DateTime, primary_key=True)  # 时间桶起始时间
+    payload = db.Column(db.Text, nullable=False)  # 摘要(JSON)
+    updated_at = db.Column(db.DateTime, nullable=False,
+                           default=datetime.now, onupdate=datetime.now)  # 更新时间
+
+    def __repr__(self):
+        return f'<TrendingSketch {self.granularity} {self.bucket_start}>'
+
+# 每日去重计数摘要表(按天保存借阅用户/被借图书的HyperLogLog寄存器，任意日期范围合并后估算去重数)
+
+
+class DailyDistinctSketch(db.Model):
+    day = db.Column(db.Date, primary_key=True)  # 日期
+    kind = db.Column(db.String(10), primary_key=True)  # 计数对象(user:借阅用户,book:被借图书)
+    registers = db.Column(db.LargeBinary, nullable=False)  # 寄存器(压缩编码)
+    updated_at = db.Column(db.DateTime, nullable=False,
+                           default=datetime.now, onupdate=datetime.now)  # 更新时间
+
+    def __repr__(self):
+        return f'<DailyDistinctSketch {self.day} {self.kind}>'
+
+# 借阅时长分布摘要表(按图书/分类保存t-digest，归还时合并更新，用于查询分位数)
+
+
+class LoanDurationDigest(db.Model):
+    kind = db.Column(db.String(10), primary_key=True)  # 维度(book:图书,category:分类)
+    key = db.Column(db.String(80), primary_key=True)  # 图书ID或分类名
+    count = db.Column(db.Integer, nullable=False, default=0)  # 已归还次数
+    digest = db.Column(db.LargeBinary, nullable=False)  # t-digest(二进制编码)
+    updated_at = db.Column(db.DateTime, nullable=False,
+                           default=datetime.now, onupdate=datetime.now)  # 更新时间
+
+    def __repr__(self):
+        return f'<LoanDurationDigest {self.kind} {self.key}>'
+
+# 通知发件箱表(到期/逾期提醒，由发送程序读取后投递)
+
+
+class Notification(db.Model):
+    id = db.Column(db.Integer, primary_key=True)  # 主键
+    user_id = db.Column(db.Integer, db.ForeignKey(
+        'user.id'), nullable=False)  # 用户ID
+    borrow_id = db.Column(db.Integer)  # 借阅记录ID(到期/逾期提醒)
+    hold_id = db.Column(db.Integer)  # 预约ID(预约到书提醒)
+    type = db.Column(db.Integer, nullable=False)  # 类型(0:即将到期,1:已逾期,2:预约到书)
+    notify_date = db.Column(db.Date, nullable=False)  # 提醒日期(同一借阅同类提醒每个日期只生成一条)
+    email = db.Column(db.String(120), nullable=False)  # 生成时的邮箱
+    phone = db.Column(db.String(11), nullable=False)  # 生成时的手机号
+    message = db.Column(db.String(255), nullable=False)  # 提醒内容
+    status = db.Column(db.Integer, nullable=False,
+                       default=0)  # 状态(0:待发送,1:已发送)
+    created_at = db.Column(db.DateTime, nullable=False,
+                           default=datetime.now)  # 创建时间
+    sent_at = db.Column(db.DateTime)  # 发送时间
+    # 约束与索引
+    __table_args__ = (
+        db.UniqueConstraint('borrow_id', 'type', 'notify_date',
+                            name='uq_notification_borrow_type_date'),
+        db.Index('idx_notification_status_id', 'status', 'id'),
+        db.Index('idx_notification_user_id', 'user_id', 'id'),
+    )
+
+    def __repr__(self):
+        return f'<Notification {self.id}>'
+
+# 幂等键表(客户端重试借还请求时直接返回首次请求的响应)
+
+
+class IdempotencyKey(db.Model):
+    id = db.Column(db.Integer, primary_key=True)  # 主键
+    user_id = db.Column(db.Integer, db.ForeignKey(
+        'user.id'), nullable=False)  # 用户ID
+    key = db.Column(db.String(255), nullable=False)  # 客户端提供的Idempotency-Key
+    request_hash = db.Column(db.String(64), nullable=False)  # 请求指纹(方法+路径+请求体)
+    status = db.Column(db.Integer, nullable=False,
+                       default=0)  # 状态(0:处理中,1:已完成)
+    response_code = db.Column(db.Integer)  # 首次请求的响应状态码
+    response_body = db.Column(db.Text)  # 首次请求的响应体
+    created_at = db.Column(db.DateTime, nullable=False,
+                           default=datetime.now)  # 创建时间
+    expires_at = db.Column(db.DateTime, nullable=False)  # 过期时间
+    # 约束与索引
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'key',
+                            name='uq_idempotency_key_user_key'),
+        db.Index('idx_idempotency_key_expires_at', 'expires_at'),
+    )
+
+    def __repr__(self):
+        return f'<IdempotencyKey {self.key}>'
+
+
 class TokenBlacklist(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     jti = db.Column(db.String(36), nullable=False, index=True)  # JWT的唯一标识符
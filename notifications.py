@@ -0,0 +1,195 @@
+from datetime import datetime, timedelta, time as dtime
+import click
+from flask import Blueprint, jsonify, request, current_app
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from sqlalchemy import and_, insert, or_, select
+from database import db
+from models import Book, Borrow, JobCheckpoint, Notification, User
+
+# 创建notifications蓝图
+notifications_bp = Blueprint('notifications', __name__)
+
+# 检查点名称
+SWEEP_JOB = 'notification_sweep'
+# 每批读取/写入的借阅记录数(内存占用只与批大小有关)
+SWEEP_CHUNK_SIZE = 1000
+# 到期前几天提醒，可通过配置项NOTIFY_DUE_SOON_DAYS覆盖
+DEFAULT_DUE_SOON_DAYS = 2
+# 逾期后每隔几天提醒一次(逾期第1天起)，可通过配置项NOTIFY_OVERDUE_INTERVAL_DAYS覆盖
+DEFAULT_OVERDUE_INTERVAL_DAYS = 7
+
+# 通知类型
+NOTIFY_DUE_SOON = 0
+NOTIFY_OVERDUE = 1
+NOTIFY_HOLD_READY = 2
+NOTIFY_TYPE_TEXT = {NOTIFY_DUE_SOON: '即将到期', NOTIFY_OVERDUE: '已逾期', NOTIFY_HOLD_READY: '预约到书'}
+
+# 批量写入发件箱，重跑时已存在的(借阅, 类型, 日期)由唯一约束忽略
+_insert_outbox = insert(Notification.__table__).prefix_with(
+    'IGNORE', dialect='mysql').prefix_with('OR IGNORE', dialect='sqlite')
+
+
+def _build_notification(row, now, today, due_soon_days, overdue_interval):
+    # 根据应还时间决定是否提醒，不需要提醒返回None
+    due_date = row.due_at.date()
+    if row.due_at >= now:
+        if (due_date - today).days > due_soon_days:
+            return None
+        # 即将到期：每个应还日期只提醒一次
+        kind, notify_date = NOTIFY_DUE_SOON, due_date
+        message = f'您借阅的《{row.book_name}》将于{due_date.isoformat()}到期，请及时归还'
+    else:
+        overdue_days = (today - due_date).days
+        if overdue_days < 1 or (overdue_days - 1) % overdue_interval:
+            return None
+        # 已逾期：逾期第1天提醒，之后每隔overdue_interval天提醒一次
+        kind, notify_date = NOTIFY_OVERDUE, today
+        message = f'您借阅的《{row.book_name}》已逾期{overdue_days}天，请尽快归还'
+
+    return {
+        'user_id': row.user_id,
+        'borrow_id': row.id,
+        'type': kind,
+        'notify_date': notify_date,
+        'email': row.email,
+        'phone': row.phone,
+        'message': message[:255]
+    }
+
+# 到期/逾期提醒扫描：按(应还时间, ID)顺序流式读取借阅中的记录，分批写入发件箱
+# 每批提交后记录检查点，当天重跑从断点继续，次日重新开始
+
+
+def sweep_notifications(chunk_size=SWEEP_CHUNK_SIZE, restart=False):
+    now = datetime.now()
+    today = now.date()
+    due_soon_days = current_app.config.get(
+        'NOTIFY_DUE_SOON_DAYS', DEFAULT_DUE_SOON_DAYS)
+    overdue_interval = current_app.config.get(
+        'NOTIFY_OVERDUE_INTERVAL_DAYS', DEFAULT_OVERDUE_INTERVAL_DAYS)
+    # 只需扫描应还时间早于提醒窗口结束的记录(走(status, due_at)索引)
+    horizon = datetime.combine(
+        today + timedelta(days=due_soon_days + 1), dtime.min)
+
+    checkpoint = db.session.get(JobCheckpoint, SWEEP_JOB)
+    if checkpoint is None:
+        checkpoint = JobCheckpoint(name=SWEEP_JOB, run_date=today)
+        db.session.add(checkpoint)
+    if restart or checkpoint.run_date != today:
+        checkpoint.run_date = today
+        checkpoint.cursor_time = None
+        checkpoint.cursor_id = None
+    db.session.commit()
+
+    stmt = select(
+        Borrow.id,
+        Borrow.user_id,
+        Borrow.due_at,
+        Book.name.label('book_name'),
+        User.email,
+        User.phone
+    ).join(User, User.id == Borrow.user_id).join(
+        Book, Book.id == Borrow.book_id
+    ).where(
+        Borrow.status == 0,  # 借阅中
+        Borrow.due_at < horizon,
+        Borrow.deleted_at == None,
+        User.deleted_at == None
+    )
+    if checkpoint.cursor_time is not None:
+        stmt = stmt.where(or_(
+            Borrow.due_at > checkpoint.cursor_time,
+            and_(Borrow.due_at == checkpoint.cursor_time,
+                 Borrow.id > checkpoint.cursor_id)
+        ))
+    stmt = stmt.order_by(Borrow.due_at, Borrow.id)
+
+    scanned = created = 0
+    # 读取使用独立连接上的服务端游标，写入和提交在会话连接上进行，互不影响
+    with db.engine.connect() as conn:
+        result = conn.execution_options(yield_per=chunk_size).execute(stmt)
+        for rows in result.partitions():
+            notifications = [notification for notification in (
+                _build_notification(row, now, today, due_soon_days, overdue_interval) for row in rows
+            ) if notification]
+            if notifications:
+                created += db.session.execute(_insert_outbox,
+                                              notifications).rowcount
+            checkpoint.cursor_time = rows[-1].due_at
+            checkpoint.cursor_id = rows[-1].id
+            db.session.commit()
+            scanned += len(rows)
+
+    return scanned, created
+
+# 获取当前用户的提醒
+
+
+@notifications_bp.route('/', methods=['GET'])
+@jwt_required()
+def get_user_notifications():
+    current_user_id = get_jwt_identity()
+
+    # 分页参数
+    page = request.args.get('page', 1, type=int)
+    per_page = request.args.get('per_page', 10, type=int)
+
+    notifications = Notification.query.filter_by(user_id=current_user_id).order_by(
+        Notification.id.desc()).paginate(page=page, per_page=per_page, error_out=False)
+
+    notification_list = []
+    for notification in notifications.items:
+        notification_list.append({
+            'id': notification.id,
+            'borrow_id': notification.borrow_id,
+            'hold_id': notification.hold_id,
+            'type': notification.type,
+            'type_text': NOTIFY_TYPE_TEXT.get(notification.type),
+            'message': notification.message,
+            'notify_date': notification.notify_date.isoformat(),
+            'created_at': notification.created_at.isoformat()
+        })
+
+    return jsonify({
+        'notifications': notification_list,
+        'total': notifications.total,
+        'pages': notifications.pages,
+        'current_page': notifications.page
+    }), 200
+
+# 管理员触发提醒扫描
+
+
+@notifications_bp.route('/sweep', methods=['POST'])
+@jwt_required()
+def sweep():
+    current_user_id = get_jwt_identity()
+    current_user = User.query.get(current_user_id)
+
+    # 检查是否是管理员
+    if not current_user or current_user.privilege != 1:
+        return jsonify({'message': '权限不足'}), 403
+
+    data = request.get_json(silent=True) or {}
+
+    try:
+        scanned, created = sweep_notifications(restart=bool(data.get('restart')))
+        return jsonify({
+            'message': '提醒扫描完成',
+            'scanned_borrows': scanned,
+            'new_notifications': created
+        }), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': '提醒扫描失败', 'error': str(e)}), 500
+
+# 命令行：生成到期/逾期提醒(建议每天执行)
+
+
+@notifications_bp.cli.command('sweep')
+@click.option('--chunk-size', default=SWEEP_CHUNK_SIZE, show_default=True, help='每批处理的借阅记录数')
+@click.option('--restart', is_flag=True, help='忽略当天的检查点，从头扫描')
+def sweep_command(chunk_size, restart):
+    """流式扫描借阅中的记录，把到期/逾期提醒写入发件箱"""
+    scanned, created = sweep_notifications(chunk_size, restart)
+    click.echo(f'扫描借阅记录 {scanned} 条，新增提醒 {created} 条')
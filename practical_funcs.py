@@ -31,3 +31,31 @@ def remove_html_tags(text):
     # 移除HTML标签
     clean = re.compile('<.*?>')
     return re.sub(clean, '', text)
+
+
+# 乐观锁：根据版本号生成ETag响应头
+
+
+def version_etag(version):
+    return {'ETag': f'"{version}"'}
+
+# 乐观锁：请求携带了If-Match且与当前版本号不一致时返回True(未携带则不校验)
+
+
+def if_match_failed(version):
+    from flask import request
+    if not request.if_match:
+        return False
+    return not request.if_match.contains(str(version))
+
+# 借阅期限校验：为空(使用默认值)或正整数天数
+
+
+def is_valid_loan_period(value):
+    return value is None or (isinstance(value, int) and not isinstance(value, bool) and 0 < value <= 365)
+
+# 借阅上限校验：为空(使用默认值)或1-100之间的整数
+
+
+def is_valid_borrow_limit(value):
+    return value is None or (isinstance(value, int) and not isinstance(value, bool) and 0 < value <= 100)
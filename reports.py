@@ -0,0 +1,427 @@
+import csv
+import io
+import json
+from datetime import datetime
+import click
+from flask import Blueprint, Response, jsonify, request, stream_with_context
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from sqlalchemy import and_, case, func, select
+from database import db
+from models import Book, User, LoanDurationDigest
+from inventory import stock_totals
+from archive import borrow_history
+from borrows import borrow_limit
+from durations import TDigest, percentiles
+from sql_funcs import days_between
+
+# 创建reports蓝图
+reports_bp = Blueprint('reports', __name__)
+
+# 每批计算的报表数：每批只执行固定几条分组查询
+REPORT_BATCH_SIZE = 500
+# 报表中的最近借阅记录数、借阅最多的用户数
+RECENT_BORROWS_LIMIT = 5
+TOP_BORROWERS_LIMIT = 5
+# CSV只输出汇总列(最近借阅等列表字段只在NDJSON中输出)，不存在的ID在message列说明
+USER_REPORT_FIELDS = ['user_id', 'username', 'name', 'total_borrows', 'returned_borrows', 'overdue_borrows',
+                      'current_overdue_borrows', 'current_borrows', 'borrow_limit', 'fine_balance',
+                      'overdue_rate', 'message']
+BOOK_REPORT_FIELDS = ['book_id', 'book_name', 'author', 'publisher', 'stock', 'total_borrows',
+                      'returned_borrows', 'current_borrows', 'avg_borrow_days',
+                      'loan_days_p50', 'loan_days_p90', 'loan_days_p99', 'message']
+# 批量报表支持的筛选条件
+USER_FILTERS = ['status', 'privilege']
+BOOK_FILTERS = ['category', 'author', 'publisher']
+
+
+# 用户报表的条件聚合列：总借阅、已归还、逾期归还和当前逾期次数(单个报表和批量报表共用)
+
+
+def user_report_columns(history, now):
+    returned = history.c.status == 1  # 已归还
+    return [
+        func.count(history.c.id).label('total_borrows'),
+        func.coalesce(func.sum(case((returned, 1), else_=0)), 0).label('returned_borrows'),
+        func.coalesce(func.sum(case((and_(returned, history.c.return_time > history.c.due_at), 1),
+                                    else_=0)), 0).label('overdue_borrows'),
+        func.coalesce(func.sum(case((and_(history.c.status == 0, history.c.due_at < now), 1),
+                                    else_=0)), 0).label('current_overdue_borrows')
+    ]
+
+# 图书报表的条件聚合列：总借阅、已归还、当前借阅中次数和平均借阅时长(天)
+
+
+def book_report_columns(history):
+    returned = history.c.status == 1  # 已归还
+    return [
+        func.count(history.c.id).label('total_borrows'),
+        func.coalesce(func.sum(case((returned, 1), else_=0)), 0).label('returned_borrows'),
+        func.coalesce(func.sum(case((history.c.status == 0, 1), else_=0)), 0).label('current_borrows'),
+        func.avg(case((returned, days_between(history.c.return_time, history.c.borrow_time)))
+                 ).label('avg_days')
+    ]
+
+
+def format_user_report(user, counts, recent_borrows, now):
+    returned_borrows = int(counts.returned_borrows) if counts else 0
+    overdue_borrows = int(counts.overdue_borrows) if counts else 0
+    current_overdue_borrows = int(counts.current_overdue_borrows) if counts else 0
+
+    # 计算逾期率
+    overdue_rate = 0
+    if returned_borrows > 0:
+        overdue_rate = round((overdue_borrows / returned_borrows) * 100, 2)
+
+    formatted_recent_borrows = []
+    for borrow in recent_borrows:
+        # 计算是否逾期
+        is_overdue = False
+        days_left = None
+        due_time = borrow.due_at
+
+        if borrow.status == 0:  # 借阅中
+            if now > due_time:
+                is_overdue = True
+                days_left = -((now - due_time).days)
+            else:
+                days_left = (due_time - now).days
+        elif borrow.return_time and borrow.return_time > due_time:
+            is_overdue = True
+
+        formatted_recent_borrows.append({
+            'borrow_id': borrow.id,
+            'book_name': borrow.book_name,
+            'borrow_time': borrow.borrow_time.isoformat(),
+            'return_time': borrow.return_time.isoformat() if borrow.return_time else None,
+            'status': borrow.status,
+            'status_text': '借阅中' if borrow.status == 0 else '已归还',
+            'is_overdue': is_overdue,
+            'days_left': days_left
+        })
+
+    return {
+        'user_id': user.id,
+        'username': user.username,
+        'name': user.name,
+        'total_borrows': counts.total_borrows if counts else 0,
+        'returned_borrows': returned_borrows,
+        'overdue_borrows': overdue_borrows + current_overdue_borrows,
+        'current_overdue_borrows': current_overdue_borrows,
+        'current_borrows': user.active_borrows,  # 借还时维护的计数，无需聚合
+        'borrow_limit': borrow_limit(user),
+        'fine_balance': float(user.fine_balance),  # 罚款余额随借还和夜间计提维护
+        'overdue_rate': overdue_rate,
+        'recent_borrows': formatted_recent_borrows
+    }
+
+
+def format_book_report(book, stock, counts, recent_borrows, top_borrowers, loan_percentiles):
+    avg_borrow_days = 0
+    if counts and counts.avg_days is not None:
+        avg_borrow_days = round(float(counts.avg_days), 2)
+
+    formatted_recent_borrows = []
+    for borrow in recent_borrows:
+        formatted_recent_borrows.append({
+            'borrow_id': borrow.id,
+            'username': borrow.username,
+            'user_name': borrow.user_name,
+            'borrow_time': borrow.borrow_time.isoformat(),
+            'return_time': borrow.return_time.isoformat() if borrow.return_time else None,
+            'status': borrow.status,
+            'status_text': '借阅中' if borrow.status == 0 else '已归还'
+        })
+
+    formatted_top_borrowers = []
+    for borrower in top_borrowers:
+        formatted_top_borrowers.append({
+            'user_id': borrower.id,
+            'username': borrower.username,
+            'user_name': borrower.user_name,
+            'borrow_count': borrower.borrow_count
+        })
+
+    return {
+        'book_id': book.id,
+        'book_name': book.name,
+        'author': book.author,
+        'publisher': book.publisher,
+        'stock': stock,
+        'total_borrows': counts.total_borrows if counts else 0,
+        'returned_borrows': int(counts.returned_borrows) if counts else 0,
+        'current_borrows': int(counts.current_borrows) if counts else 0,
+        'avg_borrow_days': avg_borrow_days,
+        'loan_days_percentiles': loan_percentiles,  # 借阅时长分位数(天)，由归还时维护的摘要给出
+        'recent_borrows': formatted_recent_borrows,
+        'top_borrowers': formatted_top_borrowers
+    }
+
+
+def _group_rows(rows, key):
+    grouped = {}
+    for row in rows:
+        grouped.setdefault(getattr(row, key), []).append(row)
+    return grouped
+
+
+def _ranked(stmt, partition, order_by, limit):
+    # 每组按order_by取前limit行(窗口函数)，一条查询完成整批
+    ranked = stmt.add_columns(
+        func.row_number().over(partition_by=partition, order_by=order_by).label('row_rank')).subquery()
+    return db.session.query(ranked).filter(ranked.c.row_rank <= limit).order_by(ranked.c.row_rank).all()
+
+# 一批用户的报表：用户、借阅统计、最近借阅各一条查询
+
+
+def _user_batch_reports(users, now):
+    user_ids = [user.id for user in users]
+    history = borrow_history(user_ids=user_ids)
+
+    counts = {row.user_id: row for row in db.session.query(
+        history.c.user_id, *user_report_columns(history, now)
+    ).filter(
+        history.c.deleted_at == None
+    ).group_by(history.c.user_id).all()}
+
+    recent = _group_rows(_ranked(
+        select(history.c.user_id, history.c.id, Book.name.label('book_name'), history.c.borrow_time,
+               history.c.return_time, history.c.due_at, history.c.status
+               ).join(Book, Book.id == history.c.book_id).where(
+            history.c.deleted_at == None,
+            Book.deleted_at == None),
+        history.c.user_id, (history.c.borrow_time.desc(), history.c.id.desc()), RECENT_BORROWS_LIMIT
+    ), 'user_id')
+
+    for user in users:
+        yield format_user_report(user, counts.get(user.id), recent.get(user.id, []), now)
+
+# 一批图书的报表：图书、库存、借阅统计、最近借阅、借阅最多的用户、借阅时长摘要各一条查询
+
+
+def _book_batch_reports(books):
+    book_ids = [book.id for book in books]
+    history = borrow_history(book_ids=book_ids)
+
+    counts = {row.book_id: row for row in db.session.query(
+        history.c.book_id, *book_report_columns(history)
+    ).filter(
+        history.c.deleted_at == None
+    ).group_by(history.c.book_id).all()}
+
+    recent = _group_rows(_ranked(
+        select(history.c.book_id, history.c.id, User.username, User.name.label('user_name'),
+               history.c.borrow_time, history.c.return_time, history.c.status
+               ).join(User, User.id == history.c.user_id).where(
+            history.c.deleted_at == None,
+            User.deleted_at == None),
+        history.c.book_id, (history.c.borrow_time.desc(), history.c.id.desc()), RECENT_BORROWS_LIMIT
+    ), 'book_id')
+
+    borrower_counts = select(
+        history.c.book_id, User.id, User.username, User.name.label('user_name'),
+        func.count(history.c.id).label('borrow_count')
+    ).join(User, User.id == history.c.user_id).where(
+        history.c.deleted_at == None,
+        User.deleted_at == None
+    ).group_by(history.c.book_id, User.id).subquery()
+    top = _group_rows(_ranked(
+        select(borrower_counts), borrower_counts.c.book_id,
+        (borrower_counts.c.borrow_count.desc(), borrower_counts.c.id), TOP_BORROWERS_LIMIT
+    ), 'book_id')
+
+    digests = {int(row.key): row for row in LoanDurationDigest.query.filter(
+        LoanDurationDigest.kind == 'book',
+        LoanDurationDigest.key.in_([str(book_id) for book_id in book_ids])
+    ).all()}
+    stocks = stock_totals(books)
+
+    for book in books:
+        digest = digests.get(book.id)
+        yield format_book_report(
+            book, stocks[book.id], counts.get(book.id), recent.get(book.id, []), top.get(book.id, []),
+            percentiles(TDigest.decode(digest.digest)) if digest and digest.count else None)
+
+
+def _batches(model, columns, ids, filters, batch_size):
+    # 指定ID时按ID分批(不存在或已删除的ID单独返回)，否则按筛选条件以ID游标分页
+    query = db.session.query(*columns).filter(model.deleted_at == None)
+    for name, value in filters.items():
+        query = query.filter(getattr(model, name) == value)
+
+    if ids is not None:
+        ids = sorted(set(ids))
+        for start in range(0, len(ids), batch_size):
+            chunk = ids[start:start + batch_size]
+            rows = query.filter(model.id.in_(chunk)).order_by(model.id).all()
+            yield rows, sorted(set(chunk) - {row.id for row in rows})
+        return
+
+    last_id = 0
+    while True:
+        rows = query.filter(model.id > last_id).order_by(model.id).limit(batch_size).all()
+        if not rows:
+            return
+        yield rows, []
+        last_id = rows[-1].id
+
+# 批量生成用户报表(逐条返回)，ids为空时按筛选条件生成全部未删除用户的报表
+
+
+def user_reports(ids=None, filters=None, batch_size=REPORT_BATCH_SIZE):
+    columns = [User.id, User.username, User.name, User.borrow_limit, User.active_borrows, User.fine_balance]
+    for users, missing in _batches(User, columns, ids, filters or {}, batch_size):
+        yield from _user_batch_reports(users, datetime.now())
+        for user_id in missing:
+            yield {'user_id': user_id, 'message': '用户不存在或已被删除'}
+
+# 批量生成图书报表(逐条返回)，ids为空时按筛选条件生成全部未删除图书的报表
+
+
+def book_reports(ids=None, filters=None, batch_size=REPORT_BATCH_SIZE):
+    columns = [Book.id, Book.name, Book.author, Book.publisher, Book.stock, Book.stock_shards]
+    for books, missing in _batches(Book, columns, ids, filters or {}, batch_size):
+        yield from _book_batch_reports(books)
+        for book_id in missing:
+            yield {'book_id': book_id, 'message': '图书不存在或已被删除'}
+
+
+def _csv_row(report):
+    loan_percentiles = report.get('loan_days_percentiles') or {}
+    return dict(report, **{f'loan_days_{name}': value for name, value in loan_percentiles.items()})
+
+
+def _write_reports(reports, fmt, fields):
+    # 逐条输出报表文本(ndjson每行一条；csv只含汇总列)
+    if fmt == 'ndjson':
+        for report in reports:
+            yield json.dumps(report, ensure_ascii=False) + '\n'
+        return
+    output = io.StringIO()
+    writer = csv.DictWriter(output, fieldnames=fields, extrasaction='ignore')
+    writer.writeheader()
+    yield output.getvalue()
+    for report in reports:
+        output.seek(0)
+        output.truncate()
+        writer.writerow(_csv_row(report))
+        yield output.getvalue()
+
+
+def _parse_request(filter_names):
+    # 解析批量报表请求：{"ids": [...]} 或筛选条件；返回(ids, 筛选条件, 错误信息)
+    data = request.get_json(silent=True) or {}
+    ids = data.get('ids')
+    if ids is not None and (not isinstance(ids, list) or not all(
+            isinstance(item, int) and not isinstance(item, bool) for item in ids)):
+        return None, None, 'ids必须是整数数组'
+    return ids, {name: data[name] for name in filter_names if data.get(name) is not None}, None
+
+
+def _stream_response(reports, fields):
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in ('ndjson', 'csv'):
+        return jsonify({'message': '输出格式必须是ndjson或csv'}), 400
+    return Response(stream_with_context(_write_reports(reports, fmt, fields)),
+                    mimetype='text/csv' if fmt == 'csv' else 'application/x-ndjson')
+
+# 管理员批量获取用户报表(逐行流式输出ndjson/csv)
+# 请求体：{"ids": [1, 2, ...]}，或按status/privilege筛选，都不提供时为全部未删除用户
+
+
+@reports_bp.route('/users', methods=['POST'])
+@jwt_required()
+def batch_user_reports():
+    current_user_id = get_jwt_identity()
+
+    # 检查是否是管理员
+    current_user = User.query.get(current_user_id)
+    if not current_user or current_user.privilege != 1:
+        return jsonify({'message': '权限不足'}), 403
+
+    ids, filters, error = _parse_request(USER_FILTERS)
+    if error:
+        return jsonify({'message': error}), 400
+    return _stream_response(user_reports(ids, filters), USER_REPORT_FIELDS)
+
+# 管理员批量获取图书报表(逐行流式输出ndjson/csv)
+# 请求体：{"ids": [1, 2, ...]}，或按category/author/publisher筛选，都不提供时为全部未删除图书
+
+
+@reports_bp.route('/books', methods=['POST'])
+@jwt_required()
+def batch_book_reports():
+    current_user_id = get_jwt_identity()
+
+    # 检查是否是管理员
+    current_user = User.query.get(current_user_id)
+    if not current_user or current_user.privilege != 1:
+        return jsonify({'message': '权限不足'}), 403
+
+    ids, filters, error = _parse_request(BOOK_FILTERS)
+    if error:
+        return jsonify({'message': error}), 400
+    return _stream_response(book_reports(ids, filters), BOOK_REPORT_FIELDS)
+
+
+def _read_ids(ids, ids_file):
+    # 命令行的ID列表：逗号分隔，或文件中每行一个
+    if ids_file:
+        with open(ids_file, encoding='utf-8-sig') as source:
+            return [int(line) for line in source if line.strip()]
+    if ids:
+        return [int(item) for item in ids.split(',') if item.strip()]
+    return None
+
+
+def _export(reports, fmt, fields, output_path):
+    target = open(output_path, 'w', encoding='utf-8',
+                  newline='') if output_path else click.get_text_stream('stdout')
+    total = 0
+    try:
+        for text in _write_reports(reports, fmt, fields):
+            target.write(text)
+            total += 1
+    finally:
+        if output_path:
+            target.close()
+    return total - (1 if fmt == 'csv' else 0)  # csv不计表头
+
+# 命令行：批量导出用户报表
+
+
+@reports_bp.cli.command('users')
+@click.option('--ids', default=None, help='用户ID，逗号分隔')
+@click.option('--ids-file', type=click.Path(exists=True, dir_okay=False), default=None, help='用户ID文件，每行一个')
+@click.option('--status', type=int, default=None, help='按状态筛选(0:正常,1:禁用)')
+@click.option('--privilege', type=int, default=None, help='按权限筛选(0:普通用户,1:管理员)')
+@click.option('--format', 'fmt', type=click.Choice(['ndjson', 'csv']), default='ndjson', show_default=True)
+@click.option('--output', 'output_path', type=click.Path(dir_okay=False), default=None,
+              help='输出文件(默认输出到标准输出)')
+@click.option('--batch-size', default=REPORT_BATCH_SIZE, show_default=True, help='每批计算的报表数')
+def users_command(ids, ids_file, status, privilege, fmt, output_path, batch_size):
+    """批量导出用户借阅报表"""
+    filters = {name: value for name, value in (('status', status), ('privilege', privilege)) if value is not None}
+    total = _export(user_reports(_read_ids(ids, ids_file), filters, batch_size),
+                    fmt, USER_REPORT_FIELDS, output_path)
+    click.echo(f'已导出 {total} 条用户报表', err=True)
+
+# 命令行：批量导出图书报表
+
+
+@reports_bp.cli.command('books')
+@click.option('--ids', default=None, help='图书ID，逗号分隔')
+@click.option('--ids-file', type=click.Path(exists=True, dir_okay=False), default=None, help='图书ID文件，每行一个')
+@click.option('--category', default=None, help='按分类筛选')
+@click.option('--author', default=None, help='按作者筛选')
+@click.option('--publisher', default=None, help='按出版社筛选')
+@click.option('--format', 'fmt', type=click.Choice(['ndjson', 'csv']), default='ndjson', show_default=True)
+@click.option('--output', 'output_path', type=click.Path(dir_okay=False), default=None,
+              help='输出文件(默认输出到标准输出)')
+@click.option('--batch-size', default=REPORT_BATCH_SIZE, show_default=True, help='每批计算的报表数')
+def books_command(ids, ids_file, category, author, publisher, fmt, output_path, batch_size):
+    """批量导出图书借阅报表"""
+    filters = {name: value for name, value in (
+        ('category', category), ('author', author), ('publisher', publisher)) if value is not None}
+    total = _export(book_reports(_read_ids(ids, ids_file), filters, batch_size),
+                    fmt, BOOK_REPORT_FIELDS, output_path)
+    click.echo(f'已导出 {total} 条图书报表', err=True)
@@ -0,0 +1,195 @@
+from datetime import date, datetime, timedelta, time as dtime
+import click
+from flask import Blueprint
+from sqlalchemy import case, delete, event, func, insert, literal, select, union_all
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from database import db
+from models import Book, DailyBookStat, DailyCategoryStat, DailyUserStat, JobCheckpoint
+from archive import borrow_history
+
+# 创建rollups蓝图(只提供命令行)
+rollups_bp = Blueprint('rollups', __name__)
+
+# 全量重建的检查点名称(记录统计表覆盖的起始日期)
+ROLLUP_JOB = 'rollups'
+# 重建时每个事务处理的天数
+REBUILD_CHUNK_DAYS = 31
+# 统计列
+ROLLUP_COUNTERS = ['borrows', 'returns', 'overdue_returns']
+# 统计表及其维度列
+ROLLUP_TABLES = {
+    DailyBookStat.__tablename__: (DailyBookStat, 'book_id'),
+    DailyUserStat.__tablename__: (DailyUserStat, 'user_id'),
+    DailyCategoryStat.__tablename__: (DailyCategoryStat, 'category'),
+}
+
+
+# 借还时记录统计增量(暂存在会话中，提交前合并写入，回滚时丢弃)
+
+
+def _record(day, book, user_id, borrows=0, returns=0, overdue_returns=0):
+    pending = db.session.info.setdefault('rollup_pending', {})
+    for tablename, key in ((DailyBookStat.__tablename__, book.id),
+                           (DailyUserStat.__tablename__, user_id),
+                           (DailyCategoryStat.__tablename__, book.category)):
+        counts = pending.setdefault((tablename, day, key), [0, 0, 0])
+        counts[0] += borrows
+        counts[1] += returns
+        counts[2] += overdue_returns
+
+
+def record_borrow(borrow, book):
+    _record(borrow.borrow_time.date(), book, borrow.user_id, borrows=1)
+
+
+def record_return(borrow, book):
+    _record(borrow.return_time.date(), book, borrow.user_id, returns=1,
+            overdue_returns=1 if borrow.return_time > borrow.due_at else 0)
+
+
+def _upsert_add(session, model, day, key_column, key, counts):
+    # 累加到(日期, 维度)行，行不存在时插入
+    table = model.__table__
+    row = {'day': day, key_column: key}
+    row.update(zip(ROLLUP_COUNTERS, counts))
+    dialect = session.get_bind().dialect.name
+    if dialect == 'mysql':
+        stmt = mysql.insert(table).values(row)
+        stmt = stmt.on_duplicate_key_update(
+            {c: table.c[c] + stmt.inserted[c] for c in ROLLUP_COUNTERS})
+    else:
+        dialect_insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+        stmt = dialect_insert(table).values(row)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['day', key_column],
+            set_={c: table.c[c] + stmt.excluded[c] for c in ROLLUP_COUNTERS})
+    session.execute(stmt)
+
+# 提交前把本事务的增量按(表, 日期, 维度)合并后写入：
+# 统计行(尤其是当天的分类行)是热点行，最后才加锁可缩短持锁时间，固定顺序加锁避免批量借还互相死锁
+
+
+@event.listens_for(db.session, 'before_commit')
+def _flush_rollups(session):
+    pending = session.info.pop('rollup_pending', None)
+    if not pending:
+        return
+    for (tablename, day, key), counts in sorted(pending.items()):
+        model, key_column = ROLLUP_TABLES[tablename]
+        _upsert_add(session, model, day, key_column, key, counts)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_rollups(session):
+    session.info.pop('rollup_pending', None)
+
+# 图书改分类时把这些图书的每日统计从旧分类移到新分类(不提交事务)
+# 移动量按图书统计表汇总，与按图书当前分类重建的结果一致；移空的旧分类行删除
+
+
+def move_category_rollups(book_ids, old_category, new_category):
+    if not book_ids or old_category == new_category:
+        return
+    rows = db.session.query(
+        DailyBookStat.day, *[func.sum(getattr(DailyBookStat, c)) for c in ROLLUP_COUNTERS]
+    ).filter(DailyBookStat.book_id.in_(book_ids)).group_by(DailyBookStat.day).order_by(DailyBookStat.day).all()
+    for day, *counts in rows:
+        counts = [int(count) for count in counts]
+        # 与提交前写入统计的加锁顺序一致：按(日期, 分类)排序
+        for category, sign in sorted(((old_category, -1), (new_category, 1))):
+            _upsert_add(db.session, DailyCategoryStat, day, 'category', category,
+                        [sign * count for count in counts])
+    db.session.execute(delete(DailyCategoryStat).where(
+        DailyCategoryStat.category == old_category,
+        *[getattr(DailyCategoryStat, c) <= 0 for c in ROLLUP_COUNTERS]))
+
+
+def rollup_events(start, end, history=None):
+    # [start, end)日期范围内的借出/归还事件子查询(每条借出、归还各一行)，重建统计和按需汇总共用
+    if history is None:
+        history = borrow_history()
+    low = datetime.combine(start, dtime.min)
+    high = datetime.combine(end, dtime.min)
+    zero = literal(0)
+    return union_all(
+        select(func.date(history.c.borrow_time).label('day'), history.c.book_id, history.c.user_id,
+               literal(1).label('borrows'), zero.label('returns'), zero.label('overdue_returns')
+               ).where(history.c.deleted_at == None,
+                       history.c.borrow_time >= low, history.c.borrow_time < high),
+        select(func.date(history.c.return_time).label('day'), history.c.book_id, history.c.user_id,
+               zero.label('borrows'), literal(1).label('returns'),
+               case((history.c.return_time > history.c.due_at, 1), else_=0).label('overdue_returns')
+               ).where(history.c.deleted_at == None, history.c.status == 1,
+                       history.c.return_time >= low, history.c.return_time < high)
+    ).subquery('rollup_events')
+
+
+def rollup_coverage_start():
+    # 统计表完整覆盖的起始日期(全量重建后记录)，未重建过返回None
+    checkpoint = db.session.get(JobCheckpoint, ROLLUP_JOB)
+    return checkpoint.run_date if checkpoint else None
+
+# 按借阅历史(在线表+归档表)重建[start, end)日期范围内的统计，每个事务处理chunk_days天
+# 分类按图书当前所属分类重新归集
+
+
+def rebuild_rollups(start=None, end=None, chunk_days=REBUILD_CHUNK_DAYS):
+    history = borrow_history()
+    full = start is None
+    if full:
+        first = db.session.query(func.min(history.c.borrow_time)).scalar()
+        start = first.date() if first else date.today()
+    if end is None:
+        end = date.today() + timedelta(days=1)
+
+    days = 0
+    chunk_start = start
+    while chunk_start < end:
+        chunk_end = min(chunk_start + timedelta(days=chunk_days), end)
+        _rebuild_chunk(history, chunk_start, chunk_end)
+        days += (chunk_end - chunk_start).days
+        chunk_start = chunk_end
+
+    if full:
+        # 全量重建后统计表覆盖全部历史，此后由借还增量维护
+        checkpoint = db.session.get(JobCheckpoint, ROLLUP_JOB) or JobCheckpoint(name=ROLLUP_JOB)
+        checkpoint.run_date = start
+        db.session.add(checkpoint)
+        db.session.commit()
+    return days
+
+
+def _rebuild_chunk(history, start, end):
+    events = rollup_events(start, end, history)
+    sums = [func.sum(events.c[c]) for c in ROLLUP_COUNTERS]
+
+    try:
+        for model, key_column in ROLLUP_TABLES.values():
+            db.session.execute(delete(model).where(model.day >= start, model.day < end))
+            if key_column == 'category':
+                key = Book.category
+                source = select(events.c.day, key, *sums).join(
+                    Book, Book.id == events.c.book_id)
+            else:
+                key = events.c[key_column]
+                source = select(events.c.day, key, *sums)
+            db.session.execute(insert(model).from_select(
+                ['day', key_column] + ROLLUP_COUNTERS,
+                source.group_by(events.c.day, key)))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+# 命令行：重建每日借阅统计(首次上线回填，或统计与借阅记录不一致时修正)
+
+
+@rollups_bp.cli.command('rebuild')
+@click.option('--from', 'start', type=click.DateTime(formats=['%Y-%m-%d']), help='起始日期(含)，默认最早的借阅日期')
+@click.option('--to', 'end', type=click.DateTime(formats=['%Y-%m-%d']), help='结束日期(含)，默认今天')
+@click.option('--chunk-days', default=REBUILD_CHUNK_DAYS, show_default=True, help='每个事务重建的天数')
+def rebuild_command(start, end, chunk_days):
+    """按借阅历史重建每日借阅统计"""
+    days = rebuild_rollups(start.date() if start else None,
+                           end.date() + timedelta(days=1) if end else None, chunk_days)
+    click.echo(f'已重建 {days} 天的借阅统计')
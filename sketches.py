@@ -0,0 +1,135 @@
+import atexit
+import threading
+import time
+from flask import current_app
+from sqlalchemy import event
+from database import db
+
+# 重建时服务端游标每批读取的行数
+REBUILD_BATCH_SIZE = 5000
+
+
+class BufferedSketchTracker:
+    # 进程内暂存增量摘要，定期与数据库中的摘要行合并后清空(热门图书、每日去重计数共用)
+    # 借阅时先把事件暂存在会话中，提交成功后计入增量，回滚时丢弃
+    # 具体统计提供：entries(事件列表) -> [(摘要键, 元素)]，new_sketch() -> 空摘要，
+    # merge(增量, 新增量) -> 合并后的摘要，upsert_row(摘要键, 增量) 锁定摘要行后合并写回(不提交事务)，
+    # 可选的cleanup() 在同一事务内清理过期的摘要行
+    def __init__(self, name, flush_setting, default_flush_seconds, entries, new_sketch, merge,
+                 upsert_row, cleanup=None):
+        self.session_key = f'{name}_pending'
+        self._flush_setting = flush_setting
+        self._default_flush_seconds = default_flush_seconds
+        self._entries = entries
+        self._new_sketch = new_sketch
+        self._merge = merge
+        self._upsert_row = upsert_row
+        self._cleanup = cleanup
+        self._lock = threading.Lock()
+        self._pending = {}  # 摘要键 -> 增量摘要
+        self._flushing = False
+        self._last_flush = time.time()
+        self._app = None
+        event.listen(db.session, 'after_commit', self._feed)
+        event.listen(db.session, 'after_rollback', self._discard)
+
+    def record(self, item):
+        # 暂存一条事件(不提交事务)
+        db.session.info.setdefault(self.session_key, []).append(item)
+
+    def _feed(self, session):
+        events = session.info.pop(self.session_key, None)
+        if events:
+            self.track(events, current_app._get_current_object())
+
+    def _discard(self, session):
+        session.info.pop(self.session_key, None)
+
+    def track(self, events, app):
+        with self._lock:
+            for key, value in self._entries(events):
+                sketch = self._pending.get(key)
+                if sketch is None:
+                    sketch = self._pending[key] = self._new_sketch()
+                sketch.add(value)
+            if self._app is None:
+                self._app = app
+                atexit.register(self.flush_on_exit)
+            due = time.time() - self._last_flush >= app.config.get(
+                self._flush_setting, self._default_flush_seconds)
+            start = due and not self._flushing
+            if start:
+                self._flushing = True
+        if start:
+            threading.Thread(target=self._flush_in_background, daemon=True).start()
+
+    def read_pending(self, read):
+        # 在锁内读取本进程尚未写入的增量({摘要键: 增量摘要})，避免与借阅线程并发修改
+        with self._lock:
+            return read(self._pending)
+
+    def flush(self):
+        # 把增量合并进数据库(锁定摘要行后合并，多个进程同时写入不会丢失)
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = time.time()
+        if not pending:
+            return 0
+        try:
+            for key, sketch in sorted(pending.items()):
+                self._upsert_row(key, sketch)
+            if self._cleanup:
+                self._cleanup()
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            # 写入失败时把增量放回，下次再合并
+            with self._lock:
+                for key, sketch in pending.items():
+                    current = self._pending.get(key)
+                    self._pending[key] = sketch if current is None else self._merge(sketch, current)
+            raise
+        return len(pending)
+
+    def _flush_in_background(self):
+        try:
+            with self._app.app_context():
+                self.flush()
+        except Exception:
+            pass
+        finally:
+            with self._lock:
+                self._flushing = False
+
+    def flush_on_exit(self):
+        try:
+            with self._app.app_context():
+                self.flush()
+        except Exception:
+            pass
+
+# 按明细重建摘要行：独立连接上的服务端游标流式读取stmt，entries(行)产出[(摘要键, 元素)]累计到摘要，
+# 然后在一个事务内执行clear删除旧行，并写入to_row(摘要键, 摘要)生成的新行，返回{摘要键: 摘要}
+
+
+def rebuild_sketch_rows(stmt, entries, new_sketch, clear, to_row):
+    sketches = {}
+    with db.engine.connect() as conn:
+        result = conn.execution_options(yield_per=REBUILD_BATCH_SIZE).execute(stmt)
+        for rows in result.partitions():
+            for row in rows:
+                for key, value in entries(row):
+                    sketch = sketches.get(key)
+                    if sketch is None:
+                        sketch = sketches[key] = new_sketch()
+                    sketch.add(value)
+
+    try:
+        db.session.execute(clear)
+        for key, sketch in sorted(sketches.items()):
+            db.session.add(to_row(key, sketch))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return sketches
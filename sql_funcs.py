@@ -0,0 +1,33 @@
+from sqlalchemy import Integer
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
+
+# 跨数据库的SQL函数(生产环境MySQL，开发测试可用SQLite)
+
+# 两个时间之间相差的自然日数(只比较日期部分，与MySQL DATEDIFF一致)
+
+
+class days_between(FunctionElement):
+    type = Integer()
+    name = 'days_between'
+    inherit_cache = True
+
+
+@compiles(days_between)
+def _days_between_default(element, compiler, **kw):
+    later, earlier = list(element.clauses)
+    return 'DATEDIFF(%s, %s)' % (compiler.process(later, **kw), compiler.process(earlier, **kw))
+
+
+@compiles(days_between, 'sqlite')
+def _days_between_sqlite(element, compiler, **kw):
+    later, earlier = list(element.clauses)
+    return 'CAST(julianday(date(%s)) - julianday(date(%s)) AS INTEGER)' % (
+        compiler.process(later, **kw), compiler.process(earlier, **kw))
+
+
+@compiles(days_between, 'postgresql')
+def _days_between_postgresql(element, compiler, **kw):
+    later, earlier = list(element.clauses)
+    return '(CAST(%s AS DATE) - CAST(%s AS DATE))' % (
+        compiler.process(later, **kw), compiler.process(earlier, **kw))
@@ -1,15 +1,42 @@
-from datetime import datetime, timedelta
-from flask import Blueprint, jsonify, request
+from datetime import date, datetime, timedelta
+from flask import Blueprint, jsonify, request, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from sqlalchemy import func, extract, and_, or_
+from sqlalchemy import func, extract, literal
 from database import db
-from models import Borrow, Book, User
+from models import Borrow, Book, User, DailyBookStat, DailyCategoryStat, DailyUserStat, LoanDurationDigest
+from inventory import book_stock
+from archive import borrow_history
+from rollups import rollup_coverage_start, rollup_events
+from activity import distinct_counts
+from durations import TDigest, percentiles
+from fanout import QueryTimeout, fan_out, fetch_all, fetch_first, fetch_one, fetch_scalar
+from reports import (RECENT_BORROWS_LIMIT, TOP_BORROWERS_LIMIT, book_report_columns,
+                     format_book_report, format_user_report, user_report_columns)
+from cache import (StaleWhileRevalidateCache, STATS_CACHE_VERSION, get_counter,
+                   bump_counter, clear_shared)
 
 # 创建statistics蓝图
 statistics_bp = Blueprint('statistics', __name__)
 
-# 默认借阅期限（天）
-DEFAULT_BORROW_PERIOD = 14
+# 统计结果缓存(过期后先返回旧值再后台刷新)
+stats_cache = StaleWhileRevalidateCache(maxsize=256)
+# 默认软过期/硬过期时间(秒)，可通过配置项STATS_CACHE_SOFT_TTL/STATS_CACHE_HARD_TTL覆盖
+DEFAULT_SOFT_TTL = 5
+DEFAULT_HARD_TTL = 60
+
+
+def _cached_response(key, compute):
+    # 缓存键带上统计缓存版本号，清除缓存后所有进程的旧结果失效；Age响应头为结果已生成的秒数
+    config = current_app.config
+    value, age, state = stats_cache.get(
+        f'{get_counter(STATS_CACHE_VERSION)}:{key}', compute,
+        soft_ttl=config.get('STATS_CACHE_SOFT_TTL', DEFAULT_SOFT_TTL),
+        hard_ttl=config.get('STATS_CACHE_HARD_TTL', DEFAULT_HARD_TTL),
+        shared=config.get('STATS_CACHE_SHARED', False))
+    response = jsonify(value)
+    response.headers['Age'] = str(int(age))
+    response.headers['X-Cache'] = state
+    return response, 200
 
 
 # 管理员获取用户借阅报表
@@ -31,95 +58,34 @@ def get_user_reports(user_id):
         return jsonify({'message': '用户不存在或已被删除'}), 404
 
     try:
-        # 计算总借阅次数
-        total_borrows = db.session.query(func.count(Borrow.id)).filter(
-            Borrow.user_id == user_id,
-            Borrow.deleted_at == None
-        ).scalar()
-
-        # 计算已归还次数
-        returned_borrows = db.session.query(func.count(Borrow.id)).filter(
-            Borrow.user_id == user_id,
-            Borrow.status == 1,  # 已归还
-            Borrow.deleted_at == None
-        ).scalar()
-
-        # 计算逾期次数（已归还且逾期）
-        from sqlalchemy import text
-
-        overdue_borrows = db.session.query(func.count(Borrow.id)).filter(
-            Borrow.user_id == user_id,
-            Borrow.status == 1,  # 已归还
-            Borrow.return_time > func.date_add(Borrow.borrow_time, text(
-                f'INTERVAL {DEFAULT_BORROW_PERIOD} DAY')),
-            Borrow.deleted_at == None
-        ).scalar()
-
-        # 计算当前逾期未归还次数
-        current_overdue_borrows = db.session.query(func.count(Borrow.id)).filter(
-            Borrow.user_id == user_id,
-            Borrow.status == 0,  # 借阅中
-            Borrow.borrow_time < datetime.now() - timedelta(days=DEFAULT_BORROW_PERIOD),
-            Borrow.deleted_at == None
-        ).scalar()
-
-        # 计算逾期率
-        overdue_rate = 0
-        if returned_borrows > 0:
-            overdue_rate = round((overdue_borrows / returned_borrows) * 100, 2)
+        # 借阅历史跨在线表和归档表统计
+        history = borrow_history(user_id=user_id)
+
+        # 一次条件聚合统计总借阅、已归还、逾期归还和当前逾期次数
+        now = datetime.now()
+        counts = db.session.query(*user_report_columns(history, now)).filter(
+            history.c.deleted_at == None
+        )
 
         # 获取用户最近5次借阅记录
         recent_borrows = db.session.query(
-            Borrow.id,
+            history.c.id,
             Book.name.label('book_name'),
-            Borrow.borrow_time,
-            Borrow.return_time,
-            Borrow.status
-        ).join(Book).filter(
-            Borrow.user_id == user_id,
-            Borrow.deleted_at == None,
+            history.c.borrow_time,
+            history.c.return_time,
+            history.c.due_at,
+            history.c.status
+        ).join(Book, Book.id == history.c.book_id).filter(
+            history.c.deleted_at == None,
             Book.deleted_at == None
-        ).order_by(Borrow.borrow_time.desc()).limit(5).all()
-
-        formatted_recent_borrows = []
-        for borrow in recent_borrows:
-            # 计算是否逾期
-            is_overdue = False
-            days_left = None
-            due_time = borrow.borrow_time + \
-                timedelta(days=DEFAULT_BORROW_PERIOD)
-
-            if borrow.status == 0:  # 借阅中
-                if datetime.now() > due_time:
-                    is_overdue = True
-                    days_left = -((datetime.now() - due_time).days)
-                else:
-                    days_left = (due_time - datetime.now()).days
-            elif borrow.return_time and borrow.return_time > due_time:
-                is_overdue = True
-
-            formatted_recent_borrows.append({
-                'borrow_id': borrow.id,
-                'book_name': borrow.book_name,
-                'borrow_time': borrow.borrow_time.isoformat(),
-                'return_time': borrow.return_time.isoformat() if borrow.return_time else None,
-                'status': borrow.status,
-                'status_text': '借阅中' if borrow.status == 0 else '已归还',
-                'is_overdue': is_overdue,
-                'days_left': days_left
-            })
+        ).order_by(history.c.borrow_time.desc()).limit(RECENT_BORROWS_LIMIT)
 
-        return jsonify({
-            'user_id': user.id,
-            'username': user.username,
-            'name': user.name,
-            'total_borrows': total_borrows,
-            'returned_borrows': returned_borrows,
-            'overdue_borrows': overdue_borrows + current_overdue_borrows,
-            'current_overdue_borrows': current_overdue_borrows,
-            'overdue_rate': overdue_rate,
-            'recent_borrows': formatted_recent_borrows
-        }), 200
+        # 两条查询互不依赖，并发执行
+        results = fan_out({'counts': fetch_one(counts), 'recent_borrows': fetch_all(recent_borrows)})
+
+        return jsonify(format_user_report(user, results['counts'], results['recent_borrows'], now)), 200
+    except QueryTimeout as e:
+        return jsonify({'message': '获取用户报表超时', 'error': str(e)}), 504
     except Exception as e:
         return jsonify({'message': '获取用户报表失败', 'error': str(e)}), 500
 
@@ -142,102 +108,219 @@ def get_book_reports(book_id):
         return jsonify({'message': '图书不存在或已被删除'}), 404
 
     try:
-        # 计算总借阅次数
-        total_borrows = db.session.query(func.count(Borrow.id)).filter(
-            Borrow.book_id == book_id,
-            Borrow.deleted_at == None
-        ).scalar()
-
-        # 计算已归还次数
-        returned_borrows = db.session.query(func.count(Borrow.id)).filter(
-            Borrow.book_id == book_id,
-            Borrow.status == 1,  # 已归还
-            Borrow.deleted_at == None
-        ).scalar()
-
-        # 计算当前借阅中次数
-        current_borrows = db.session.query(func.count(Borrow.id)).filter(
-            Borrow.book_id == book_id,
-            Borrow.status == 0,  # 借阅中
-            Borrow.deleted_at == None
-        ).scalar()
-
-        # 计算平均借阅时长（天）
-        avg_borrow_days = 0
-        if returned_borrows > 0:
-            result = db.session.query(
-                func.avg(func.datediff(Borrow.return_time,
-                         Borrow.borrow_time)).label('avg_days')
-            ).filter(
-                Borrow.book_id == book_id,
-                Borrow.status == 1,  # 已归还
-                Borrow.deleted_at == None
-            ).first()
-            if result.avg_days is not None:
-                avg_borrow_days = round(float(result.avg_days), 2)
+        # 借阅历史跨在线表和归档表统计
+        history = borrow_history(book_id=book_id)
+
+        # 一次条件聚合统计总借阅、已归还、当前借阅中次数和平均借阅时长（天）
+        counts = db.session.query(*book_report_columns(history)).filter(
+            history.c.deleted_at == None
+        )
 
         # 获取最近5次借阅记录
         recent_borrows = db.session.query(
-            Borrow.id,
+            history.c.id,
             User.username,
             User.name.label('user_name'),
-            Borrow.borrow_time,
-            Borrow.return_time,
-            Borrow.status
-        ).join(User).filter(
-            Borrow.book_id == book_id,
-            Borrow.deleted_at == None,
+            history.c.borrow_time,
+            history.c.return_time,
+            history.c.status
+        ).join(User, User.id == history.c.user_id).filter(
+            history.c.deleted_at == None,
             User.deleted_at == None
-        ).order_by(Borrow.borrow_time.desc()).limit(5).all()
-
-        formatted_recent_borrows = []
-        for borrow in recent_borrows:
-            formatted_recent_borrows.append({
-                'borrow_id': borrow.id,
-                'username': borrow.username,
-                'user_name': borrow.user_name,
-                'borrow_time': borrow.borrow_time.isoformat(),
-                'return_time': borrow.return_time.isoformat() if borrow.return_time else None,
-                'status': borrow.status,
-                'status_text': '借阅中' if borrow.status == 0 else '已归还'
-            })
+        ).order_by(history.c.borrow_time.desc()).limit(RECENT_BORROWS_LIMIT)
 
         # 获取借阅最多的用户（前5名）
         top_borrowers = db.session.query(
             User.id,
             User.username,
             User.name.label('user_name'),
-            func.count(Borrow.id).label('borrow_count')
-        ).join(User).filter(
-            Borrow.book_id == book_id,
-            Borrow.deleted_at == None,
+            func.count(history.c.id).label('borrow_count')
+        ).join(User, User.id == history.c.user_id).filter(
+            history.c.deleted_at == None,
             User.deleted_at == None
-        ).group_by(User.id).order_by(func.count(Borrow.id).desc()).limit(5).all()
-
-        formatted_top_borrowers = []
-        for borrower in top_borrowers:
-            formatted_top_borrowers.append({
-                'user_id': borrower.id,
-                'username': borrower.username,
-                'user_name': borrower.user_name,
-                'borrow_count': borrower.borrow_count
-            })
+        ).group_by(User.id).order_by(func.count(history.c.id).desc()).limit(TOP_BORROWERS_LIMIT)
+
+        # 借阅时长分位数(天)，由归还时维护的摘要给出，无需扫描历史
+        digest = db.session.query(LoanDurationDigest.count, LoanDurationDigest.digest).filter(
+            LoanDurationDigest.kind == 'book',
+            LoanDurationDigest.key == str(book.id)
+        )
+
+        # 四条查询互不依赖，并发执行
+        results = fan_out({
+            'counts': fetch_one(counts),
+            'recent_borrows': fetch_all(recent_borrows),
+            'top_borrowers': fetch_all(top_borrowers),
+            'digest': fetch_first(digest)
+        })
+        digest = results['digest']
+
+        return jsonify(format_book_report(
+            book, book_stock(book), results['counts'], results['recent_borrows'], results['top_borrowers'],
+            percentiles(TDigest.decode(digest.digest)) if digest and digest.count else None)), 200
+    except QueryTimeout as e:
+        return jsonify({'message': '获取图书报表超时', 'error': str(e)}), 504
+    except Exception as e:
+        return jsonify({'message': '获取图书报表失败', 'error': str(e)}), 500
 
-        return jsonify({
+# 系统整体统计(结果可JSON序列化，供缓存使用)；days为空时统计全部历史
+
+
+def _system_overview(days=None):
+    # 总用户数（不包括已删除和禁用的）
+    total_users = db.session.query(func.count(User.id)).filter(
+        User.deleted_at == None,
+        User.status == 0  # 正常状态
+    )
+
+    # 总图书数（不包括已删除的）
+    total_books = db.session.query(func.count(Book.id)).filter(
+        Book.deleted_at == None
+    )
+
+    # 借阅次数、热门图书、活跃用户和分类借阅数：统计表覆盖统计范围时读取每日统计表，
+    # 扫描量为天数×当天有借还的图书/用户数，与借阅记录总量无关；
+    # 未全量重建过统计表(或覆盖起点晚于统计范围)时改为对借阅历史分组统计，结果相同但较慢
+    since = date.today() - timedelta(days=days - 1) if days else None
+    coverage = rollup_coverage_start()
+    if coverage is not None and (since is None or coverage <= since):
+        source = 'rollup'
+
+        def in_window(model):
+            return [model.day >= since] if since else []
+
+        # 总借阅次数(按分类汇总的行数最少)
+        total_borrows = db.session.query(
+            func.coalesce(func.sum(DailyCategoryStat.borrows), 0)
+        ).filter(*in_window(DailyCategoryStat))
+        book_counts = db.session.query(
+            DailyBookStat.book_id,
+            func.sum(DailyBookStat.borrows).label('borrow_count')
+        ).filter(*in_window(DailyBookStat)).group_by(DailyBookStat.book_id).subquery()
+        user_counts = db.session.query(
+            DailyUserStat.user_id,
+            func.sum(DailyUserStat.borrows).label('borrow_count')
+        ).filter(*in_window(DailyUserStat)).group_by(DailyUserStat.user_id).subquery()
+        category_borrows = db.session.query(
+            DailyCategoryStat.category,
+            func.sum(DailyCategoryStat.borrows)
+        ).filter(*in_window(DailyCategoryStat)).group_by(DailyCategoryStat.category)
+    else:
+        source = 'borrow'
+        history = borrow_history()
+        window = [history.c.deleted_at == None]
+        if since:
+            window.append(history.c.borrow_time >= datetime.combine(since, datetime.min.time()))
+        total_borrows = db.session.query(func.count(history.c.id)).filter(*window)
+        book_counts = db.session.query(
+            history.c.book_id,
+            func.count(history.c.id).label('borrow_count')
+        ).filter(*window).group_by(history.c.book_id).subquery()
+        user_counts = db.session.query(
+            history.c.user_id,
+            func.count(history.c.id).label('borrow_count')
+        ).filter(*window).group_by(history.c.user_id).subquery()
+        # 与统计表一致，按图书当前所属分类归集
+        category_borrows = db.session.query(
+            Book.category,
+            func.count(history.c.id)
+        ).join(Book, Book.id == history.c.book_id).filter(*window).group_by(Book.category)
+
+    # 当前借阅中次数与逾期次数只涉及借阅中的记录，走(status, due_at)索引
+    current_borrows = db.session.query(func.count(Borrow.id)).filter(
+        Borrow.status == 0,  # 借阅中
+        Borrow.deleted_at == None
+    )
+
+    current_overdue_borrows = db.session.query(func.count(Borrow.id)).filter(
+        Borrow.status == 0,  # 借阅中
+        Borrow.due_at < datetime.now(),
+        Borrow.deleted_at == None
+    )
+
+    # 热门图书（借阅次数最多的前10本）
+    popular_books = db.session.query(
+        Book.id,
+        Book.name,
+        Book.author,
+        book_counts.c.borrow_count
+    ).join(book_counts, book_counts.c.book_id == Book.id).filter(
+        Book.deleted_at == None,
+        book_counts.c.borrow_count > 0
+    ).order_by(book_counts.c.borrow_count.desc()).limit(10)
+
+    # 活跃用户（借阅次数最多的前10名）
+    active_users = db.session.query(
+        User.id,
+        User.username,
+        User.name,
+        user_counts.c.borrow_count
+    ).join(user_counts, user_counts.c.user_id == User.id).filter(
+        User.deleted_at == None,
+        User.status == 0,  # 正常状态
+        user_counts.c.borrow_count > 0
+    ).order_by(user_counts.c.borrow_count.desc()).limit(10)
+
+    # 图书分类统计：图书数按图书表分组，借阅次数见上
+    category_stats = db.session.query(
+        Book.category,
+        func.count(Book.id).label('book_count')
+    ).filter(
+        Book.deleted_at == None
+    ).group_by(Book.category).order_by(func.count(Book.id).desc())
+
+    # 以上查询互不依赖，并发执行
+    results = fan_out({
+        'total_users': fetch_scalar(total_users),
+        'total_books': fetch_scalar(total_books),
+        'total_borrows': fetch_scalar(total_borrows),
+        'current_borrows': fetch_scalar(current_borrows),
+        'current_overdue_borrows': fetch_scalar(current_overdue_borrows),
+        'popular_books': fetch_all(popular_books),
+        'active_users': fetch_all(active_users),
+        'category_borrows': fetch_all(category_borrows),
+        'category_stats': fetch_all(category_stats)
+    })
+
+    formatted_popular_books = []
+    for book in results['popular_books']:
+        formatted_popular_books.append({
             'book_id': book.id,
-            'book_name': book.name,
+            'name': book.name,
             'author': book.author,
-            'publisher': book.publisher,
-            'stock': book.stock,
-            'total_borrows': total_borrows,
-            'returned_borrows': returned_borrows,
-            'current_borrows': current_borrows,
-            'avg_borrow_days': avg_borrow_days,
-            'recent_borrows': formatted_recent_borrows,
-            'top_borrowers': formatted_top_borrowers
-        }), 200
-    except Exception as e:
-        return jsonify({'message': '获取图书报表失败', 'error': str(e)}), 500
+            'borrow_count': int(book.borrow_count)
+        })
+
+    formatted_active_users = []
+    for user in results['active_users']:
+        formatted_active_users.append({
+            'user_id': user.id,
+            'username': user.username,
+            'name': user.name,
+            'borrow_count': int(user.borrow_count)
+        })
+
+    category_borrows = dict(results['category_borrows'])
+    formatted_category_stats = []
+    for category in results['category_stats']:
+        formatted_category_stats.append({
+            'category': category.category,
+            'book_count': category.book_count,
+            'borrow_count': int(category_borrows.get(category.category) or 0)
+        })
+
+    return {
+        'total_users': results['total_users'],
+        'total_books': results['total_books'],
+        'total_borrows': int(results['total_borrows']),
+        'current_borrows': results['current_borrows'],
+        'current_overdue_borrows': results['current_overdue_borrows'],
+        'popular_books': formatted_popular_books,
+        'active_users': formatted_active_users,
+        'category_stats': formatted_category_stats,
+        'source': source,  # rollup:每日统计表，borrow:借阅历史
+        'coverage_start': coverage.isoformat() if coverage else None
+    }
 
 # 管理员获取系统整体统计信息
 
@@ -253,103 +336,286 @@ def get_system_overview():
         return jsonify({'message': '权限不足'}), 403
 
     try:
-        # 总用户数（不包括已删除和禁用的）
-        total_users = db.session.query(func.count(User.id)).filter(
-            User.deleted_at == None,
-            User.status == 0  # 正常状态
-        ).scalar()
-
-        # 总图书数（不包括已删除的）
-        total_books = db.session.query(func.count(Book.id)).filter(
-            Book.deleted_at == None
-        ).scalar()
-
-        # 总借阅次数
-        total_borrows = db.session.query(func.count(Borrow.id)).filter(
-            Borrow.deleted_at == None
-        ).scalar()
-
-        # 当前借阅中次数
-        current_borrows = db.session.query(func.count(Borrow.id)).filter(
-            Borrow.status == 0,  # 借阅中
-            Borrow.deleted_at == None
-        ).scalar()
-
-        # 当前逾期次数
-        current_overdue_borrows = db.session.query(func.count(Borrow.id)).filter(
-            Borrow.status == 0,  # 借阅中
-            Borrow.borrow_time < datetime.now() - timedelta(days=DEFAULT_BORROW_PERIOD),
-            Borrow.deleted_at == None
-        ).scalar()
-
-        # 热门图书（借阅次数最多的前10本）
-        popular_books = db.session.query(
-            Book.id,
-            Book.name,
-            Book.author,
-            func.count(Borrow.id).label('borrow_count')
-        ).join(Book).filter(
-            Borrow.deleted_at == None,
-            Book.deleted_at == None
-        ).group_by(Book.id).order_by(func.count(Borrow.id).desc()).limit(10).all()
-
-        formatted_popular_books = []
-        for book in popular_books:
-            formatted_popular_books.append({
-                'book_id': book.id,
-                'name': book.name,
-                'author': book.author,
-                'borrow_count': book.borrow_count
-            })
+        # 可选days参数只统计最近N天
+        days = request.args.get('days', type=int)
+        if not days or days <= 0:
+            days = None
+        return _cached_response(f'overview:{days}', lambda: _system_overview(days))
+    except QueryTimeout as e:
+        return jsonify({'message': '获取系统统计信息超时', 'error': str(e)}), 504
+    except Exception as e:
+        return jsonify({'message': '获取系统统计信息失败', 'error': str(e)}), 500
 
-        # 活跃用户（借阅次数最多的前10名）
-        active_users = db.session.query(
-            User.id,
-            User.username,
-            User.name,
-            func.count(Borrow.id).label('borrow_count')
-        ).join(User).filter(
-            Borrow.deleted_at == None,
-            User.deleted_at == None,
-            User.status == 0  # 正常状态
-        ).group_by(User.id).order_by(func.count(Borrow.id).desc()).limit(10).all()
-
-        formatted_active_users = []
-        for user in active_users:
-            formatted_active_users.append({
-                'user_id': user.id,
-                'username': user.username,
-                'name': user.name,
-                'borrow_count': user.borrow_count
-            })
+# 借还趋势：时间粒度与分组维度
+TIMESERIES_GRANULARITIES = ['day', 'week', 'month']
+TIMESERIES_GROUP_BY = ['category', 'book']
+# 默认查询最近多少天、最多查询多少天
+TIMESERIES_DEFAULT_DAYS = 30
+TIMESERIES_MAX_DAYS = 3660
+# 日活/周活/月活对应的天数
+ACTIVE_PERIODS = {'day': 1, 'week': 7, 'month': 30}
+
+
+def _bucket_start(day, granularity):
+    # 日期所在时间桶的起始日期(周从周一开始)
+    if granularity == 'week':
+        return day - timedelta(days=day.weekday())
+    if granularity == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def _bucket_starts(start, end, granularity):
+    buckets = []
+    bucket = _bucket_start(start, granularity)
+    while bucket <= end:
+        buckets.append(bucket)
+        if granularity == 'day':
+            bucket += timedelta(days=1)
+        elif granularity == 'week':
+            bucket += timedelta(days=7)
+        else:
+            bucket = (bucket + timedelta(days=32)).replace(day=1)
+    return buckets
+
+# 借还趋势(结果可JSON序列化，供缓存使用)：
+# 统计表覆盖查询范围时读取每日统计，否则对借阅历史做一次分组查询，两者返回相同格式的(日期, 维度, 借出, 归还)
+
+
+def _timeseries(granularity, start, end, group_by=None, book_id=None, category=None, limit=10):
+    coverage = rollup_coverage_start()
+    by_book = group_by == 'book' or book_id is not None
+    if coverage is not None and coverage <= start:
+        source = 'rollup'
+        model = DailyBookStat if by_book else DailyCategoryStat
+        key = model.book_id if by_book else model.category
+        query = db.session.query(model.day, key if group_by else literal(None),
+                                 func.sum(model.borrows), func.sum(model.returns)
+                                 ).filter(model.day >= start, model.day <= end)
+        if book_id is not None:
+            query = query.filter(model.book_id == book_id)
+        if category is not None:
+            if by_book:
+                query = query.join(Book, Book.id == model.book_id)
+            query = query.filter(Book.category == category if by_book else model.category == category)
+        day_column = model.day
+    else:
+        source = 'borrow'
+        events = rollup_events(start, end + timedelta(days=1))
+        key = events.c.book_id if group_by == 'book' else Book.category
+        query = db.session.query(events.c.day, key if group_by else literal(None),
+                                 func.sum(events.c.borrows), func.sum(events.c.returns))
+        if group_by == 'category' or category is not None:
+            query = query.join(Book, Book.id == events.c.book_id)
+        if book_id is not None:
+            query = query.filter(events.c.book_id == book_id)
+        if category is not None:
+            query = query.filter(Book.category == category)
+        day_column = events.c.day
+    rows = query.group_by(day_column, *([key] if group_by else [])).all()
+
+    # 按时间桶累加，没有借还的时间桶补0
+    buckets = _bucket_starts(start, end, granularity)
+    index = {bucket: i for i, bucket in enumerate(buckets)}
+    series = {}
+    totals = {}
+    for day, series_key, borrows, returns in rows:
+        if isinstance(day, str):
+            day = date.fromisoformat(day)
+        counts = series.setdefault(series_key, ([0] * len(buckets), [0] * len(buckets)))
+        i = index[_bucket_start(day, granularity)]
+        counts[0][i] += int(borrows or 0)
+        counts[1][i] += int(returns or 0)
+        totals[series_key] = totals.get(series_key, 0) + int(borrows or 0)
+
+    keys = sorted(series, key=lambda k: (-totals[k], str(k)))
+    if group_by == 'book':
+        keys = keys[:limit]
+    names = {}
+    if group_by == 'book' and keys:
+        names = dict(db.session.query(Book.id, Book.name).filter(Book.id.in_(keys)).all())
+    if not group_by and not keys:
+        keys = [None]
+        series[None] = ([0] * len(buckets), [0] * len(buckets))
+
+    formatted_series = []
+    for series_key in keys:
+        borrows, returns = series[series_key]
+        item = {'borrows': borrows, 'returns': returns, 'total_borrows': sum(borrows)}
+        if group_by == 'book':
+            item.update(book_id=series_key, book_name=names.get(series_key))
+        elif group_by == 'category':
+            item.update(category=series_key)
+        formatted_series.append(item)
+
+    return {
+        'granularity': granularity,
+        'from': start.isoformat(),
+        'to': end.isoformat(),
+        'group_by': group_by,
+        'source': source,
+        'buckets': [bucket.isoformat() for bucket in buckets],
+        'series': formatted_series
+    }
+
+# 管理员获取借还趋势(按日/周/月，可按分类或图书分组)
+
+
+@statistics_bp.route('/timeseries', methods=['GET'])
+@jwt_required()
+def get_timeseries():
+    current_user_id = get_jwt_identity()
 
-        # 图书分类统计
-        category_stats = db.session.query(
-            Book.category,
-            func.count(Book.id).label('book_count'),
-            func.count(Borrow.id).label('borrow_count')
-        ).outerjoin(Borrow).filter(
-            Book.deleted_at == None,
-            or_(Borrow.deleted_at == None, Borrow.id == None)
-        ).group_by(Book.category).order_by(func.count(Book.id).desc()).all()
-
-        formatted_category_stats = []
-        for category in category_stats:
-            formatted_category_stats.append({
-                'category': category.category,
-                'book_count': category.book_count,
-                'borrow_count': category.borrow_count
+    # 检查是否是管理员
+    current_user = User.query.get(current_user_id)
+    if not current_user or current_user.privilege != 1:
+        return jsonify({'message': '权限不足'}), 403
+
+    granularity = request.args.get('granularity', 'day')
+    if granularity not in TIMESERIES_GRANULARITIES:
+        return jsonify({'message': '时间粒度必须是day、week或month'}), 400
+
+    group_by = request.args.get('group_by') or None
+    if group_by is not None and group_by not in TIMESERIES_GROUP_BY:
+        return jsonify({'message': '分组维度必须是category或book'}), 400
+
+    # 日期范围(含两端)，默认最近30天
+    try:
+        end = date.fromisoformat(request.args['to']) if request.args.get('to') else date.today()
+        start = (date.fromisoformat(request.args['from']) if request.args.get('from')
+                 else end - timedelta(days=TIMESERIES_DEFAULT_DAYS - 1))
+    except ValueError:
+        return jsonify({'message': '日期格式应为YYYY-MM-DD'}), 400
+    if start > end:
+        return jsonify({'message': '起始日期不能晚于结束日期'}), 400
+    if (end - start).days >= TIMESERIES_MAX_DAYS:
+        return jsonify({'message': f'查询范围不能超过{TIMESERIES_MAX_DAYS}天'}), 400
+
+    book_id = request.args.get('book_id', type=int)
+    category = request.args.get('category') or None
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 50)
+
+    try:
+        key = f'timeseries:{granularity}:{start}:{end}:{group_by}:{book_id}:{category}:{limit}'
+        return _cached_response(key, lambda: _timeseries(
+            granularity, start, end, group_by, book_id, category, limit))
+    except Exception as e:
+        return jsonify({'message': '获取借还趋势失败', 'error': str(e)}), 500
+
+# 管理员获取借阅用户数和被借图书数(去重，HyperLogLog估算，误差约1%)
+# period为day/week/month时统计截至今天的1/7/30天，也可用from/to指定日期范围
+
+
+@statistics_bp.route('/active', methods=['GET'])
+@jwt_required()
+def get_active_counts():
+    current_user_id = get_jwt_identity()
+
+    # 检查是否是管理员
+    current_user = User.query.get(current_user_id)
+    if not current_user or current_user.privilege != 1:
+        return jsonify({'message': '权限不足'}), 403
+
+    period = request.args.get('period')
+    if period is not None and period not in ACTIVE_PERIODS:
+        return jsonify({'message': '统计周期必须是day、week或month'}), 400
+
+    try:
+        end = date.fromisoformat(request.args['to']) if request.args.get('to') else date.today()
+        if period:
+            start = end - timedelta(days=ACTIVE_PERIODS[period] - 1)
+        else:
+            start = (date.fromisoformat(request.args['from']) if request.args.get('from')
+                     else end - timedelta(days=ACTIVE_PERIODS['month'] - 1))
+    except ValueError:
+        return jsonify({'message': '日期格式应为YYYY-MM-DD'}), 400
+    if start > end:
+        return jsonify({'message': '起始日期不能晚于结束日期'}), 400
+
+    try:
+        def compute():
+            counts = distinct_counts(start, end)
+            return {
+                'from': start.isoformat(),
+                'to': end.isoformat(),
+                'active_users': counts['user'],
+                'distinct_books': counts['book']
+            }
+        return _cached_response(f'active:{start}:{end}', compute)
+    except Exception as e:
+        return jsonify({'message': '获取借阅用户数失败', 'error': str(e)}), 500
+
+# 管理员获取各分类的借阅时长分位数(天)，category指定时只返回该分类
+
+
+@statistics_bp.route('/loan-durations', methods=['GET'])
+@jwt_required()
+def get_loan_durations():
+    current_user_id = get_jwt_identity()
+
+    # 检查是否是管理员
+    current_user = User.query.get(current_user_id)
+    if not current_user or current_user.privilege != 1:
+        return jsonify({'message': '权限不足'}), 403
+
+    category = request.args.get('category')
+
+    try:
+        query = LoanDurationDigest.query.filter(LoanDurationDigest.kind == 'category')
+        if category:
+            query = query.filter(LoanDurationDigest.key == category)
+
+        categories = []
+        for row in query.order_by(LoanDurationDigest.key).all():
+            if not row.count:
+                continue
+            categories.append({
+                'category': row.key,
+                'returned_borrows': row.count,
+                'loan_days_percentiles': percentiles(TDigest.decode(row.digest))
             })
 
-        return jsonify({
-            'total_users': total_users,
-            'total_books': total_books,
-            'total_borrows': total_borrows,
-            'current_borrows': current_borrows,
-            'current_overdue_borrows': current_overdue_borrows,
-            'popular_books': formatted_popular_books,
-            'active_users': formatted_active_users,
-            'category_stats': formatted_category_stats
-        }), 200
+        if category and not categories:
+            return jsonify({'message': '该分类暂无已归还的借阅记录'}), 404
+        return jsonify({'categories': categories}), 200
     except Exception as e:
-        return jsonify({'message': '获取系统统计信息失败', 'error': str(e)}), 500
+        return jsonify({'message': '获取借阅时长分位数失败', 'error': str(e)}), 500
+
+# 管理员查看统计缓存状态
+
+
+@statistics_bp.route('/cache', methods=['GET'])
+@jwt_required()
+def get_stats_cache():
+    current_user_id = get_jwt_identity()
+    current_user = User.query.get(current_user_id)
+
+    # 检查是否是管理员
+    if not current_user or current_user.privilege != 1:
+        return jsonify({'message': '权限不足'}), 403
+
+    return jsonify(stats_cache.stats()), 200
+
+# 管理员清除统计缓存(所有进程下一次请求重新计算)
+
+
+@statistics_bp.route('/cache', methods=['DELETE'])
+@jwt_required()
+def bust_stats_cache():
+    current_user_id = get_jwt_identity()
+    current_user = User.query.get(current_user_id)
+
+    # 检查是否是管理员
+    if not current_user or current_user.privilege != 1:
+        return jsonify({'message': '权限不足'}), 403
+
+    try:
+        bump_counter(STATS_CACHE_VERSION)
+        db.session.commit()
+        stats_cache.clear()
+        if current_app.config.get('STATS_CACHE_SHARED'):
+            clear_shared()
+        return jsonify({'message': '统计缓存已清除'}), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': '清除统计缓存失败', 'error': str(e)}), 500
@@ -0,0 +1,75 @@
+import os
+import sys
+import tempfile
+from datetime import datetime
+
+# 测试使用临时SQLite数据库，须在导入app之前设置
+_db_dir = tempfile.mkdtemp()
+os.environ['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(_db_dir, 'test.db')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest  # noqa: E402
+from flask_jwt_extended import create_access_token  # noqa: E402
+from sqlalchemy import event  # noqa: E402
+from werkzeug.security import generate_password_hash  # noqa: E402
+from app import app as flask_app  # noqa: E402
+from database import db  # noqa: E402
+from models import Book, Borrow, User  # noqa: E402
+
+
+@pytest.fixture
+def app():
+    # 每个测试使用新建的空表
+    flask_app.config['TESTING'] = True
+    with flask_app.app_context():
+        db.create_all()
+        yield flask_app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def statements(app):
+    # 记录执行的SQL语句
+    executed = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        executed.append(statement)
+    event.listen(db.engine, 'before_cursor_execute', record)
+    yield executed
+    event.remove(db.engine, 'before_cursor_execute', record)
+
+
+def make_user(username, privilege=0):
+    user = User(username=username, email=f'{username}@example.com',
+                phone=str(13800000000 + User.query.count()), password=generate_password_hash('password'),
+                name=username, sex=0, privilege=privilege, status=0,
+                # 早于令牌签发时间，避免被当作改过密码的旧令牌
+                password_updated_at=datetime(2000, 1, 1))
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+def make_book(name, category='科幻', stock=5):
+    book = Book(name=name, author='作者', publisher='出版社', category=category,
+                ISBN=str(9787000000000 + Book.query.count()), stock=stock)
+    db.session.add(book)
+    db.session.commit()
+    return book
+
+
+def make_borrow(user, book, borrow_time, due_at, return_time=None):
+    borrow = Borrow(user_id=user.id, book_id=book.id, borrow_time=borrow_time, due_at=due_at,
+                    return_time=return_time, status=0 if return_time is None else 1)
+    db.session.add(borrow)
+    return borrow
+
+
+def auth_headers(user):
+    return {'Authorization': 'Bearer ' + create_access_token(identity=str(user.id))}
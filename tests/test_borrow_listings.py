@@ -0,0 +1,58 @@
+from datetime import datetime, timedelta
+import pytest
+from database import db
+from conftest import auth_headers, make_book, make_borrow, make_user
+
+# 借阅列表接口：每页条数不同时执行的SQL语句数相同(没有逐行查询图书/用户)
+
+
+@pytest.fixture
+def seeded(app):
+    admin = make_user('admin', privilege=1)
+    reader = make_user('reader')
+    other = make_user('other')
+    books = [make_book(f'书{i}') for i in range(10)]
+    now = datetime.now()
+    for i in range(60):
+        borrow_time = now - timedelta(days=60 - i)
+        book = books[i % len(books)]
+        if i % 3 == 0:
+            # 已归还
+            make_borrow(reader, book, borrow_time, borrow_time + timedelta(days=14),
+                        return_time=borrow_time + timedelta(days=7))
+        else:
+            # 借阅中，较早的已逾期
+            make_borrow(reader, book, borrow_time, borrow_time + timedelta(days=14))
+        make_borrow(other, book, borrow_time, borrow_time + timedelta(days=14))
+    # 已删除图书的借阅不出现在列表中
+    books[0].deleted_at = now
+    db.session.commit()
+    return admin, reader
+
+
+def _count_statements(client, statements, url, user):
+    headers = auth_headers(user)
+    statements.clear()
+    response = client.get(url, headers=headers)
+    assert response.status_code == 200
+    return len(statements), response.get_json()
+
+
+@pytest.mark.parametrize('url, items_key, as_admin', [
+    ('/api/borrows/', 'borrows', False),
+    ('/api/borrows/overdue', 'overdue_borrows', False),
+    ('/api/borrows/all', 'borrows', True),
+])
+def test_statement_count_independent_of_page_size(client, statements, seeded, url, items_key, as_admin):
+    admin, reader = seeded
+    user = admin if as_admin else reader
+
+    small_count, small = _count_statements(client, statements, f'{url}?per_page=1', user)
+    large_count, large = _count_statements(client, statements, f'{url}?per_page=50', user)
+
+    assert len(small[items_key]) == 1
+    # 已删除的图书在SQL中过滤，整页不缺条
+    assert len(large[items_key]) == min(large['total'], 50)
+    assert large['total'] > 1
+    assert small_count == large_count
+    assert all(borrow['book_id'] != 1 for borrow in large[items_key])
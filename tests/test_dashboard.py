@@ -0,0 +1,37 @@
+from datetime import datetime, time, timedelta
+from database import db
+from conftest import auth_headers, make_book, make_borrow, make_user
+
+# 读者首页：整个请求3条SQL(黑名单、用户、在借图书)，逾期天数按自然日计
+
+
+def test_dashboard_statements_and_calendar_overdue(client, statements):
+    reader = make_user('reader')
+    now = datetime.now()
+    today = datetime.combine(now.date(), time.min)
+    dues = [
+        today,  # 今天零点到期：已过应还时间，但到期当天不算逾期
+        today - timedelta(seconds=1),  # 昨天23:59:59到期：逾期1天
+        today - timedelta(days=3, hours=-20),  # 3天前20点到期：逾期3天
+        today + timedelta(days=2, hours=9),  # 后天到期
+    ]
+    for i, due_at in enumerate(dues):
+        make_borrow(reader, make_book(f'书{i}'), due_at - timedelta(days=14), due_at)
+    db.session.commit()
+    reader.active_borrows = len(dues)
+    db.session.commit()
+
+    headers = auth_headers(reader)
+    # 请求与测试共用会话，先清空identity map，按请求中实际的加载过程计数
+    db.session.expunge_all()
+    statements.clear()
+    response = client.get('/api/me/dashboard', headers=headers)
+    assert response.status_code == 200
+    assert len(statements) == 3
+
+    data = response.get_json()
+    active = {item['book_name']: item for item in data['active_borrows']}
+    assert [(active[f'书{i}']['is_overdue'], active[f'书{i}']['days_left']) for i in range(4)] == [
+        (False, 0), (True, -1), (True, -3), (False, 2)]
+    assert {item['book_name']: item['overdue_days'] for item in data['overdue_borrows']} == {'书1': 1, '书2': 3}
+    assert data['counts']['overdue_borrows'] == 2
@@ -0,0 +1,90 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from sqlalchemy import text
+import fanout
+from fanout import QueryTimeout, fan_out
+
+# 并发查询：超时按每条查询开始执行起计时，超时/出错时取消未开始的查询并中断执行中的查询
+
+# SQLite上执行数秒的查询，用于验证数据库端中断
+SLOW_QUERY = text('WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c WHERE x < 200000000) '
+                  'SELECT count(*) FROM c')
+
+
+@pytest.fixture
+def executor(monkeypatch):
+    # 每个测试使用独立的小线程池，模拟多个请求争用共用线程池
+    pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix='query-fanout-test')
+    monkeypatch.setattr(fanout, '_executor', pool)
+    yield pool
+    pool.shutdown(wait=True, cancel_futures=True)
+
+
+def _sleep(seconds, value):
+    def fetch(conn):
+        time.sleep(seconds)
+        return value
+    return fetch
+
+
+def test_queue_wait_does_not_count_against_deadline(app, executor):
+    # 4个请求各3条0.2秒的查询共用2个线程：最后一批要排队约1秒，但每条执行都远小于超时时间
+    results = []
+    errors = []
+
+    def request():
+        with app.app_context():
+            try:
+                results.append(fan_out({f'q{i}': _sleep(0.2, i) for i in range(3)}, timeout=0.5))
+            except Exception as e:
+                errors.append(e)
+    threads = [threading.Thread(target=request) for _ in range(4)]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert results == [{'q0': 0, 'q1': 1, 'q2': 2}] * 4
+    assert time.monotonic() - started >= 1.0
+
+
+def test_timeout_interrupts_running_and_cancels_queued(app, executor):
+    ran = []
+
+    def record(conn):
+        ran.append(True)
+        return conn.execute(text('SELECT 1')).scalar()
+
+    started = time.monotonic()
+    with pytest.raises(QueryTimeout) as excinfo:
+        fan_out({'slow': lambda conn: conn.execute(SLOW_QUERY).scalar(),
+                 'slow2': lambda conn: conn.execute(SLOW_QUERY).scalar(),
+                 'queued1': record, 'queued2': record}, timeout=0.3)
+    assert time.monotonic() - started < 2
+    assert 'slow' in str(excinfo.value)
+
+    # 执行中的查询已在数据库端中断，排队的查询不再执行，线程池立即可用
+    started = time.monotonic()
+    assert fan_out({'fast': lambda conn: conn.execute(text('SELECT 1')).scalar()}, timeout=1) == {'fast': 1}
+    assert time.monotonic() - started < 0.5
+    assert ran == []
+
+
+def test_error_cancels_remaining(app, executor):
+    ran = []
+
+    def fail(conn):
+        raise ValueError('查询出错')
+
+    def record(conn):
+        ran.append(True)
+
+    with pytest.raises(ValueError):
+        fan_out({'a_fail': fail, 'b_slow': lambda conn: conn.execute(SLOW_QUERY).scalar(),
+                 'c_queued': record, 'd_queued': record}, timeout=5)
+    executor.submit(lambda: None).result(timeout=2)
+    assert ran == []
@@ -0,0 +1,35 @@
+import json
+import inventory
+from database import db
+from models import Book
+from conftest import auth_headers, make_book, make_user
+
+# 库存盘点：某一块失败时返回已提交部分的报告和失败块的行号范围
+
+
+def test_failed_chunk_reports_committed_rows(client, monkeypatch):
+    admin = make_user('admin', privilege=1)
+    books = [make_book(f'书{i}', stock=5) for i in range(5)]
+    body = '\n'.join(json.dumps({'book_id': book.id, 'stock': 7}) for book in books)
+    headers = auth_headers(admin)
+
+    reconcile_chunk = inventory._reconcile_chunk
+
+    def fail_on_line_3(chunk):
+        if any(line == 3 for line, raw in chunk):
+            raise RuntimeError('数据库连接中断')
+        return reconcile_chunk(chunk)
+    monkeypatch.setattr(inventory, '_reconcile_chunk', fail_on_line_3)
+
+    response = client.post('/api/inventory/reconcile?chunk_size=2', data=body,
+                           headers=headers, content_type='application/x-ndjson')
+    assert response.status_code == 500
+    data = response.get_json()
+    assert data['failed_lines'] == {'from': 3, 'to': 4}
+    assert data['error'] == '数据库连接中断'
+    assert [row['line'] for row in data['report']] == [1, 2]
+    assert data['summary']['updated'] == 2
+
+    # 失败块之前的块已提交，失败块及之后的条目未生效
+    db.session.expire_all()
+    assert [db.session.get(Book, book.id).stock for book in books] == [7, 7, 5, 5, 5]
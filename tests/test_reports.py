@@ -0,0 +1,117 @@
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import func
+from database import db
+from models import Borrow, BorrowArchive
+from archive import borrow_history
+from reports import book_report_columns, format_book_report, format_user_report, user_report_columns
+from sql_funcs import days_between
+from conftest import make_book, make_borrow, make_user
+
+# 用户/图书报表：条件聚合的结果与原来逐项COUNT查询的结果一致
+
+
+@pytest.fixture
+def seeded(app):
+    now = datetime.now()
+    users = [make_user(f'reader{i}') for i in range(3)]
+    books = [make_book(f'书{i}') for i in range(3)]
+    day = timedelta(days=1)
+    for i, user in enumerate(users):
+        for j, book in enumerate(books):
+            start = now - (30 + i * 3 + j) * day
+            # 按期归还
+            make_borrow(user, book, start, start + 14 * day, return_time=start + 10 * day)
+            # 逾期归还
+            make_borrow(user, book, start, start + 14 * day, return_time=start + (17 + i) * day)
+            # 借阅中，已逾期
+            make_borrow(user, book, now - (20 + j) * day, now - (6 + j) * day)
+        # 借阅中，未到期
+        make_borrow(user, books[i], now - 2 * day, now + 12 * day)
+        # 深夜借、次日凌晨还：时长按自然日计为1天
+        late_night = datetime.combine(now.date() - 40 * day, datetime.min.time()) + timedelta(hours=23)
+        make_borrow(user, books[i], late_night, late_night + 14 * day, return_time=late_night + 2 * timedelta(hours=1))
+        # 已删除的记录不计入
+        deleted = make_borrow(user, books[i], now - 3 * day, now - 1 * day)
+        deleted.deleted_at = now
+    # 已归档的记录同样计入
+    for k, (user, book) in enumerate([(users[0], books[1]), (users[2], books[0])]):
+        start = now - (400 + k) * day
+        db.session.add(BorrowArchive(id=10000 + k, user_id=user.id, book_id=book.id, borrow_time=start,
+                                     return_time=start + (20 + k) * day, due_at=start + 14 * day,
+                                     status=1, archived_at=now))
+    db.session.commit()
+    return users, books, now
+
+
+def _old_user_counts(user_id, now):
+    # 原实现：每项一条COUNT查询，当前逾期只查在线表
+    history = borrow_history(user_id=user_id)
+    total_borrows = db.session.query(func.count(history.c.id)).filter(
+        history.c.deleted_at == None).scalar()
+    returned_borrows = db.session.query(func.count(history.c.id)).filter(
+        history.c.status == 1, history.c.deleted_at == None).scalar()
+    overdue_borrows = db.session.query(func.count(history.c.id)).filter(
+        history.c.status == 1, history.c.return_time > history.c.due_at,
+        history.c.deleted_at == None).scalar()
+    current_overdue_borrows = db.session.query(func.count(Borrow.id)).filter(
+        Borrow.user_id == user_id, Borrow.status == 0, Borrow.due_at < now,
+        Borrow.deleted_at == None).scalar()
+    overdue_rate = 0
+    if returned_borrows > 0:
+        overdue_rate = round((overdue_borrows / returned_borrows) * 100, 2)
+    return {
+        'total_borrows': total_borrows,
+        'returned_borrows': returned_borrows,
+        'overdue_borrows': overdue_borrows + current_overdue_borrows,
+        'current_overdue_borrows': current_overdue_borrows,
+        'overdue_rate': overdue_rate
+    }
+
+
+def _old_book_counts(book_id):
+    # 原实现：每项一条聚合查询，平均时长为DATEDIFF(按自然日)的平均值
+    history = borrow_history(book_id=book_id)
+    total_borrows = db.session.query(func.count(history.c.id)).filter(
+        history.c.deleted_at == None).scalar()
+    returned_borrows = db.session.query(func.count(history.c.id)).filter(
+        history.c.status == 1, history.c.deleted_at == None).scalar()
+    current_borrows = db.session.query(func.count(Borrow.id)).filter(
+        Borrow.book_id == book_id, Borrow.status == 0, Borrow.deleted_at == None).scalar()
+    avg_borrow_days = 0
+    if returned_borrows > 0:
+        avg_days = db.session.query(
+            func.avg(days_between(history.c.return_time, history.c.borrow_time))
+        ).filter(history.c.status == 1, history.c.deleted_at == None).scalar()
+        if avg_days is not None:
+            avg_borrow_days = round(float(avg_days), 2)
+    return {
+        'total_borrows': total_borrows,
+        'returned_borrows': returned_borrows,
+        'current_borrows': current_borrows,
+        'avg_borrow_days': avg_borrow_days
+    }
+
+
+def test_user_report_matches_separate_counts(seeded):
+    users, books, now = seeded
+    for user in users:
+        history = borrow_history(user_id=user.id)
+        counts = db.session.query(*user_report_columns(history, now)).filter(
+            history.c.deleted_at == None).one()
+        report = format_user_report(user, counts, [], now)
+        expected = _old_user_counts(user.id, now)
+        assert {key: report[key] for key in expected} == expected
+        assert expected['current_overdue_borrows'] == len(books)
+
+
+def test_book_report_matches_separate_counts(seeded):
+    users, books, now = seeded
+    for book in books:
+        history = borrow_history(book_id=book.id)
+        counts = db.session.query(*book_report_columns(history)).filter(
+            history.c.deleted_at == None).one()
+        report = format_book_report(book, book.stock, counts, [], [], None)
+        expected = _old_book_counts(book.id)
+        assert {key: report[key] for key in expected} == expected
+        assert expected['avg_borrow_days'] > 0
@@ -0,0 +1,34 @@
+from datetime import datetime, timedelta
+from database import db
+from rollups import rebuild_rollups
+from statistics import _system_overview
+from conftest import make_book, make_borrow, make_user
+
+# 系统概览：统计表未全量重建时从借阅历史统计，重建后读取统计表，两者结果一致
+
+
+def test_overview_falls_back_to_history_until_rollups_rebuilt(app):
+    now = datetime.now()
+    users = [make_user(f'reader{i}') for i in range(3)]
+    books = [make_book(f'书{i}', category=['科幻', '历史'][i % 2]) for i in range(4)]
+    for i in range(20):
+        borrow_time = now - timedelta(days=i * 3, hours=1)
+        make_borrow(users[i % 3], books[i % 4], borrow_time, borrow_time + timedelta(days=14),
+                    return_time=borrow_time + timedelta(hours=30) if i > 2 else None)
+    db.session.commit()
+
+    before = {days: _system_overview(days) for days in (None, 7, 30)}
+    for overview in before.values():
+        assert overview['source'] == 'borrow'
+        assert overview['coverage_start'] is None
+    assert before[None]['total_borrows'] == 20
+    assert before[7]['total_borrows'] == 3
+
+    rebuild_rollups()
+    for days, expected in before.items():
+        overview = _system_overview(days)
+        assert overview['source'] == 'rollup'
+        assert overview['coverage_start'] is not None
+        overview.pop('source'), overview.pop('coverage_start')
+        expected.pop('source'), expected.pop('coverage_start')
+        assert overview == expected
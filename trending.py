@@ -0,0 +1,265 @@
+import json
+from datetime import datetime, timedelta
+import click
+from flask import Blueprint, jsonify, request, current_app
+from flask_jwt_extended import jwt_required
+from sqlalchemy import delete, select
+from database import db
+from models import Book, Borrow, TrendingSketch
+from sketches import BufferedSketchTracker, rebuild_sketch_rows
+
+# 创建trending蓝图
+trending_bp = Blueprint('trending', __name__)
+
+# 默认每个摘要保留的图书数，可通过配置项TRENDING_CAPACITY覆盖
+DEFAULT_CAPACITY = 200
+# 默认合并写入数据库的间隔(秒)，可通过配置项TRENDING_FLUSH_SECONDS覆盖
+DEFAULT_FLUSH_SECONDS = 60
+# 统计窗口：(时间桶粒度, 桶数)
+TRENDING_WINDOWS = {'24h': ('hour', 24), '7d': ('day', 7), '30d': ('day', 30)}
+# 各粒度保留的时间桶数
+RETAINED_BUCKETS = {'hour': 24, 'day': 30}
+
+
+def _bucket_start(when, granularity):
+    if granularity == 'hour':
+        return when.replace(minute=0, second=0, microsecond=0)
+    return when.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _bucket_step(granularity):
+    return timedelta(hours=1) if granularity == 'hour' else timedelta(days=1)
+
+
+class SpaceSaving:
+    # Space-Saving摘要：最多保存capacity个计数，满了之后新元素替换计数最小的元素并继承其计数(记为误差)
+    # 计数相同的元素放在同一个桶里，单次加一为O(1)
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = {}  # key -> 计数(可能偏大，偏大量不超过误差)
+        self.errors = {}  # key -> 误差上限
+        self._buckets = {}  # 计数 -> 该计数的key集合
+        self._min = 0
+
+    def _move(self, key, old, new):
+        if old:
+            keys = self._buckets[old]
+            keys.discard(key)
+            if not keys:
+                del self._buckets[old]
+        self._buckets.setdefault(new, set()).add(key)
+        self.counts[key] = new
+
+    def add(self, key):
+        count = self.counts.get(key)
+        if count is None:
+            if len(self.counts) < self.capacity:
+                self.errors[key] = 0
+                self._move(key, 0, 1)
+                self._min = 1
+                return
+            # 替换计数最小的元素
+            count = self._min
+            evicted = next(iter(self._buckets[count]))
+            self._buckets[count].discard(evicted)
+            del self.counts[evicted]
+            del self.errors[evicted]
+            self.errors[key] = count
+            self.counts[key] = count
+            self._buckets[count].add(key)
+        self._move(key, count, count + 1)
+        if count == self._min and count not in self._buckets:
+            self._min = count + 1
+
+    @property
+    def floor(self):
+        # 未被保存的元素的计数上限(摘要未满时为0)
+        return self._min if len(self.counts) >= self.capacity else 0
+
+    def top(self, n):
+        return sorted(self.counts.items(), key=lambda item: (-item[1], item[0]))[:n]
+
+    @classmethod
+    def merge(cls, capacity, summaries):
+        # 合并多个摘要：同一元素计数相加；某摘要中没有的元素按该摘要的floor计入误差，最后保留最大的capacity个
+        summaries = [s for s in summaries if s.counts]
+        merged = cls(capacity)
+        if not summaries:
+            return merged
+        keys = set().union(*(s.counts for s in summaries))
+        totals = []
+        for key in keys:
+            count = error = 0
+            for s in summaries:
+                if key in s.counts:
+                    count += s.counts[key]
+                    error += s.errors[key]
+                else:
+                    count += s.floor
+                    error += s.floor
+            totals.append((count, error, key))
+        totals.sort(key=lambda item: (-item[0], item[2]))
+        for count, error, key in totals[:capacity]:
+            merged.counts[key] = count
+            merged.errors[key] = error
+            merged._buckets.setdefault(count, set()).add(key)
+        merged._min = min(merged._buckets)
+        return merged
+
+    def to_json(self):
+        return json.dumps([[key, count, self.errors[key]] for key, count in self.counts.items()])
+
+    @classmethod
+    def from_json(cls, capacity, payload):
+        summary = cls(capacity)
+        for key, count, error in json.loads(payload):
+            summary.counts[key] = count
+            summary.errors[key] = error
+            summary._buckets.setdefault(count, set()).add(key)
+        if summary._buckets:
+            summary._min = min(summary._buckets)
+        return summary
+
+
+def _capacity():
+    return current_app.config.get('TRENDING_CAPACITY', DEFAULT_CAPACITY)
+
+
+def _borrow_entries(book_ids):
+    # 每次借阅计入当前小时和当天的时间桶
+    now = datetime.now()
+    buckets = [(granularity, _bucket_start(now, granularity)) for granularity in RETAINED_BUCKETS]
+    return [(bucket, book_id) for book_id in book_ids for bucket in buckets]
+
+
+def _merge_summaries(first, second):
+    return SpaceSaving.merge(_capacity(), [first, second])
+
+
+def _upsert_sketch(bucket, summary):
+    # 锁定时间桶的摘要行后合并写回(不提交事务)
+    granularity, bucket_start = bucket
+    row = db.session.query(TrendingSketch).filter_by(
+        granularity=granularity, bucket_start=bucket_start).with_for_update().first()
+    if row is None:
+        db.session.add(TrendingSketch(granularity=granularity, bucket_start=bucket_start,
+                                      payload=summary.to_json()))
+    else:
+        stored = SpaceSaving.from_json(_capacity(), row.payload)
+        row.payload = _merge_summaries(stored, summary).to_json()
+
+
+def _delete_expired():
+    # 删除过期的时间桶
+    now = datetime.now()
+    for granularity, retained in RETAINED_BUCKETS.items():
+        oldest = _bucket_start(now, granularity) - _bucket_step(granularity) * (retained - 1)
+        db.session.execute(delete(TrendingSketch).where(
+            TrendingSketch.granularity == granularity,
+            TrendingSketch.bucket_start < oldest))
+
+
+# 进程内的增量摘要(按小时和按天各一组)
+tracker = BufferedSketchTracker(
+    'trending', 'TRENDING_FLUSH_SECONDS', DEFAULT_FLUSH_SECONDS,
+    entries=_borrow_entries,
+    new_sketch=lambda: SpaceSaving(_capacity()),
+    merge=_merge_summaries,
+    upsert_row=_upsert_sketch,
+    cleanup=_delete_expired)
+
+# 借阅时记录(暂存在会话中，提交成功后计入摘要，回滚时丢弃)
+
+
+def track_borrow(book_id):
+    tracker.record(book_id)
+
+# 查询窗口内的热门图书：合并数据库中的时间桶摘要和本进程尚未写入的增量
+
+
+def trending_books(window):
+    granularity, buckets = TRENDING_WINDOWS[window]
+    capacity = _capacity()
+    oldest = _bucket_start(datetime.now(), granularity) - _bucket_step(granularity) * (buckets - 1)
+
+    summaries = [SpaceSaving.from_json(capacity, row.payload) for row in db.session.query(
+        TrendingSketch.payload).filter(
+        TrendingSketch.granularity == granularity,
+        TrendingSketch.bucket_start >= oldest
+    ).all()]
+    # 本进程尚未写入的增量(在锁内合并成副本)
+    summaries.append(tracker.read_pending(lambda pending: SpaceSaving.merge(capacity, [
+        summary for (g, bucket_start), summary in pending.items()
+        if g == granularity and bucket_start >= oldest])))
+    return SpaceSaving.merge(capacity, summaries)
+
+# 按借阅记录重建最近30天的摘要(首次上线或数据库中的摘要丢失时使用)
+
+
+def rebuild_sketches():
+    now = datetime.now()
+    since = _bucket_start(now, 'day') - timedelta(days=RETAINED_BUCKETS['day'] - 1)
+    hour_since = _bucket_start(now, 'hour') - timedelta(hours=RETAINED_BUCKETS['hour'] - 1)
+
+    def entries(row):
+        for granularity in RETAINED_BUCKETS:
+            if granularity == 'hour' and row.borrow_time < hour_since:
+                continue
+            yield (granularity, _bucket_start(row.borrow_time, granularity)), row.book_id
+
+    summaries = rebuild_sketch_rows(
+        select(Borrow.borrow_time, Borrow.book_id).where(
+            Borrow.borrow_time >= since, Borrow.deleted_at == None),
+        entries,
+        new_sketch=lambda: SpaceSaving(_capacity()),
+        clear=delete(TrendingSketch),
+        to_row=lambda bucket, summary: TrendingSketch(
+            granularity=bucket[0], bucket_start=bucket[1], payload=summary.to_json()))
+    return len(summaries)
+
+# 热门图书(最近24小时/7天/30天)
+
+
+@trending_bp.route('/books', methods=['GET'])
+@jwt_required()
+def get_trending_books():
+    window = request.args.get('window', '7d')
+    if window not in TRENDING_WINDOWS:
+        return jsonify({'message': '统计窗口必须是24h、7d或30d'}), 400
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 50)
+
+    try:
+        summary = trending_books(window)
+        # 多取一些候选，过滤已删除的图书后仍能凑满
+        candidates = summary.top(limit * 2)
+        books = {book.id: book for book in Book.query.filter(
+            Book.id.in_([book_id for book_id, count in candidates]),
+            Book.deleted_at == None
+        ).all()} if candidates else {}
+
+        trending_list = []
+        for book_id, count in candidates:
+            book = books.get(book_id)
+            if not book:
+                continue
+            trending_list.append({
+                'book_id': book.id,
+                'name': book.name,
+                'author': book.author,
+                'borrow_count': count,  # 估计值，偏大量不超过error
+                'error': summary.errors[book_id]
+            })
+            if len(trending_list) >= limit:
+                break
+
+        return jsonify({'window': window, 'books': trending_list}), 200
+    except Exception as e:
+        return jsonify({'message': '获取热门图书失败', 'error': str(e)}), 500
+
+# 命令行：按借阅记录重建热门图书摘要(首次上线时回填)
+
+
+@trending_bp.cli.command('rebuild')
+def rebuild_command():
+    """按最近30天的借阅记录重建热门图书摘要"""
+    click.echo(f'已重建 {rebuild_sketches()} 个时间桶的热门图书摘要')